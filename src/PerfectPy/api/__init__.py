@@ -5,12 +5,19 @@ from __future__ import unicode_literals, generators, division, absolute_import,
 import logging
 import sys
 import os
+import httplib
 import urllib2
+import urlparse
 from urllib import urlencode
 #import urllib
 import json
+import re
 #import base64
 import time
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from Queue import Queue, Empty
 
 TRACE = 5
 
@@ -120,7 +127,7 @@ class APIClient:
             dict -- Server response data
         """
         log.trace("send_get  '%s'" % uri)
-        return self.__send_request('GET', uri, None, None)
+        return self.__send_request('GET', uri, None)
 
     def send_post(self, uri, data):
         """
@@ -133,14 +140,207 @@ class APIClient:
             uri {string} -- The API method to call including parameters
                             (e.g. add_case/1)
             data {dict} --  The data to submit as part of the request (as
-                            Python dict, strings must be UTF-8 encoded)
+                            Python dict, strings must be UTF-8 encoded), or an
+                            open file, which is streamed instead of read into memory.
 
         Returns:
             dict -- response data
         """
-        log.trace("send_post '%s', data length = '%s'" % (uri, len(data)))
+        log.trace("send_post '%s', data length = '%s'" % (uri, _length(data)))
         return self.__send_request('POST', uri, data)
 
+    def send_post_chunks(self, uri, chunks, contentType="application/octet-stream"):
+        """
+        Issues a POST request whose body is produced piece by piece and sent with
+        chunked transfer encoding, so it never has to be held in memory or
+        measured up front.
+
+        Arguments:
+            uri {string} -- The API method to call including parameters
+            chunks {iterable} -- the body as byte strings, for example a generator
+
+        Keyword Arguments:
+            contentType {str} -- Content-Type of the body. (default: {"application/octet-stream"})
+
+        Returns:
+            dict -- response data
+
+        Raises:
+            APIError -- Any error responses get raised as exceptions
+        """
+        log.trace("send_post_chunks '%s'" % uri)
+        url = self.__build_url(uri)
+        log.debug("Request URL is '%s'" % url)
+        parts = urlparse.urlsplit(url)
+        connectionClass = httplib.HTTPSConnection if parts.scheme == "https" else httplib.HTTPConnection
+        connection = connectionClass(parts.netloc)
+        sent = 0
+        try:
+            connection.putrequest("POST", parts.path + ("?" + parts.query if parts.query else ""))
+            connection.putheader("Content-Type", contentType)
+            connection.putheader("Transfer-Encoding", "chunked")
+            connection.endheaders()
+            for chunk in chunks:
+                if isinstance(chunk, unicode):
+                    chunk = chunk.encode("utf-8")
+                if chunk:
+                    connection.send(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                    sent += len(chunk)
+            connection.send(b"0\r\n\r\n")
+            response = connection.getresponse()
+            body = response.read()
+        finally:
+            connection.close()
+        log.debug("sent '%s' bytes, HTTP '%s'" % (sent, response.status))
+        if response.status >= 400:
+            log.error("Error sending request because HTTP '%s'\n%s" % (response.status, body))
+        return self.__parse_response(body, response.status if response.status >= 400 else None)
+
+    def send_get_raw(self, uri, output=None, chunkSize=64 * 1024):
+        """
+        Issues a GET request and returns the response body as is, without
+        parsing it. Use it for binary downloads such as report attachments.
+
+        Arguments:
+            uri {string} -- The API method to call including parameters
+
+        Keyword Arguments:
+            output {file} -- When given, the body is streamed into this file
+                             object chunk by chunk instead of being returned.
+                             (default: {None})
+            chunkSize {int} -- Bytes read per chunk while streaming. (default: {64 KiB})
+
+        Returns:
+            bytes or int -- The body, or the number of bytes written to output.
+
+        Raises:
+            APIError -- Any error responses get raised as exceptions
+        """
+        log.trace("send_get_raw '%s'" % uri)
+        response = self.__open(uri)
+        try:
+            if output is None:
+                return response.read()
+            return self.__copy(response, output, chunkSize)
+        finally:
+            response.close()
+
+    def send_get_stream(self, uri):
+        """
+        Issues a GET request and returns the open response, a file-like object the
+        caller reads the body from and must close.
+
+        Raises:
+            APIError -- Any error responses get raised as exceptions
+        """
+        log.trace("send_get_stream '%s'" % uri)
+        return self.__open(uri)
+
+    def send_get_range(self, uri, start=0, end=None, output=None, chunkSize=64 * 1024):
+        """
+        Issues a GET request for part of a response body using an HTTP Range header.
+
+        Arguments:
+            uri {string} -- The API method to call including parameters
+
+        Keyword Arguments:
+            start {int} -- First byte offset. A negative start asks for the last
+                           -start bytes, like a Python slice. (default: {0})
+            end {int} -- Last byte offset, inclusive; None reads to the end. (default: {None})
+            output {file} -- When given, the body is streamed into this file object. (default: {None})
+            chunkSize {int} -- Bytes read per chunk while streaming. (default: {64 KiB})
+
+        Returns:
+            dict -- "partial" (False when the server ignored the range; the
+                    requested bytes are then cut from the whole body), "start" and
+                    "end" of the bytes delivered, "total" size (None when unknown),
+                    and "body" or, with output, "size".
+
+        Raises:
+            APIError -- Any error responses get raised as exceptions
+        """
+        log.trace("send_get_range '%s' '%s'-'%s'" % (uri, start, end))
+        if start < 0:
+            byteRange = "bytes=%d" % start
+        else:
+            byteRange = "bytes=%d-%s" % (start, "" if end is None else end)
+        response = self.__open(uri, {"Range": byteRange})
+        try:
+            info = {"partial": False, "start": 0, "end": None, "total": None}
+            match = re.match(r"bytes\s+(\d+)-(\d+)/(\d+|\*)", response.info().getheader("Content-Range") or "")
+            skip, limit = 0, None
+            if response.getcode() == 206 and match:
+                info["partial"] = True
+                info["start"], info["end"] = int(match.group(1)), int(match.group(2))
+                if match.group(3) != "*":
+                    info["total"] = int(match.group(3))
+            else:
+                length = response.info().getheader("Content-Length")
+                info["total"] = int(length) if length else None
+                if start < 0 and info["total"] is None:
+                    body = response.read()
+                    info["total"] = len(body)
+                    response = _Body(body)
+                if start < 0:
+                    skip = max(0, info["total"] + start)
+                else:
+                    skip = start
+                    limit = None if end is None else end - start + 1
+                log.warn("server ignored the range request, skipping '%s' bytes locally" % skip)
+                info["start"] = skip
+            if output is None:
+                collected = _Body()
+                info["size"] = self.__copy(response, collected, chunkSize, skip, limit)
+                info["body"] = collected.getvalue()
+            else:
+                info["size"] = self.__copy(response, output, chunkSize, skip, limit)
+            info["end"] = info["start"] + info["size"] - 1
+            return info
+        finally:
+            response.close()
+
+    def probe_range(self, uri):
+        """
+        Ask for the first byte of a response to learn its total size and whether
+        the server honours Range requests.
+
+        Returns:
+            tuple -- (total or None, supportsRanges)
+        """
+        info = self.send_get_range(uri, 0, 0)
+        return info["total"], info["partial"]
+
+    def __open(self, uri, headers=None):
+        url = self.__build_url(uri)
+        log.debug("Request URL is '%s'" % url)
+        request = urllib2.Request(url)
+        for (name, value) in (headers or {}).items():
+            request.add_header(name, value)
+        try:
+            return urllib2.urlopen(request)
+        except urllib2.HTTPError as e:
+            body = e.read()
+            log.error("Error sending request because '%s'\n%s" % (e.message, body))
+            raise APIError('REST API returned HTTP %s (%s)' % (e.code, body or 'No additional error message received'))
+
+    def __copy(self, response, output, chunkSize, skip=0, limit=None):
+        written = 0
+        while True:
+            want = chunkSize if limit is None else min(chunkSize, limit - written)
+            if want <= 0:
+                break
+            chunk = response.read(min(want, skip) if skip else want)
+            if not chunk:
+                break
+            if skip:
+                skip -= len(chunk)
+                continue
+            output.write(chunk)
+            written += len(chunk)
+        return written
+
+    def __build_url(self, uri):
+        return (self.__url + uri + "&" + urlencode({self.__securityKeyStr: self.__securityToken})).encode('ascii', "ignore")
 
     def __send_request(self, method, uri, data):
         """
@@ -157,8 +357,8 @@ class APIClient:
         Raises:
             APIError -- Any error responses get raised as exceptions
         """
-        log.trace("__send_request  '%s', '%s', data length is '%s'" % (method, uri, len(data) if data else 0))
-        url = (self.__url + uri + "&" + urlencode({self.__securityKeyStr: self.__securityToken})).encode('ascii', "ignore")
+        log.trace("__send_request  '%s', '%s', data length is '%s'" % (method, uri, _length(data)))
+        url = self.__build_url(uri)
         log.debug("Request URL is '%s'" % url)
         request = urllib2.Request(url, data if data else None)
         #TODO: Fix post handling
@@ -167,7 +367,7 @@ class APIClient:
             #log.debug("auth = '%s'" % auth)
             #request.add_header('Authorization', 'Basic %s' % auth)
             request.add_header("Content-Type", "application/octet-stream")
-            request.add_header("Content-Length", str(len(data)))
+            request.add_header("Content-Length", str(_length(data)))
             #request.add_header("Content-Encoding", "base64")
 
 
@@ -180,7 +380,12 @@ class APIClient:
             log.error("Error sending request because '%s'\n%s" % (e.message, response))
             log.error(e)
 
+        return self.__parse_response(response, e.code if e is not None else None)
 
+    def __parse_response(self, response, errorCode=None):
+        """
+        Parse a response body as json, or else xml, and raise APIError for error responses.
+        """
         if response:
             try:
                 result = json.loads(response)
@@ -197,12 +402,12 @@ class APIClient:
             log.warn("No reponse received.")
             result = {}
 
-        if e is not None:
+        if errorCode is not None:
             if result and 'error' in result:
                 error = '"' + result['error'] + '"'
             else:
                 error = 'No additional error message received' if not result else '"%s"' % result
-            raise APIError('REST API returned HTTP %s (%s)' % (e.code, error))
+            raise APIError('REST API returned HTTP %s (%s)' % (errorCode, error))
         return result
 
 
@@ -210,6 +415,22 @@ class APIError(Exception):
     pass
 
 
+def _length(data):
+    """Size of a request body given as bytes or as an open file."""
+    if not data:
+        return 0
+    if hasattr(data, "read"):
+        return os.fstat(data.fileno()).st_size - data.tell()
+    return len(data)
+
+
+class _Body(BytesIO):
+    """In-memory stand-in for a response whose body has already been read."""
+
+    def close(self):
+        pass
+
+
 class APIBase:
     """
     Base class for classes accessing the REST API
@@ -239,3 +460,66 @@ def timeMilis(plusSecs=0, plusMins=0, plusHours=0):
         time in milis
     """
     return int(round(time.time() * 1000)) + int(round(plusSecs * 1000)) + int(round(plusMins * 60 * 1000)) + int(round(plusHours * 60 * 60 * 1000))
+
+
+def runConcurrently(func, calls, maxWorkers=8, progress=None):
+    """
+    Run many API calls at once using a bounded pool of worker threads.
+
+    Arguments:
+        func {callable} -- The API method to call for every entry.
+        calls {iterable} -- (key, args, kwargs) tuples. key identifies the
+                            entry in the result map, args and kwargs are
+                            passed to func.
+
+    Keyword Arguments:
+        maxWorkers {int} -- The most calls in flight at the same time. (default: {8})
+        progress {callable} -- Called as progress(key, outcome, done, total)
+                               each time a call finishes. (default: {None})
+
+    Returns:
+        OrderedDict -- key -> {"success": bool, "result": response} or
+                       {"success": False, "error": message}, in the order
+                       the calls were given.
+    """
+    calls = list(calls)
+    total = len(calls)
+    results = OrderedDict((key, None) for (key, args, kwargs) in calls)
+    if not calls:
+        return results
+    pending = Queue()
+    for call in calls:
+        pending.put(call)
+    lock = threading.Lock()
+    done = [0]
+
+    def worker():
+        while True:
+            try:
+                key, args, kwargs = pending.get_nowait()
+            except Empty:
+                return
+            try:
+                outcome = {"success": True, "result": func(*args, **kwargs)}
+            except Exception as e:
+                log.error("concurrent call for '%s' failed because '%s'" % (key, e.message))
+                outcome = {"success": False, "error": e.message}
+            with lock:
+                results[key] = outcome
+                done[0] += 1
+                finished = done[0]
+            log.debug("'%s' finished, %s of %s done" % (key, finished, total))
+            if progress:
+                try:
+                    progress(key, outcome, finished, total)
+                except Exception as e:
+                    log.error("progress callback failed because '%s'" % e.message)
+
+    workers = [threading.Thread(target=worker, name="PerfectoWorker-%s" % i)
+               for i in range(max(1, min(maxWorkers, total)))]
+    for t in workers:
+        t.daemon = True
+        t.start()
+    for t in workers:
+        t.join()
+    return results
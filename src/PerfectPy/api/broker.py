@@ -0,0 +1,429 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from .__init__ import log
+from .devices import handsetList
+from collections import OrderedDict
+from contextlib import contextmanager
+import SocketServer
+import itertools
+import json
+import os
+import select
+import socket
+import threading
+import time
+import uuid
+
+
+class DeviceBroker(object):
+    """
+    Local daemon that owns the device inventory and leases devices to worker
+    processes over a Unix socket.
+
+    One poller thread refreshes the inventory with listDevices, so the cloud sees
+    a single client however many workers are running. Workers ask for a device by
+    attributes (any listDevices field, e.g. {"os": "Android", "model": "Pixel 3"}).
+    Requests wait in one FIFO queue per attribute set and the queues are served
+    round robin, so a popular attribute set cannot starve the others. A lease that
+    is not renewed before it expires is taken back and the device is released.
+
+        broker = DeviceBroker(devices, "/tmp/perfecto-broker.sock", os="Android")
+        broker.serve_forever()
+    """
+
+    def __init__(self, devices, socketPath, pollInterval=30, leaseSeconds=300,
+                 releaseOnExpiry=True, admin=False, maxWait=600, **filters):
+        """
+        Arguments:
+            devices {Devices} -- Devices instance used to list and release devices.
+            socketPath {string} -- Path of the Unix socket to listen on.
+
+        Keyword Arguments:
+            pollInterval {number} -- Seconds between inventory refreshes. (default: {30})
+            leaseSeconds {number} -- Default lease length. (default: {300})
+            releaseOnExpiry {bool} -- Call releaseDevice when a lease expires. (default: {True})
+            admin {bool} -- Release devices as admin. (default: {False})
+            maxWait {number} -- Longest a worker request waits for a device, also when
+                                it asks for no timeout. None waits forever. (default: {600})
+            **filters -- listDevices filters that define the inventory.
+        """
+        self.devices = devices
+        self.socketPath = socketPath
+        self.pollInterval = pollInterval
+        self.leaseSeconds = leaseSeconds
+        self.releaseOnExpiry = releaseOnExpiry
+        self.admin = admin
+        self.maxWait = maxWait
+        self.filters = filters
+        self.__inventory = OrderedDict()
+        self.__leases = {}
+        self.__queues = OrderedDict()
+        self.__turn = 0
+        self.__lock = threading.Condition()
+        self.__stop = threading.Event()
+        self.__threads = []
+        self.__server = None
+
+    def refresh(self):
+        """
+        Reload the inventory from listDevices and hand freed devices to waiting workers.
+        """
+        rslt = self.devices.listDevices(**dict(self.filters))
+        handsets = handsetList(rslt)
+        with self.__lock:
+            self.__inventory = OrderedDict((h["deviceId"], h) for h in handsets if h.get("deviceId"))
+            self.__dispatch()
+        log.debug("broker inventory holds '%s' devices" % len(handsets))
+
+    def acquire(self, attributes=None, timeout=None, leaseSeconds=None, owner=None, cancelled=None):
+        """
+        Lease a free device matching attributes, waiting up to timeout seconds.
+        The request is dropped from its queue as soon as cancelled() returns True.
+
+        Returns:
+            dict -- the lease: "id", "deviceId", "expires" (epoch seconds), "owner" and "device".
+
+        Raises:
+            Exception -- no matching device became free in time, or the request was cancelled.
+        """
+        attributes = dict((k, "%s" % v) for (k, v) in (attributes or {}).items())
+        waiter = {"attributes": attributes, "owner": owner, "lease": None,
+                  "leaseSeconds": leaseSeconds or self.leaseSeconds}
+        key = tuple(sorted(attributes.items()))
+        deadline = None if timeout is None else time.time() + timeout
+        with self.__lock:
+            self.__queues.setdefault(key, []).append(waiter)
+            self.__dispatch()
+            while waiter["lease"] is None:
+                remaining = None if deadline is None else deadline - time.time()
+                if cancelled is not None and cancelled():
+                    self.__dequeue(key, waiter)
+                    raise Exception("Request for a device matching '%s' was cancelled." % attributes)
+                if remaining is not None and remaining <= 0:
+                    self.__dequeue(key, waiter)
+                    raise Exception("No device matching '%s' became available." % attributes)
+                self.__lock.wait(min(remaining, 1.0) if remaining is not None else 1.0)
+            return dict(waiter["lease"])
+
+    def renew(self, leaseID, leaseSeconds=None):
+        """
+        Push back the expiry of a lease.
+        """
+        with self.__lock:
+            lease = self.__leases.get(leaseID)
+            if lease is None:
+                raise Exception("Unknown or expired lease '%s'." % leaseID)
+            lease["expires"] = time.time() + (leaseSeconds or lease["leaseSeconds"])
+            return dict(lease)
+
+    def release(self, leaseID):
+        """
+        Give a leased device back to the broker so it can be leased again.
+        """
+        with self.__lock:
+            lease = self.__leases.pop(leaseID, None)
+            if lease is None:
+                raise Exception("Unknown or expired lease '%s'." % leaseID)
+            self.__dispatch()
+        log.debug("lease '%s' on '%s' returned" % (leaseID, lease["deviceId"]))
+        return dict(lease)
+
+    def status(self):
+        """
+        Return the inventory size, leased device IDs and queued request counts.
+        """
+        with self.__lock:
+            return {"devices": len(self.__inventory),
+                    "leased": sorted(l["deviceId"] for l in self.__leases.values()),
+                    "waiting": dict((json.dumps(dict(k), sort_keys=True), len(q)) for (k, q) in self.__queues.items())}
+
+    def expireLeases(self):
+        """
+        Take back every lease past its expiry and release its device.
+        """
+        now = time.time()
+        with self.__lock:
+            expired = [l for l in self.__leases.values() if l["expires"] <= now]
+            for lease in expired:
+                del self.__leases[lease["id"]]
+        for lease in expired:
+            log.info("lease '%s' on '%s' expired" % (lease["id"], lease["deviceId"]))
+            if self.releaseOnExpiry:
+                try:
+                    self.devices.releaseDevice(lease["deviceId"], self.admin)
+                except Exception as e:
+                    log.error("could not release expired device '%s' because '%s'" % (lease["deviceId"], e.message))
+        if expired:
+            with self.__lock:
+                self.__dispatch()
+        return expired
+
+    def __dequeue(self, key, waiter):
+        """Drop a waiter that gave up. Caller holds the lock."""
+        self.__queues[key].remove(waiter)
+        if not self.__queues[key]:
+            del self.__queues[key]
+
+    def __matches(self, handset, attributes):
+        for (name, value) in attributes.items():
+            if ("%s" % handset.get(name, "")).lower() != value.lower():
+                return False
+        return True
+
+    def __free(self):
+        leased = set(l["deviceId"] for l in self.__leases.values())
+        return [h for (deviceID, h) in self.__inventory.items()
+                if deviceID not in leased
+                and ("%s" % h.get("inUse", "false")).lower() != "true"
+                and ("%s" % h.get("available", "true")).lower() != "false"]
+
+    def __dispatch(self):
+        """Serve waiting requests round robin across attribute sets. Caller holds the lock."""
+        free = self.__free()
+        served = True
+        while free and self.__queues and served:
+            served = False
+            keys = list(self.__queues)
+            start = self.__turn % len(keys)
+            for key in keys[start:] + keys[:start]:
+                queue = self.__queues[key]
+                handset = next((h for h in free if self.__matches(h, queue[0]["attributes"])), None)
+                if handset is None:
+                    continue
+                waiter = queue.pop(0)
+                if not queue:
+                    del self.__queues[key]
+                free.remove(handset)
+                lease = {"id": uuid.uuid4().hex, "deviceId": handset["deviceId"], "owner": waiter["owner"],
+                         "leaseSeconds": waiter["leaseSeconds"],
+                         "expires": time.time() + waiter["leaseSeconds"], "device": dict(handset)}
+                self.__leases[lease["id"]] = lease
+                waiter["lease"] = lease
+                self.__turn += 1
+                served = True
+                break
+        self.__lock.notify_all()
+
+    def __loop(self, interval, func):
+        while not self.__stop.is_set():
+            try:
+                func()
+            except Exception as e:
+                log.error("broker background task failed because '%s'" % e.message)
+            self.__stop.wait(interval)
+
+    def start(self):
+        """
+        Start the inventory poller, lease expiry and socket server threads.
+        """
+        if os.path.exists(self.socketPath):
+            os.unlink(self.socketPath)
+        self.__stop.clear()
+        broker = self
+
+        class Handler(SocketServer.StreamRequestHandler):
+            def disconnected(self):
+                # Readable with nothing to read means the worker hung up.
+                if not select.select([self.connection], [], [], 0)[0]:
+                    return False
+                try:
+                    return not self.connection.recv(1, socket.MSG_PEEK)
+                except socket.error:
+                    return True
+
+            def handle(self):
+                try:
+                    for line in iter(self.rfile.readline, b""):
+                        response = broker.handleRequest(line, self.disconnected)
+                        try:
+                            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+                            self.wfile.flush()
+                        except socket.error:
+                            if response.get("lease") and json.loads(line).get("op") == "acquire":
+                                log.warn("worker left before lease '%s' was delivered" % response["lease"]["id"])
+                                broker.handleRequest(json.dumps({"op": "release", "leaseId": response["lease"]["id"]}))
+                            raise
+                except socket.error as e:
+                    log.debug("broker connection closed because '%s'" % e)
+
+            def finish(self):
+                try:
+                    SocketServer.StreamRequestHandler.finish(self)
+                except socket.error:
+                    pass
+
+        self.__server = SocketServer.ThreadingUnixStreamServer(self.socketPath, Handler)
+        self.__server.daemon_threads = True
+        self.__threads = [
+            threading.Thread(target=self.__loop, args=(self.pollInterval, self.refresh), name="BrokerPoller"),
+            threading.Thread(target=self.__loop, args=(1.0, self.expireLeases), name="BrokerLeases"),
+            threading.Thread(target=self.__server.serve_forever, name="BrokerServer")]
+        for t in self.__threads:
+            t.daemon = True
+            t.start()
+        log.info("device broker listening on '%s'" % self.socketPath)
+
+    def serve_forever(self):
+        """
+        Start the broker and block until stop() is called.
+        """
+        self.start()
+        while not self.__stop.wait(1.0):
+            pass
+
+    def stop(self):
+        """
+        Stop serving. Outstanding leases are forgotten, not released.
+        """
+        self.__stop.set()
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__server = None
+        for t in self.__threads:
+            t.join()
+        self.__threads = []
+        if os.path.exists(self.socketPath):
+            os.unlink(self.socketPath)
+
+    def handleRequest(self, line, cancelled=None):
+        """
+        Answer one json request line from a worker. An acquire waits at most
+        maxWait seconds and gives up once cancelled() returns True.
+        """
+        try:
+            request = json.loads(line)
+            op = request.get("op")
+            if op == "acquire":
+                timeout = request.get("timeout")
+                if self.maxWait is not None:
+                    timeout = self.maxWait if timeout is None else min(timeout, self.maxWait)
+                lease = self.acquire(request.get("attributes"), timeout,
+                                     request.get("leaseSeconds"), request.get("owner"), cancelled)
+            elif op == "renew":
+                lease = self.renew(request["leaseId"], request.get("leaseSeconds"))
+            elif op == "release":
+                lease = self.release(request["leaseId"])
+            elif op == "status":
+                return {"ok": True, "status": self.status()}
+            else:
+                raise Exception("Unknown broker operation '%s'." % op)
+            return {"ok": True, "lease": lease}
+        except Exception as e:
+            log.error("broker request failed because '%s'" % e.message)
+            return {"ok": False, "error": e.message}
+
+
+class BrokerClient(object):
+    """
+    Worker side of the DeviceBroker protocol.
+
+    Each request in flight uses its own connection, so one thread waiting in
+    acquire does not hold up renewals or releases from other threads.
+
+        client = BrokerClient("/tmp/perfecto-broker.sock")
+        with client.lease({"os": "Android"}, timeout=600) as lease:
+            run_tests(lease["deviceId"])
+    """
+
+    def __init__(self, socketPath, owner=None):
+        self.socketPath = socketPath
+        self.owner = owner or "%s:%s" % (socket.gethostname(), os.getpid())
+        self.__lock = threading.Lock()
+        self.__ids = itertools.count()
+        self.__idle = []
+
+    def __connect(self):
+        with self.__lock:
+            if self.__idle:
+                return self.__idle.pop()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socketPath)
+        return sock, sock.makefile("rwb")
+
+    def __call(self, request):
+        with self.__lock:
+            request["seq"] = next(self.__ids)
+        connection = self.__connect()
+        try:
+            connection[1].write(json.dumps(request).encode("utf-8") + b"\n")
+            connection[1].flush()
+            line = connection[1].readline()
+        except Exception:
+            self.__disconnect(connection)
+            raise
+        if not line:
+            self.__disconnect(connection)
+            raise Exception("Device broker closed the connection.")
+        with self.__lock:
+            self.__idle.append(connection)
+        response = json.loads(line)
+        if not response.get("ok"):
+            raise Exception("Device broker request failed because '%s'" % response.get("error"))
+        return response
+
+    def acquire(self, attributes=None, timeout=None, leaseSeconds=None):
+        """
+        Lease a device matching attributes. See DeviceBroker.acquire.
+        """
+        return self.__call({"op": "acquire", "attributes": attributes or {}, "timeout": timeout,
+                            "leaseSeconds": leaseSeconds, "owner": self.owner})["lease"]
+
+    def renew(self, leaseID, leaseSeconds=None):
+        return self.__call({"op": "renew", "leaseId": leaseID, "leaseSeconds": leaseSeconds})["lease"]
+
+    def release(self, leaseID):
+        return self.__call({"op": "release", "leaseId": leaseID})["lease"]
+
+    def status(self):
+        return self.__call({"op": "status"})["status"]
+
+    @contextmanager
+    def lease(self, attributes=None, timeout=None, leaseSeconds=None, renewInterval=None):
+        """
+        Lease a device for the duration of a with block. A background thread
+        renews the lease until the block ends, and a lease that expired anyway
+        is not an error on the way out.
+
+        Keyword Arguments:
+            renewInterval {number} -- Seconds between renewals. (default: {a third of the lease})
+        """
+        lease = self.acquire(attributes, timeout, leaseSeconds)
+        done = threading.Event()
+        interval = renewInterval or lease["leaseSeconds"] / 3.0
+
+        def heartbeat():
+            while not done.wait(interval):
+                try:
+                    self.renew(lease["id"], leaseSeconds)
+                except Exception as e:
+                    log.error("could not renew lease '%s' because '%s'" % (lease["id"], e.message))
+
+        renewer = threading.Thread(target=heartbeat, name="BrokerLeaseRenewer")
+        renewer.daemon = True
+        renewer.start()
+        try:
+            yield lease
+        finally:
+            done.set()
+            renewer.join()
+            try:
+                self.release(lease["id"])
+            except Exception as e:
+                log.warn("could not return lease '%s' because '%s'" % (lease["id"], e.message))
+
+    def __disconnect(self, connection):
+        try:
+            connection[1].close()
+            connection[0].close()
+        except socket.error:
+            pass
+
+    def close(self):
+        with self.__lock:
+            idle = self.__idle
+            self.__idle = []
+        for connection in idle:
+            self.__disconnect(connection)
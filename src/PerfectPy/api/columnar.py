@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Helpers shared by the columnar analytics modules.
+
+    Requires numpy. Parquet export also requires pyarrow.
+"""
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+import csv
+try:
+    import numpy as np
+except ImportError:  # pragma no cover
+    np = None
+
+
+def encode(values):
+    """Dictionary-encode a list of strings into (codes, categories)."""
+    categories = []
+    index = {}
+    codes = np.empty(len(values), dtype=np.int32)
+    for (i, value) in enumerate(values):
+        code = index.get(value)
+        if code is None:
+            code = index[value] = len(categories)
+            categories.append(value)
+        codes[i] = code
+    return codes, categories
+
+
+def writeCSV(columns, path):
+    """
+    Write a dict of equal length columns (name -> array or list) to a csv file.
+    """
+    names = list(columns)
+    with open(path, "wb") as f:
+        writer = csv.writer(f)
+        writer.writerow([n.encode("utf-8") for n in names])
+        for row in zip(*[columns[n] for n in names]):
+            writer.writerow([("%s" % v).encode("utf-8") for v in row])
+
+
+def writeParquet(columns, path):
+    """
+    Write a dict of equal length columns (name -> array or list) to a parquet file.
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise Exception("pyarrow is required for parquet export.")
+    table = pyarrow.Table.from_arrays([pyarrow.array(columns[n]) for n in columns], names=[str(n) for n in columns])
+    pyarrow.parquet.write_table(table, path)
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Local evaluation of the cron expressions used for scheduled executions.
+
+    Perfecto takes Quartz style expressions:
+
+        seconds minutes hours day-of-month month day-of-week [year]
+
+    with the documented limitations that "*" is not allowed in the seconds and
+    minutes fields, and that increments restart at every round hour/day
+    ("10/20" in the minutes field fires at x:10, x:30 and x:50 of every hour).
+    Times are UTC milliseconds, like every other time in the API.
+"""
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from .__init__ import timeMilis
+from bisect import bisect_left
+from datetime import datetime, timedelta
+import calendar
+import heapq
+import threading
+
+_MONTHS = dict((name, i + 1) for (i, name) in enumerate(
+    ["JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC"]))
+_DAYS = dict((name, i + 1) for (i, name) in enumerate(["SUN", "MON", "TUE", "WED", "THU", "FRI", "SAT"]))
+_FIELDS = (
+    ("seconds", 0, 59, None),
+    ("minutes", 0, 59, None),
+    ("hours", 0, 23, None),
+    ("day-of-month", 1, 31, None),
+    ("month", 1, 12, _MONTHS),
+    ("day-of-week", 1, 7, _DAYS),
+    ("year", 1970, 2099, None),
+)
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _value(token, low, high, names, field):
+    token = token.upper()
+    if names and token in names:
+        return names[token]
+    try:
+        value = int(token)
+    except ValueError:
+        raise Exception("Invalid value '%s' in the %s field." % (token, field))
+    if value < low or value > high:
+        raise Exception("Value '%s' is out of range %s-%s in the %s field." % (token, low, high, field))
+    return value
+
+
+def _parseField(text, field):
+    """Expand a plain field (lists, ranges, steps) into a sorted tuple of values."""
+    (name, low, high, names) = field
+    cycle = high - low + 1
+    values = set()
+    for part in text.split(","):
+        step = 1
+        hasStep = "/" in part
+        if hasStep:
+            part, stepText = part.split("/", 1)
+            step = _value(stepText, 1, cycle, None, name)
+        if part in ("*", "?"):
+            first, last = low, high
+        elif "-" in part:
+            first, last = [_value(p, low, high, names, name) for p in part.split("-", 1)]
+        else:
+            first = _value(part, low, high, names, name)
+            last = high if hasStep else first
+        # A range like FRI-MON or 22-2 wraps around the end of the field.
+        for offset in range(0, (last - first) % cycle + 1, step):
+            values.add(low + (first - low + offset) % cycle)
+    return tuple(sorted(values))
+
+
+def _toMillis(dt):
+    return int((dt - _EPOCH).total_seconds()) * 1000
+
+
+def _fromMillis(millis):
+    return _EPOCH + timedelta(milliseconds=int(millis))
+
+
+class CronExpression(object):
+    """
+    A compiled Perfecto cron expression. Use compileCron() to get a cached instance.
+
+        cron = compileCron("0 10/20 8-18 ? * MON-FRI")
+        cron.nextFireTimes(3)
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = expression.split()
+        if len(fields) not in (6, 7):
+            raise Exception("Cron expression '%s' needs 6 or 7 fields, found %s." % (expression, len(fields)))
+        for (name, text) in zip(("seconds", "minutes"), fields[:2]):
+            if "*" in text:
+                raise Exception("'*' is not allowed in the %s field of '%s'." % (name, expression))
+        self.seconds = _parseField(fields[0], _FIELDS[0])
+        if len(self.seconds) == 60:
+            raise Exception("Running a script every second is not allowed: '%s'." % expression)
+        self.minutes = _parseField(fields[1], _FIELDS[1])
+        self.hours = _parseField(fields[2], _FIELDS[2])
+        self.months = _parseField(fields[4], _FIELDS[4])
+        self.years = _parseField(fields[6], _FIELDS[6]) if len(fields) == 7 else None
+        dom, dow = fields[3], fields[5]
+        if (dom == "?") == (dow == "?"):
+            if dom == "?":
+                raise Exception("Only one of day-of-month and day-of-week may be '?' in '%s'." % expression)
+            raise Exception("One of day-of-month and day-of-week must be '?' in '%s'." % expression)
+        self.__dayMatcher = self.__domMatcher(dom) if dow == "?" else self.__dowMatcher(dow)
+
+    def __domMatcher(self, text):
+        text = text.upper()
+        if text == "L":
+            return lambda y, m, d, last: d == last
+        if text.startswith("L-"):
+            offset = _value(text[2:], 0, 30, None, "day-of-month")
+            return lambda y, m, d, last: d == last - offset
+        if text in ("LW",) or text.endswith("W"):
+            target = None if text == "LW" else _value(text[:-1], 1, 31, None, "day-of-month")
+
+            def nearestWeekday(y, m, d, last):
+                day = min(target or last, last)
+                weekday = calendar.weekday(y, m, day)
+                if weekday == 5:
+                    day = day - 1 if day > 1 else day + 2
+                elif weekday == 6:
+                    day = day + 1 if day < last else day - 2
+                return d == day
+            return nearestWeekday
+        days = frozenset(_parseField(text, _FIELDS[3]))
+        return lambda y, m, d, last: d in days
+
+    def __dowMatcher(self, text):
+        text = text.upper()
+
+        def quartzDay(y, m, d):
+            return (calendar.weekday(y, m, d) + 1) % 7 + 1
+
+        if "#" in text:
+            dayText, nthText = text.split("#", 1)
+            day = _value(dayText, 1, 7, _DAYS, "day-of-week")
+            nth = _value(nthText, 1, 5, None, "day-of-week")
+            return lambda y, m, d, last: quartzDay(y, m, d) == day and (d - 1) // 7 + 1 == nth
+        if text.endswith("L") and text != "L":
+            day = _value(text[:-1], 1, 7, _DAYS, "day-of-week")
+            return lambda y, m, d, last: quartzDay(y, m, d) == day and d + 7 > last
+        if text == "L":
+            text = "7"
+        days = frozenset(_parseField(text, _FIELDS[5]))
+        return lambda y, m, d, last: quartzDay(y, m, d) in days
+
+    def matchesDay(self, year, month, day):
+        return self.__dayMatcher(year, month, day, calendar.monthrange(year, month)[1])
+
+    def iterFireTimes(self, after=None, until=None):
+        """
+        Yield fire times strictly after after (ms, default now) in increasing order,
+        stopping at until (ms) if given.
+        """
+        start = _fromMillis(timeMilis() if after is None else after) + timedelta(seconds=1)
+        start = start.replace(microsecond=0)
+        limit = None if until is None else _fromMillis(until)
+        years = self.years or range(start.year, 2100)
+        for year in years:
+            if year < start.year:
+                continue
+            for month in self.months:
+                if (year, month) < (start.year, start.month):
+                    continue
+                last = calendar.monthrange(year, month)[1]
+                firstDay = start.day if (year, month) == (start.year, start.month) else 1
+                for day in range(firstDay, last + 1):
+                    if limit is not None and datetime(year, month, day) > limit:
+                        return
+                    if not self.__dayMatcher(year, month, day, last):
+                        continue
+                    startDay = (year, month, day) == (start.year, start.month, start.day)
+                    hours = self.hours[bisect_left(self.hours, start.hour):] if startDay else self.hours
+                    for hour in hours:
+                        startHour = startDay and hour == start.hour
+                        minutes = self.minutes[bisect_left(self.minutes, start.minute):] if startHour else self.minutes
+                        for minute in minutes:
+                            startMinute = startHour and minute == start.minute
+                            seconds = self.seconds[bisect_left(self.seconds, start.second):] if startMinute else self.seconds
+                            for second in seconds:
+                                fire = datetime(year, month, day, hour, minute, second)
+                                if limit is not None and fire > limit:
+                                    return
+                                yield _toMillis(fire)
+
+    def nextFireTimes(self, count=1, after=None, until=None):
+        """
+        Return up to count fire times (ms) after after (default now).
+        """
+        times = []
+        for fire in self.iterFireTimes(after, until):
+            times.append(fire)
+            if len(times) >= count:
+                break
+        return times
+
+    def nextFireTime(self, after=None):
+        times = self.nextFireTimes(1, after)
+        return times[0] if times else None
+
+
+_cache = {}
+_cacheLock = threading.Lock()
+
+
+def compileCron(expression):
+    """
+    Parse and validate a cron expression, returning a cached CronExpression.
+
+    Raises:
+        Exception -- the expression is not valid for Perfecto.
+    """
+    key = " ".join(expression.split())
+    with _cacheLock:
+        cron = _cache.get(key)
+    if cron is None:
+        cron = CronExpression(key)
+        with _cacheLock:
+            _cache[key] = cron
+    return cron
+
+
+def scheduleFireTimes(recurrence, startTime=None, endTime=None, repeatCount=None, after=None, until=None, count=None):
+    """
+    Fire times of a scheduled execution, honouring its startTime, endTime and repeatCount.
+    """
+    cron = compileCron(recurrence)
+    first = timeMilis() if after is None else after
+    if startTime:
+        first = max(first, int(startTime) - 1)
+    bounds = [int(t) for t in (endTime, until) if t]
+    last = min(bounds) if bounds else None
+    limits = [int(n) for n in (count, repeatCount) if n]
+    limit = min(limits) if limits else None
+    if last is None and limit is None:
+        raise Exception("An until time, count or repeatCount is needed to bound the fire times.")
+    times = []
+    for fire in cron.iterFireTimes(first, last):
+        times.append(fire)
+        if limit and len(times) >= limit:
+            break
+    return times
+
+
+def findOverlaps(schedules, after=None, until=None, duration=0):
+    """
+    Find fire times of different schedules that would run at the same time.
+
+    Arguments:
+        schedules {list} -- dicts with "scheduleKey" and "recurrence", and optionally
+                            "startTime", "endTime", "repeatCount" and "duration" (ms
+                            an execution is expected to run).
+
+    Keyword Arguments:
+        after {long} -- Start of the checked range in ms. (default: {now})
+        until {long} -- End of the checked range in ms. (default: {one week after after})
+        duration {long} -- Expected run time for schedules that give none. (default: {0})
+
+    Returns:
+        list -- (scheduleKeyA, fireTimeA, scheduleKeyB, fireTimeB) for every overlapping pair.
+    """
+    after = timeMilis() if after is None else after
+    until = after + 7 * 24 * 60 * 60 * 1000 if until is None else until
+    streams = []
+    for s in schedules:
+        runFor = s.get("duration", duration) or 0
+        fires = scheduleFireTimes(s["recurrence"], s.get("startTime"), s.get("endTime"), s.get("repeatCount"), after, until)
+        streams.append([(fire, fire + max(runFor, 1000), s["scheduleKey"]) for fire in fires])
+    overlaps = []
+    active = []
+    for (start, end, key) in heapq.merge(*streams):
+        active = [a for a in active if a[1] > start]
+        for (otherStart, otherEnd, otherKey) in active:
+            if otherKey != key:
+                overlaps.append((otherKey, otherStart, key, start))
+        active.append((start, end, key))
+    return overlaps
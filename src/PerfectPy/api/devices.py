@@ -1,8 +1,12 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
-from .__init__ import APIBase, log, properParams
+from .__init__ import APIBase, log, properParams, runConcurrently
 from urllib import urlencode
+from collections import OrderedDict
+import atexit
+import threading
+import weakref
 
 
 class Devices(APIBase):
@@ -161,3 +165,210 @@ class Devices(APIBase):
             log.debug(e.args)
             raise Exception("relase device API call failed because '%s'" % e.message)
         return rslt
+
+    def releaseDevices(self, deviceIDs, admin=False, maxWorkers=8, progress=None):
+        """
+            Release many devices at once instead of one at a time.
+
+            deviceIDs: list of device IDs to release.
+            admin: optional admin for these devices?
+            maxWorkers: the most release calls in flight at the same time.
+            progress: optional callable called as progress(deviceID, outcome, done, total)
+                      as each release finishes.
+
+            Returns an ordered dict of deviceID -> {"success": True, "result": response}
+            or {"success": False, "error": message}. A failed release does not stop the others.
+        """
+        calls = [(deviceID, (deviceID,), {"admin": admin}) for deviceID in deviceIDs]
+        log.debug("releasing '%s' devices" % len(calls))
+        return runConcurrently(self.releaseDevice, calls, maxWorkers, progress)
+
+    def updateDevices(self, updates, admin=False, maxWorkers=8, progress=None):
+        """
+            Update the description and/or roles of many devices at once.
+
+            updates: dict of deviceID -> (description, roles). Either value may be None,
+                     but not both.
+            admin: optional admin for these devices?
+            maxWorkers: the most update calls in flight at the same time.
+            progress: optional callable called as progress(deviceID, outcome, done, total)
+                      as each update finishes.
+
+            Returns an ordered dict of deviceID -> {"success": True, "result": response}
+            or {"success": False, "error": message}. A failed update does not stop the others.
+        """
+        calls = [(deviceID, (deviceID, description, roles or []), {"admin": admin})
+                 for (deviceID, (description, roles)) in updates.items()]
+        log.debug("updating '%s' devices" % len(calls))
+        return runConcurrently(self.updateDevice, calls, maxWorkers, progress)
+
+
+def handsetList(rslt):
+    """
+    Return the handsets in a listDevices response as a list of dicts,
+    whether the server answered in xml or json and whatever the number of handsets.
+    """
+    if not rslt:
+        return []
+    handsets = rslt.get("handsets", rslt) if isinstance(rslt, dict) else rslt
+    if isinstance(handsets, dict):
+        handsets = handsets.get("handset", [])
+    if isinstance(handsets, dict):
+        handsets = [handsets]
+    return list(handsets or [])
+
+
+# Queues still open, held weakly so the exit hook does not keep them alive.
+_openQueues = weakref.WeakSet()
+
+
+@atexit.register
+def _closeOpenQueues():
+    for queue in list(_openQueues):
+        queue.close()
+
+
+class DeviceUpdateQueue(object):
+    """
+    Write-behind queue for updateDevice calls.
+
+    Updates to the same device within the window are merged into one
+    updateDevice call: role lists are combined and the last description wins.
+    Pending updates are sent concurrently when the window closes, when flush()
+    is called, and when the queue is closed or the interpreter exits. An update
+    that fails is queued again, merged under any newer update for the device,
+    and dropped with an error in the log after retries attempts or on close.
+
+        with DeviceUpdateQueue(devices) as updates:
+            updates.update(deviceID, roles=["nightly"])
+            updates.update(deviceID, description="Pixel 3 lab 2")
+    """
+
+    def __init__(self, devices, window=2.0, admin=False, maxWorkers=8, progress=None, retries=3):
+        """
+        Arguments:
+            devices {Devices} -- Devices instance used to send the updates.
+
+        Keyword Arguments:
+            window {float} -- Seconds to wait after the first pending update before flushing. (default: {2.0})
+            admin {bool} -- Send the updates as admin. (default: {False})
+            maxWorkers {int} -- The most update calls in flight at the same time. (default: {8})
+            progress {callable} -- Passed on to Devices.updateDevices. (default: {None})
+            retries {int} -- Times a failed update is sent before it is dropped. (default: {3})
+        """
+        self.devices = devices
+        self.window = window
+        self.admin = admin
+        self.maxWorkers = maxWorkers
+        self.progress = progress
+        self.retries = retries
+        self.__pending = OrderedDict()
+        self.__attempts = {}
+        self.__lock = threading.Lock()
+        self.__flushLock = threading.Lock()
+        self.__timer = None
+        self.__closed = False
+        _openQueues.add(self)
+
+    def update(self, deviceID, description=None, roles=None):
+        """
+        Queue an update for a device.
+
+        Arguments:
+            deviceID {string} -- The device to update.
+
+        Keyword Arguments:
+            description {string} -- New description, replaces any pending one. (default: {None})
+            roles {list} -- Roles to add to the pending role list. (default: {None})
+        """
+        if not deviceID:
+            raise Exception("Device ID is required.")
+        if not description and not roles:
+            raise Exception("One or more of description or roles required in function call.")
+        with self.__lock:
+            if self.__closed:
+                raise Exception("DeviceUpdateQueue is closed.")
+            pendingDescription, pendingRoles = self.__pending.get(deviceID, (None, []))
+            if description:
+                pendingDescription = description
+            for role in roles or []:
+                if role not in pendingRoles:
+                    pendingRoles.append(role)
+            self.__pending[deviceID] = (pendingDescription, pendingRoles)
+            self.__startTimer()
+        log.debug("queued update for device '%s'" % deviceID)
+
+    def __startTimer(self):
+        if self.__timer is None:
+            self.__timer = threading.Timer(self.window, self.flush)
+            self.__timer.daemon = True
+            self.__timer.start()
+
+    def pending(self):
+        """
+        Return a copy of the updates waiting to be sent as deviceID -> (description, roles).
+        """
+        with self.__lock:
+            return OrderedDict((k, (d, list(r))) for (k, (d, r)) in self.__pending.items())
+
+    def flush(self):
+        """
+        Send all pending updates now.
+
+        Returns:
+            OrderedDict -- the per-device result map from Devices.updateDevices.
+                           Failed updates are queued again, see the class docstring.
+        """
+        with self.__flushLock:
+            with self.__lock:
+                if self.__timer is not None:
+                    self.__timer.cancel()
+                    self.__timer = None
+                batch = self.__pending
+                self.__pending = OrderedDict()
+            if not batch:
+                return OrderedDict()
+            log.debug("flushing updates for '%s' devices" % len(batch))
+            results = self.devices.updateDevices(batch, self.admin, self.maxWorkers, self.progress)
+            self.__requeue(batch, results)
+            return results
+
+    def __requeue(self, batch, results):
+        with self.__lock:
+            for (deviceID, outcome) in results.items():
+                if outcome["success"]:
+                    self.__attempts.pop(deviceID, None)
+                    continue
+                attempts = self.__attempts.get(deviceID, 0) + 1
+                if self.__closed or attempts >= self.retries:
+                    self.__attempts.pop(deviceID, None)
+                    log.error("dropping update for device '%s' after '%s' attempts because '%s'" %
+                              (deviceID, attempts, outcome["error"]))
+                    continue
+                self.__attempts[deviceID] = attempts
+                description, roles = batch[deviceID]
+                if deviceID in self.__pending:
+                    # A newer update came in meanwhile: its description wins, the roles add up.
+                    newerDescription, newerRoles = self.__pending[deviceID]
+                    description = newerDescription or description
+                    roles = roles + [r for r in newerRoles if r not in roles]
+                self.__pending[deviceID] = (description, roles)
+                self.__startTimer()
+
+    def close(self):
+        """
+        Stop accepting updates and send whatever is still pending.
+        """
+        with self.__lock:
+            if self.__closed:
+                return OrderedDict()
+            self.__closed = True
+        _openQueues.discard(self)
+        return self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+        return False
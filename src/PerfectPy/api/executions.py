@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from .__init__ import APIBase, log, properParams, runConcurrently
+from urllib import urlencode
+import threading
+
+FINISHED_STATUSES = {"completed", "aborted", "failed", "cancelled", "canceled"}
+
+
+def executionFinished(status):
+    """
+    True if a getExecutionStatus response describes an execution that will not change any more.
+    """
+    if not isinstance(status, dict):
+        return False
+    if ("%s" % status.get("completed", "")).lower() == "true":
+        return True
+    return ("%s" % status.get("status", "")).lower() in FINISHED_STATUSES
+
+
+def executionItems(rslt):
+    """
+    Return the executions in a getExecutionsList response as a list of dicts,
+    whether the server answered in xml or json.
+    """
+    if not rslt:
+        return []
+    items = rslt
+    if isinstance(items, dict):
+        for name in ("executions", "items"):
+            if name in items:
+                items = items[name]
+                break
+        else:
+            items = []
+    if isinstance(items, dict):
+        items = items.get("execution", [items])
+    if isinstance(items, dict):
+        items = [items]
+    return list(items or [])
+
+
+class ExecutionFuture(object):
+    """
+    The eventual outcome of a script execution started through Executions.
+
+    result() blocks until the execution finishes and returns its last status response,
+    which includes the reportKey. Callbacks added with add_done_callback are called
+    with the future once it is done.
+    """
+
+    def __init__(self, executionId=None, reportKey=None):
+        self.executionId = executionId
+        self.reportKey = reportKey
+        self.status = None
+        self.__done = threading.Event()
+        self.__result = None
+        self.__error = None
+        self.__callbacks = []
+        self.__lock = threading.Lock()
+
+    def done(self):
+        return self.__done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for the execution to finish and return its final status.
+
+        Raises:
+            Exception -- the execution could not be started or tracked, or timeout passed.
+        """
+        if not self.__done.wait(timeout):
+            raise Exception("Execution '%s' did not finish in time." % self.executionId)
+        if self.__error is not None:
+            raise self.__error
+        return self.__result
+
+    def exception(self, timeout=None):
+        if not self.__done.wait(timeout):
+            raise Exception("Execution '%s' did not finish in time." % self.executionId)
+        return self.__error
+
+    def add_done_callback(self, callback):
+        with self.__lock:
+            if not self.__done.is_set():
+                self.__callbacks.append(callback)
+                return
+        callback(self)
+
+    def _resolve(self, result=None, error=None):
+        with self.__lock:
+            if self.__done.is_set():
+                return
+            self.__result = result
+            self.__error = error
+            if isinstance(result, dict) and result.get("reportKey"):
+                self.reportKey = result["reportKey"]
+            self.__done.set()
+            callbacks = self.__callbacks
+            self.__callbacks = []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                log.error("execution callback failed because '%s'" % e.message)
+
+
+class Executions(APIBase):
+    """
+    Start script executions and follow their status.
+
+    Many executions can be launched at once; their status is then polled in shared
+    rounds, one concurrent batch of getExecutionStatus calls per round for every
+    execution still running, instead of one loop per execution. An execution whose
+    status cannot be read maxStatusFailures rounds in a row is given up and its
+    future raises the last error.
+
+        executions = Executions(securityToken)
+        futures = executions.launch([("PRIVATE:login.xml", {"device": d}) for d in devices])
+        for future in futures.values():
+            print(future.result()["reportKey"])
+    """
+
+    def __init__(self, securityToken, baseURL='https://mobilecloud.perfectomobile.com/services/', pollInterval=10, maxWorkers=8,
+                 maxStatusFailures=5):
+        """
+        Arguments:
+            securityToken {string} -- security token generated through the perfecto console
+
+        Keyword Arguments:
+            baseURL {str} -- Base url for the web services. (default: {'https://mobilecloud.perfectomobile.com/services/'})
+            pollInterval {number} -- Seconds between status rounds. (default: {10})
+            maxWorkers {int} -- The most calls in flight at the same time. (default: {8})
+            maxStatusFailures {int} -- Failed status calls in a row before an execution is given up. (default: {5})
+        """
+        self.initClient(securityToken, baseURL)
+        self.pollInterval = pollInterval
+        self.maxWorkers = maxWorkers
+        self.maxStatusFailures = maxStatusFailures
+        self.__watching = {}
+        self.__failures = {}
+        self.__lock = threading.Lock()
+        self.__wake = threading.Event()
+        self.__thread = None
+
+    def startExecution(self, scriptKey, owner=None, admin=False, responseFormat="json", parameters=None, securedParams=None):
+        """Start a new script execution.
+
+        Arguments:
+            scriptKey {string} -- The repository key of the automation script file,
+                                  for example PRIVATE:executeScript.xml
+
+        Keyword Arguments:
+            owner {string} -- The user name of the user who owns the script. Used with admin. (default: {None})
+            admin {bool} -- true to allow users with administrative credentials to run
+                            scripts of other users. (default: {False})
+            responseFormat {str} -- Available values: json, xml (default: {"json"})
+            parameters {dict} -- script parameters, sent as param.<name>. (default: {None})
+            securedParams {dict} -- secured script parameters, sent as securedParam.<name>. (default: {None})
+
+        Returns:
+            dict -- the response, including executionId and reportKey
+        """
+        if not scriptKey:
+            raise Exception("scriptKey is a required parameter and the value is invalid.")
+        uriStr = "/executions?operation=execute"
+        params = {"scriptKey": scriptKey}
+        if owner:
+            params["owner"] = owner
+        if admin:
+            params["admin"] = admin
+        params["responseFormat"] = responseFormat
+        if parameters:
+            params.update(("param.%s" % k, v) for (k, v) in parameters.items())
+        if securedParams:
+            params.update(("securedParam.%s" % k, v) for (k, v) in securedParams.items())
+        uriStr = properParams(uriStr, urlencode(params))
+        log.debug("params are '%s'" % uriStr)
+        rslt = None
+        try:
+            rslt = self.client.send_get(uriStr)
+            log.debug("results are '%s'" % rslt)
+        except Exception as e:
+            log.error("startExecution API call failed because '%s'" % e.message)
+            raise Exception("start execution API call failed because '%s'" % e.message)
+        return rslt
+
+    def getExecutionStatus(self, executionId, responseFormat="json"):
+        """Get the status of a script execution.
+
+        Arguments:
+            executionId {string} -- The id returned by startExecution
+
+        Returns:
+            dict -- the response, including status, completed and reportKey
+        """
+        if not executionId:
+            raise Exception("executionId is a required parameter and the value is invalid.")
+        uriStr = "/executions/%s?operation=status" % executionId
+        uriStr = properParams(uriStr, urlencode({"responseFormat": responseFormat}))
+        log.debug("params are '%s'" % uriStr)
+        rslt = None
+        try:
+            rslt = self.client.send_get(uriStr)
+            log.debug("results are '%s'" % rslt)
+        except Exception as e:
+            log.error("getExecutionStatus API call failed because '%s'" % e.message)
+            raise Exception("execution status API call failed because '%s'" % e.message)
+        return rslt
+
+    def getExecutionsList(self, responseFormat="json", admin=False, **filters):
+        """List script executions.
+
+        Keyword Arguments:
+            responseFormat {str} -- Available values: json, xml (default: {"json"})
+            admin {bool} -- list executions of other users. (default: {False})
+            **filters -- server side filters, for example owner, status, startTime.
+
+        Returns:
+            dict -- the response
+        """
+        uriStr = "/executions?operation=list"
+        params = dict(filters)
+        if admin:
+            params["admin"] = admin
+        params["responseFormat"] = responseFormat
+        uriStr = properParams(uriStr, urlencode(params))
+        log.debug("params are '%s'" % uriStr)
+        rslt = None
+        try:
+            rslt = self.client.send_get(uriStr)
+            log.debug("results are '%s'" % rslt)
+        except Exception as e:
+            log.error("getExecutionsList API call failed because '%s'" % e.message)
+            raise Exception("executions list API call failed because '%s'" % e.message)
+        return rslt
+
+    def abortExecution(self, executionId, responseFormat="json"):
+        """Stop a running script execution.
+
+        Arguments:
+            executionId {string} -- The id returned by startExecution
+        """
+        if not executionId:
+            raise Exception("executionId is a required parameter and the value is invalid.")
+        uriStr = "/executions/%s?operation=abort" % executionId
+        uriStr = properParams(uriStr, urlencode({"responseFormat": responseFormat}))
+        log.debug("params are '%s'" % uriStr)
+        rslt = None
+        try:
+            rslt = self.client.send_get(uriStr)
+            log.debug("results are '%s'" % rslt)
+        except Exception as e:
+            log.error("abortExecution API call failed because '%s'" % e.message)
+            raise Exception("abort execution API call failed because '%s'" % e.message)
+        return rslt
+
+    def launch(self, executions, owner=None, admin=False, progress=None):
+        """Start many executions concurrently and track them until they finish.
+
+        Arguments:
+            executions {list} -- scriptKey strings or (scriptKey, parameters) /
+                                 (scriptKey, parameters, securedParams) tuples.
+
+        Keyword Arguments:
+            owner {string} -- see startExecution. (default: {None})
+            admin {bool} -- see startExecution. (default: {False})
+            progress {callable} -- called as progress(index, outcome, done, total) per start call. (default: {None})
+
+        Returns:
+            OrderedDict -- index in executions -> ExecutionFuture. A future whose start
+                           failed is already done and raises the error from result().
+        """
+        calls = []
+        for (i, execution) in enumerate(executions):
+            if isinstance(execution, basestring):
+                execution = (execution,)
+            scriptKey = execution[0]
+            parameters = execution[1] if len(execution) > 1 else None
+            securedParams = execution[2] if len(execution) > 2 else None
+            calls.append((i, (scriptKey, owner, admin, "json", parameters, securedParams), {}))
+        started = runConcurrently(self.startExecution, calls, self.maxWorkers, progress)
+        futures = type(started)()
+        for (i, outcome) in started.items():
+            future = ExecutionFuture()
+            futures[i] = future
+            if not outcome["success"]:
+                future._resolve(error=Exception(outcome["error"]))
+                continue
+            future.executionId = (outcome["result"] or {}).get("executionId")
+            future.reportKey = (outcome["result"] or {}).get("reportKey")
+            if not future.executionId:
+                future._resolve(error=Exception("startExecution returned no executionId: '%s'" % outcome["result"]))
+                continue
+            self.track(future)
+        return futures
+
+    def track(self, future):
+        """
+        Follow an execution started elsewhere. Accepts an ExecutionFuture or an executionId.
+        """
+        if not isinstance(future, ExecutionFuture):
+            future = ExecutionFuture(future)
+        with self.__lock:
+            self.__watching[future.executionId] = future
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__loop, name="ExecutionPoller")
+                self.__thread.daemon = True
+                self.__thread.start()
+        self.__wake.set()
+        return future
+
+    def pending(self):
+        with self.__lock:
+            return len(self.__watching)
+
+    def pollOnce(self):
+        """
+        Run one status round for every execution still being tracked and resolve the
+        futures of those that finished.
+        """
+        with self.__lock:
+            watching = dict(self.__watching)
+        if not watching:
+            return {}
+        results = runConcurrently(self.getExecutionStatus,
+                                  [(i, (i,), {}) for i in watching], self.maxWorkers)
+        for (executionId, outcome) in results.items():
+            future = watching[executionId]
+            if not outcome["success"]:
+                log.warn("status of '%s' unavailable: '%s'" % (executionId, outcome["error"]))
+                with self.__lock:
+                    failures = self.__failures.get(executionId, 0) + 1
+                    self.__failures[executionId] = failures
+                    if failures >= self.maxStatusFailures:
+                        self.__watching.pop(executionId, None)
+                        self.__failures.pop(executionId, None)
+                if failures >= self.maxStatusFailures:
+                    log.error("giving up on execution '%s' after '%s' failed status calls" % (executionId, failures))
+                    future._resolve(error=Exception("status of execution '%s' failed '%s' times in a row: '%s'" %
+                                                    (executionId, failures, outcome["error"])))
+                continue
+            future.status = outcome["result"]
+            with self.__lock:
+                self.__failures.pop(executionId, None)
+            if executionFinished(outcome["result"]):
+                with self.__lock:
+                    self.__watching.pop(executionId, None)
+                future._resolve(result=outcome["result"])
+        log.debug("status round done, '%s' executions still running" % self.pending())
+        return results
+
+    def __loop(self):
+        while True:
+            self.__wake.wait(self.pollInterval)
+            self.__wake.clear()
+            try:
+                self.pollOnce()
+            except Exception as e:
+                log.error("execution status round failed because '%s'" % e.message)
+            with self.__lock:
+                if not self.__watching:
+                    self.__thread = None
+                    return
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from .__init__ import log, runConcurrently
+from .devices import handsetList
+import threading
+import time
+
+
+class AllocationReaper(object):
+    """
+    Releases devices left allocated by crashed or forgotten test workers.
+
+    Every scan lists the devices allocated to each watched user and remembers
+    when each allocation was first seen. Test code reports activity on a device
+    with touch(). An allocation with no activity for longer than the policy allows
+    is released in bulk with Devices.releaseDevices.
+
+        reaper = AllocationReaper(devices, ["ci-bot"], idleMinutes=20)
+        reaper.start(interval=60)
+    """
+
+    def __init__(self, devices, users, idleMinutes=30, maxReleasePerRun=None,
+                 dryRun=False, admin=False, maxWorkers=8, metrics=None, clock=time.time):
+        """
+        Arguments:
+            devices {Devices} -- Devices instance used to list and release devices.
+            users {list} -- User names whose allocations are watched.
+
+        Keyword Arguments:
+            idleMinutes {number or dict} -- Minutes without activity before an allocation
+                                            is released. A dict maps user name to minutes
+                                            and may hold a "*" default. (default: {30})
+            maxReleasePerRun {int} -- Release at most this many devices per run, the
+                                      longest idle first. (default: {None})
+            dryRun {bool} -- Report what would be released without releasing. (default: {False})
+            admin {bool} -- List and release as admin. (default: {False})
+            maxWorkers {int} -- The most API calls in flight at the same time. (default: {8})
+            metrics {callable} -- Called as metrics(name, value, tags) after every run. (default: {None})
+            clock {callable} -- Returns the current time in seconds. (default: {time.time})
+        """
+        self.devices = devices
+        self.users = list(users)
+        self.idleMinutes = idleMinutes
+        self.maxReleasePerRun = maxReleasePerRun
+        self.dryRun = dryRun
+        self.admin = admin
+        self.maxWorkers = maxWorkers
+        self.metrics = metrics
+        self.clock = clock
+        self.stats = {"runs": 0, "released": 0, "failed": 0, "recoveredDeviceMinutes": 0.0}
+        self.__allocations = {}
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def touch(self, deviceID):
+        """
+        Record activity on a device so its allocation is not considered idle.
+        """
+        now = self.clock()
+        with self.__lock:
+            allocation = self.__allocations.get(deviceID)
+            if allocation:
+                allocation["lastActivity"] = now
+            else:
+                self.__allocations[deviceID] = {"user": None, "since": now, "lastActivity": now}
+
+    def allocations(self):
+        """
+        Return a copy of the tracked allocations as deviceID -> {"user", "since", "lastActivity"}.
+        """
+        with self.__lock:
+            return dict((k, dict(v)) for (k, v) in self.__allocations.items())
+
+    def limitFor(self, user):
+        """
+        Return the idle limit in minutes for a user.
+        """
+        if isinstance(self.idleMinutes, dict):
+            return self.idleMinutes.get(user, self.idleMinutes.get("*", 30))
+        return self.idleMinutes
+
+    def scan(self):
+        """
+        Refresh the tracked allocations from listDevices.
+
+        Returns:
+            list -- (deviceID, user, idleMinutes) of allocations over their idle limit,
+                    the longest idle first.
+        """
+        calls = [(user, (), {"allocatedTo": user}) for user in self.users]
+        if self.admin:
+            for (user, args, kwargs) in calls:
+                kwargs["admin"] = "true"
+        listed = runConcurrently(self.devices.listDevices, calls, self.maxWorkers)
+        now = self.clock()
+        seen = {}
+        for (user, outcome) in listed.items():
+            if not outcome["success"]:
+                log.error("could not list devices allocated to '%s': '%s'" % (user, outcome["error"]))
+                continue
+            for handset in handsetList(outcome["result"]):
+                deviceID = handset.get("deviceId")
+                if deviceID and handset.get("allocatedTo", user) == user:
+                    seen[deviceID] = user
+        failedUsers = set(user for (user, outcome) in listed.items() if not outcome["success"])
+        idle = []
+        with self.__lock:
+            for deviceID in list(self.__allocations):
+                allocation = self.__allocations[deviceID]
+                if deviceID not in seen and allocation["user"] not in failedUsers:
+                    del self.__allocations[deviceID]
+            for (deviceID, user) in seen.items():
+                allocation = self.__allocations.get(deviceID)
+                if allocation is None or allocation["user"] not in (None, user):
+                    allocation = {"user": user, "since": now, "lastActivity": now}
+                    self.__allocations[deviceID] = allocation
+                allocation["user"] = user
+                idleFor = (now - max(allocation["since"], allocation["lastActivity"])) / 60.0
+                if idleFor >= self.limitFor(user):
+                    idle.append((deviceID, user, idleFor))
+        idle.sort(key=lambda x: x[2], reverse=True)
+        log.debug("'%s' allocations tracked, '%s' idle" % (len(seen), len(idle)))
+        return idle
+
+    def reap(self):
+        """
+        Scan and release the idle allocations allowed by the policy.
+
+        Returns:
+            dict -- "candidates": (deviceID, user, idleMinutes) list, "results": the
+                    per-device map from releaseDevices (empty on a dry run),
+                    "recoveredDeviceMinutes": idle minutes of the released devices.
+        """
+        candidates = self.scan()
+        if self.maxReleasePerRun is not None:
+            candidates = candidates[:self.maxReleasePerRun]
+        results = {}
+        recovered = 0.0
+        failed = 0
+        if candidates and not self.dryRun:
+            results = self.devices.releaseDevices([c[0] for c in candidates], self.admin, self.maxWorkers)
+            with self.__lock:
+                for (deviceID, user, idleFor) in candidates:
+                    if results[deviceID]["success"]:
+                        recovered += idleFor
+                        self.__allocations.pop(deviceID, None)
+                    else:
+                        failed += 1
+        elif candidates:
+            recovered = sum(c[2] for c in candidates)
+            log.info("dry run, would release '%s'" % ", ".join(c[0] for c in candidates))
+        released = len(candidates) - failed
+        self.stats["runs"] += 1
+        if not self.dryRun:
+            self.stats["released"] += released
+            self.stats["failed"] += failed
+            self.stats["recoveredDeviceMinutes"] += recovered
+        self.__emit(released, failed, recovered)
+        return {"candidates": candidates, "results": results, "recoveredDeviceMinutes": recovered}
+
+    def __emit(self, released, failed, recovered):
+        if not self.metrics:
+            return
+        tags = {"dryRun": self.dryRun}
+        try:
+            self.metrics("reaper.released", released, tags)
+            self.metrics("reaper.failed", failed, tags)
+            self.metrics("reaper.recoveredDeviceMinutes", recovered, tags)
+        except Exception as e:
+            log.error("reaper metrics callback failed because '%s'" % e.message)
+
+    def start(self, interval=60):
+        """
+        Run reap() every interval seconds on a background thread.
+        """
+        if self.__thread is not None:
+            return
+        self.__stop.clear()
+
+        def loop():
+            while not self.__stop.wait(interval):
+                try:
+                    self.reap()
+                except Exception as e:
+                    log.error("reaper run failed because '%s'" % e.message)
+
+        self.__thread = threading.Thread(target=loop, name="AllocationReaper")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        """
+        Stop the background thread started by start().
+        """
+        if self.__thread is None:
+            return
+        self.__stop.set()
+        self.__thread.join()
+        self.__thread = None
@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from .__init__ import log, runConcurrently
+import threading
+import time
+
+
+class TimerWheel(object):
+    """
+    Hierarchical timer wheel.
+
+    Level 0 has one slot per tick, each level above covers slots times the range of
+    the level below. Scheduling and cancelling are O(1) and advancing costs one slot
+    visit per tick plus the occasional cascade of a higher slot, however many timers
+    are pending. Timers due further out than the top level wait in an overflow set.
+    """
+
+    def __init__(self, resolution=1.0, slots=64, levels=4, now=None):
+        """
+        Keyword Arguments:
+            resolution {float} -- Seconds per tick. Timers in the same tick fire together. (default: {1.0})
+            slots {int} -- Slots per level. (default: {64})
+            levels {int} -- Number of levels. (default: {4})
+            now {float} -- Current time in seconds. (default: {time.time()})
+        """
+        self.resolution = resolution
+        self.slots = slots
+        self.levels = levels
+        self.__wheels = [[{} for _ in range(slots)] for _ in range(levels)]
+        self.__overflow = {}
+        self.__where = {}
+        self.__tick = int((time.time() if now is None else now) // resolution)
+
+    def __len__(self):
+        return len(self.__where)
+
+    def __contains__(self, key):
+        return key in self.__where
+
+    def __place(self, key, dueTick, value, soonest=1):
+        delta = dueTick - self.__tick
+        if delta < soonest:
+            level, slot = 0, (self.__tick + soonest) % self.slots
+        else:
+            level = 0
+            while level < self.levels and delta >= self.slots ** (level + 1):
+                level += 1
+            if level == self.levels:
+                self.__overflow[key] = (dueTick, value)
+                self.__where[key] = None
+                return
+            slot = (dueTick // self.slots ** level) % self.slots
+        self.__wheels[level][slot][key] = (dueTick, value)
+        self.__where[key] = (level, slot)
+
+    def schedule(self, key, due, value=None):
+        """
+        Schedule or reschedule the timer key to fire at due (seconds since the epoch).
+        """
+        self.cancel(key)
+        self.__place(key, int(due // self.resolution), value)
+
+    def cancel(self, key):
+        """
+        Remove a timer. Returns its value, or None if it was not scheduled.
+        """
+        where = self.__where.pop(key, False)
+        if where is False:
+            return None
+        if where is None:
+            return self.__overflow.pop(key)[1]
+        level, slot = where
+        return self.__wheels[level][slot].pop(key)[1]
+
+    def __cascade(self, level, slot):
+        entries = self.__wheels[level][slot]
+        self.__wheels[level][slot] = {}
+        for (key, (dueTick, value)) in entries.items():
+            self.__place(key, dueTick, value, 0)
+
+    def advance(self, now=None):
+        """
+        Move the wheel to now and return the timers that came due as (key, value) pairs.
+        """
+        target = int((time.time() if now is None else now) // self.resolution)
+        due = []
+        while self.__tick < target:
+            self.__tick += 1
+            tick = self.__tick
+            for level in range(self.levels - 1, 0, -1):
+                span = self.slots ** level
+                if tick % span == 0:
+                    if level == self.levels - 1 and self.__overflow:
+                        overflow = self.__overflow
+                        self.__overflow = {}
+                        for (key, (dueTick, value)) in overflow.items():
+                            self.__place(key, dueTick, value, 0)
+                    self.__cascade(level, (tick // span) % self.slots)
+            slot = tick % self.slots
+            entries = self.__wheels[0][slot]
+            self.__wheels[0][slot] = {}
+            for (key, (dueTick, value)) in entries.items():
+                if dueTick > tick:
+                    self.__place(key, dueTick, value)
+                    continue
+                del self.__where[key]
+                due.append((key, value))
+        return due
+
+
+class RenewalScheduler(object):
+    """
+    Process-wide scheduler that keeps reservations alive for long suites.
+
+    Each watched reservation is extended with updateReservation a little before it
+    ends. Renewals are kept in a TimerWheel; all renewals that come due in the same
+    tick are sent together as concurrent updateReservation calls, retried on failure.
+    Set it as Reservations.renewals and deleting a reservation through that object
+    also cancels its renewal.
+
+        renewals = RenewalScheduler(reservations, extendBy=30 * 60 * 1000)
+        reservations.renewals = renewals
+        renewals.start()
+        renewals.watch(reservationID, endTime, until=suiteDeadline)
+    """
+
+    def __init__(self, reservations, renewBefore=5 * 60 * 1000, extendBy=30 * 60 * 1000, batchWindow=5.0,
+                 retries=3, retryDelay=2.0, maxWorkers=8, admin=False, onFailure=None):
+        """
+        Arguments:
+            reservations {Reservations} -- Reservations instance used for updateReservation.
+
+        Keyword Arguments:
+            renewBefore {long} -- Renew this many ms before the reservation ends. (default: {five minutes})
+            extendBy {long} -- Move the end time this many ms past the current end time. (default: {30 minutes})
+            batchWindow {float} -- Tick length in seconds; renewals due in one tick are batched. (default: {5.0})
+            retries {int} -- Attempts per renewal before giving up. (default: {3})
+            retryDelay {float} -- Seconds before the first retry, doubled for each further one. (default: {2.0})
+            maxWorkers {int} -- The most updateReservation calls in flight at the same time. (default: {8})
+            admin {bool} -- Renew as admin. (default: {False})
+            onFailure {callable} -- Called as onFailure(reservationID, error) when a renewal gives up. (default: {None})
+        """
+        self.reservations = reservations
+        self.renewBefore = renewBefore
+        self.extendBy = extendBy
+        self.retries = retries
+        self.retryDelay = retryDelay
+        self.maxWorkers = maxWorkers
+        self.admin = admin
+        self.onFailure = onFailure
+        self.wheel = TimerWheel(batchWindow)
+        self.__active = {}
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def watch(self, reservationID, endTime, until=None, extendBy=None):
+        """
+        Keep a reservation alive.
+
+        Arguments:
+            reservationID {string} -- The reservation to renew.
+            endTime {long} -- Its current end time in ms.
+
+        Keyword Arguments:
+            until {long} -- Do not extend past this time in ms. (default: {None, renew until cancelled})
+            extendBy {long} -- Override the scheduler's extendBy for this reservation. (default: {None})
+        """
+        entry = {"id": "%s" % reservationID, "endTime": int(endTime), "until": until,
+                 "extendBy": extendBy or self.extendBy}
+        with self.__lock:
+            self.__active[entry["id"]] = entry
+        self.__schedule(entry)
+
+    def __schedule(self, entry):
+        if entry["until"] is not None and entry["endTime"] >= entry["until"]:
+            log.debug("reservation '%s' reached its final end time" % entry["id"])
+            with self.__lock:
+                self.__active.pop(entry["id"], None)
+            return
+        with self.__lock:
+            if self.__active.get(entry["id"]) is not entry:
+                return
+            self.wheel.schedule(entry["id"], (entry["endTime"] - self.renewBefore) / 1000.0, entry)
+
+    def cancel(self, reservationID):
+        """
+        Stop renewing a reservation. Returns True if it was being renewed.
+        """
+        with self.__lock:
+            self.wheel.cancel("%s" % reservationID)
+            return self.__active.pop("%s" % reservationID, None) is not None
+
+    def watching(self):
+        with self.__lock:
+            return len(self.__active)
+
+    def __renew(self, entry):
+        newEnd = entry["endTime"] + entry["extendBy"]
+        if entry["until"] is not None:
+            newEnd = min(newEnd, entry["until"])
+        delay = self.retryDelay
+        for attempt in range(1, self.retries + 1):
+            try:
+                rslt = self.reservations.updateReservation(entry["id"], endTime=newEnd, admin=self.admin)
+                entry["endTime"] = newEnd
+                return rslt
+            except Exception as e:
+                log.warn("renewal of '%s' failed on attempt '%s' because '%s'" % (entry["id"], attempt, e.message))
+                if attempt == self.retries:
+                    raise
+                if self.__stop.wait(delay):
+                    raise
+                delay *= 2
+
+    def renewDue(self, now=None):
+        """
+        Send every renewal that is due now and schedule the next one for each.
+        Returns the per-reservation result map.
+        """
+        with self.__lock:
+            due = self.wheel.advance(now)
+        if not due:
+            return {}
+        log.debug("renewing '%s' reservations" % len(due))
+        results = runConcurrently(self.__renew, [(key, (entry,), {}) for (key, entry) in due], self.maxWorkers)
+        for (key, entry) in due:
+            if results[key]["success"]:
+                self.__schedule(entry)
+            else:
+                log.error("giving up renewing '%s' because '%s'" % (key, results[key]["error"]))
+                with self.__lock:
+                    if self.__active.get(key) is entry:
+                        del self.__active[key]
+                if self.onFailure:
+                    try:
+                        self.onFailure(key, results[key]["error"])
+                    except Exception as e:
+                        log.error("renewal failure callback failed because '%s'" % e.message)
+        return results
+
+    def start(self):
+        """
+        Tick the wheel on a background thread. Each tick's batch is sent on its own
+        thread so a slow batch does not delay the next tick.
+        """
+        if self.__thread is not None:
+            return
+        self.__stop.clear()
+
+        def loop():
+            while not self.__stop.wait(self.wheel.resolution):
+                batch = threading.Thread(target=self.__safeRenewDue, name="RenewalBatch")
+                batch.daemon = True
+                batch.start()
+
+        self.__thread = threading.Thread(target=loop, name="RenewalScheduler")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __safeRenewDue(self):
+        try:
+            self.renewDue()
+        except Exception as e:
+            log.error("renewal batch failed because '%s'" % e.message)
+
+    def stop(self):
+        if self.__thread is None:
+            return
+        self.__stop.set()
+        self.__thread.join()
+        self.__thread = None
@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Columnar analytics over many execution reports.
+
+    Requires numpy. Tests and steps are pulled out of parsed reports into flat
+    records, then held as numpy arrays with the string columns dictionary encoded.
+"""
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from .__init__ import log
+from .columnar import encode, writeCSV, writeParquet
+from collections import OrderedDict
+import json
+import os
+try:
+    import numpy as np
+except ImportError:  # pragma no cover
+    np = None
+
+TEST_ELEMENTS = ("test", "testResult", "testCase")
+STEP_ELEMENTS = ("step", "command")
+DEVICE_ELEMENTS = ("device", "deviceInfo", "handset")
+PASSED = ("passed", "pass", "success", "succeeded")
+FAILED = ("failed", "fail", "failure", "error", "errored")
+STRING_COLUMNS = ("report", "test", "step", "status", "device", "model", "os")
+
+
+def _field(node, *names):
+    """First of names found as an attribute or text child of node."""
+    for name in names:
+        for key in ("@" + name, name):
+            value = node.get(key)
+            if isinstance(value, dict):
+                value = value.get("#text")
+            if isinstance(value, basestring):
+                return value
+    return None
+
+
+def _duration(node):
+    """Duration in ms from a duration field or startTime/endTime, NaN when unknown."""
+    try:
+        return float(_field(node, "duration"))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return float(_field(node, "endTime")) - float(_field(node, "startTime"))
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def _children(node):
+    for (key, value) in node.items():
+        if key.startswith("@") or key == "#text":
+            continue
+        for child in (value if isinstance(value, list) else [value]):
+            if isinstance(child, dict):
+                yield key, child
+
+
+def _device(node):
+    """Device fields from the first device element under node, not looking inside tests."""
+    todo = [node]
+    while todo:
+        current = todo.pop(0)
+        for (name, child) in _children(current):
+            if name in DEVICE_ELEMENTS:
+                return {"device": _field(child, "deviceId", "id", "name") or "",
+                        "model": _field(child, "model") or "",
+                        "os": " ".join(filter(None, [_field(child, "os"), _field(child, "osVersion")]))}
+            if name not in TEST_ELEMENTS:
+                todo.append(child)
+    return {"device": "", "model": "", "os": ""}
+
+
+def extractRecords(doc, report=""):
+    """
+    Pull the tests and their steps out of a parsed report (getExecutionReport,
+    parseReport or xmltodict output) as flat records. Usable as a processReports
+    extractor.
+
+    Elements named in TEST_ELEMENTS are tests and elements named in STEP_ELEMENTS
+    inside them are steps. Device fields come from a DEVICE_ELEMENTS element in the
+    test, or else in the report.
+
+    Returns:
+        dict -- "tests" and "steps" lists of records with report, test, step,
+                status, device, model, os and duration (ms) fields. Steps also
+                carry their message, which is not kept in a ReportFrame.
+    """
+    tests, steps = [], []
+    reportDevice = _device(doc)
+    todo = [doc]
+    while todo:
+        node = todo.pop()
+        for (name, child) in _children(node):
+            if name not in TEST_ELEMENTS:
+                todo.append(child)
+                continue
+            device = _device(child)
+            if not any(device.values()):
+                device = reportDevice
+            test = dict(device, report=report, test=_field(child, "name") or "", step="",
+                        status=(_field(child, "status") or "").lower(), duration=_duration(child))
+            tests.append(test)
+            inner = [child]
+            while inner:
+                for (stepName, step) in _children(inner.pop()):
+                    if stepName in STEP_ELEMENTS:
+                        steps.append(dict(test, step=_field(step, "name") or stepName,
+                                          status=(_field(step, "status") or "").lower(), duration=_duration(step),
+                                          message=_field(step, "message", "error", "failureReason", "description") or ""))
+                    inner.append(step)
+    return {"tests": tests, "steps": steps}
+
+
+class ReportFrame(object):
+    """
+    Test or step records held as columnar numpy arrays.
+
+    Every column in STRING_COLUMNS is dictionary encoded: codes[name][i] indexes
+    categories[name]. duration is float64 ms with NaN where unknown. Statuses in
+    PASSED and FAILED are passes and failures; any other status, such as skipped
+    or none at all, is neither.
+
+        frames = ReportAnalytics.fromResults(reporting.processReports(keys, extractRecords))
+        frames.tests.passRate(by="model")
+        frames.steps.percentiles(by="step", q=(50, 95))
+        frames.steps.hotspots(by=("model", "step"))
+    """
+
+    def __init__(self, codes, categories, duration):
+        if np is None:
+            raise Exception("numpy is required for report analytics.")
+        self.codes = OrderedDict((n, np.asarray(codes[n], dtype=np.int32)) for n in STRING_COLUMNS)
+        self.categories = dict((n, list(categories[n])) for n in STRING_COLUMNS)
+        self.duration = np.asarray(duration, dtype=np.float64)
+
+    @classmethod
+    def fromRecords(cls, records):
+        if np is None:
+            raise Exception("numpy is required for report analytics.")
+        records = list(records)
+        codes, categories = {}, {}
+        for name in STRING_COLUMNS:
+            codes[name], categories[name] = encode([r.get(name) or "" for r in records])
+        duration = np.array([r.get("duration", float("nan")) for r in records], dtype=np.float64)
+        return cls(codes, categories, duration)
+
+    def __len__(self):
+        return len(self.duration)
+
+    def labels(self, name):
+        categories = self.categories[name]
+        return [categories[c] for c in self.codes[name]]
+
+    def where(self, **equals):
+        """
+        Boolean mask of the records whose columns equal the given values,
+        for example where(status="failed", model="Galaxy S9").
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for (name, value) in equals.items():
+            categories = self.categories[name]
+            if value not in categories:
+                return np.zeros(len(self), dtype=bool)
+            mask &= self.codes[name] == categories.index(value)
+        return mask
+
+    def filter(self, mask):
+        return ReportFrame(dict((n, c[mask]) for (n, c) in self.codes.items()), self.categories, self.duration[mask])
+
+    def __groups(self, by):
+        """Return (group ids, labels) for one column name or a tuple of them."""
+        names = (by,) if isinstance(by, basestring) else tuple(by)
+        for name in names:
+            if name not in self.codes:
+                raise Exception("Unknown group '%s'. Use %s." % (name, ", ".join(STRING_COLUMNS)))
+        key = np.zeros(len(self), dtype=np.int64)
+        for name in names:
+            key = key * max(1, len(self.categories[name])) + self.codes[name]
+        unique, ids = np.unique(key, return_inverse=True)
+        labels = []
+        for k in unique.tolist():
+            parts = []
+            for name in reversed(names):
+                size = max(1, len(self.categories[name]))
+                parts.append(self.categories[name][k % size])
+                k //= size
+            parts.reverse()
+            labels.append(parts[0] if len(parts) == 1 else tuple(parts))
+        return ids, labels
+
+    def count(self, by):
+        ids, labels = self.__groups(by)
+        return dict(zip(labels, np.bincount(ids, minlength=len(labels)).tolist()))
+
+    def __status(self, statuses):
+        categories = self.categories["status"]
+        return np.in1d(self.codes["status"], [i for (i, s) in enumerate(categories) if s in statuses])
+
+    def passRate(self, by):
+        """
+        Share of passed records per group, out of the records that passed or failed.
+
+        Returns:
+            dict -- label -> (passRate, records), records counting every status
+        """
+        ids, labels = self.__groups(by)
+        total = np.bincount(ids, minlength=len(labels))
+        passed = np.bincount(ids, weights=self.__status(PASSED), minlength=len(labels))
+        decided = passed + np.bincount(ids, weights=self.__status(FAILED), minlength=len(labels))
+        return dict((label, (p / d if d else 0.0, int(t)))
+                    for (label, p, d, t) in zip(labels, passed.tolist(), decided.tolist(), total.tolist()))
+
+    def hotspots(self, by="model", top=10):
+        """
+        Groups with the most failed records.
+
+        Returns:
+            list -- (label, failures, records, failureRate) sorted by failures, at most top
+                    long. failureRate is out of the records that passed or failed.
+        """
+        ids, labels = self.__groups(by)
+        total = np.bincount(ids, minlength=len(labels))
+        failed = np.bincount(ids, weights=self.__status(FAILED), minlength=len(labels))
+        decided = failed + np.bincount(ids, weights=self.__status(PASSED), minlength=len(labels))
+        order = np.lexsort((-total, -failed))[:top]
+        return [(labels[i], int(failed[i]), int(total[i]), failed[i] / decided[i]) for i in order if failed[i]]
+
+    def percentiles(self, by=None, q=(50, 90, 99)):
+        """
+        Duration percentiles in ms, ignoring unknown durations.
+
+        Returns:
+            list or dict -- the percentiles, or label -> percentiles when by is given.
+        """
+        known = ~np.isnan(self.duration)
+        if by is None:
+            values = self.duration[known]
+            return np.percentile(values, q).tolist() if len(values) else None
+        ids, labels = self.__groups(by)
+        ids, duration = ids[known], self.duration[known]
+        order = np.lexsort((duration, ids))
+        ids, duration = ids[order], duration[order]
+        bounds = np.searchsorted(ids, np.arange(len(labels) + 1))
+        result = {}
+        for (i, label) in enumerate(labels):
+            values = duration[bounds[i]:bounds[i + 1]]
+            result[label] = np.percentile(values, q).tolist() if len(values) else None
+        return result
+
+    def columns(self):
+        """
+        Return the records as a dict of decoded columns, ready for writeCSV or writeParquet.
+        """
+        columns = OrderedDict((n, self.labels(n)) for n in STRING_COLUMNS)
+        columns["duration"] = self.duration
+        return columns
+
+    def toCSV(self, path):
+        writeCSV(self.columns(), path)
+
+    def toParquet(self, path):
+        writeParquet(self.columns(), path)
+
+    def save(self, directory):
+        """
+        Write the arrays as .npy files plus categories.json into directory.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for (name, codes) in self.codes.items():
+            np.save(os.path.join(directory, "%s.npy" % name), codes)
+        np.save(os.path.join(directory, "duration.npy"), self.duration)
+        with open(os.path.join(directory, "categories.json"), "w") as f:
+            json.dump(self.categories, f)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """
+        Read a frame written by save. With mmap the arrays are memory-mapped
+        read only instead of read into memory.
+        """
+        if np is None:
+            raise Exception("numpy is required for report analytics.")
+        mode = "r" if mmap else None
+        with open(os.path.join(directory, "categories.json")) as f:
+            categories = json.load(f)
+        codes = dict((n, np.load(os.path.join(directory, "%s.npy" % n), mmap_mode=mode)) for n in STRING_COLUMNS)
+        frame = cls.__new__(cls)
+        frame.codes = OrderedDict((n, codes[n]) for n in STRING_COLUMNS)
+        frame.categories = categories
+        frame.duration = np.load(os.path.join(directory, "duration.npy"), mmap_mode=mode)
+        return frame
+
+
+class ReportAnalytics(object):
+    """
+    A tests frame and a steps frame built from many reports.
+    """
+
+    def __init__(self, tests, steps):
+        self.tests = tests
+        self.steps = steps
+
+    @classmethod
+    def fromReports(cls, reports):
+        """
+        Build from (reportKey, parsed report) pairs, for example getExecutionReport results.
+        """
+        return cls.fromRecords(extractRecords(doc, key) for (key, doc) in reports)
+
+    @classmethod
+    def fromResults(cls, results):
+        """
+        Build from a Reporting.processReports result map run with extractRecords.
+        Failed entries are skipped.
+        """
+        extracted = []
+        for (key, outcome) in results.items():
+            if not outcome["success"]:
+                log.warn("skipping report '%s': '%s'" % (key, outcome["error"]))
+                continue
+            for name in ("tests", "steps"):
+                for record in outcome["result"][name]:
+                    record["report"] = record.get("report") or key
+            extracted.append(outcome["result"])
+        return cls.fromRecords(extracted)
+
+    @classmethod
+    def fromRecords(cls, extracted):
+        tests, steps = [], []
+        for records in extracted:
+            tests.extend(records["tests"])
+            steps.extend(records["steps"])
+        log.debug("report analytics holds '%s' tests and '%s' steps" % (len(tests), len(steps)))
+        return cls(ReportFrame.fromRecords(tests), ReportFrame.fromRecords(steps))
+
+    def save(self, directory):
+        self.tests.save(os.path.join(directory, "tests"))
+        self.steps.save(os.path.join(directory, "steps"))
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        return cls(ReportFrame.load(os.path.join(directory, "tests"), mmap),
+                   ReportFrame.load(os.path.join(directory, "steps"), mmap))
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from .__init__ import log
+from contextlib import contextmanager
+from io import BytesIO
+import errno
+import fcntl
+import hashlib
+import os
+import tempfile
+import zlib
+
+
+class ReportCache(object):
+    """
+    Persistent on-disk cache for report and attachment payloads that never change.
+
+    Entries are addressed by a hash of (reportKey, operation, attachment, format) and
+    stored zlib compressed, one file per entry. Writes go to a temporary file that is
+    renamed into place, so readers in other processes never see half an entry. When
+    the cache grows past maxBytes the least recently used entries are evicted under
+    an exclusive lock file.
+
+    Only cache reports of executions that have finished; a running execution's
+    report still changes.
+
+        reporting.cache = ReportCache(os.path.expanduser("~/.cache/perfecto-reports"))
+    """
+
+    def __init__(self, directory, maxBytes=1024 * 1024 * 1024, level=6, chunkSize=64 * 1024):
+        """
+        Arguments:
+            directory {string} -- Where the cache lives. Created when missing.
+
+        Keyword Arguments:
+            maxBytes {int} -- Size of the cache on disk before eviction. (default: {1 GiB})
+            level {int} -- zlib compression level. (default: {6})
+            chunkSize {int} -- Bytes per chunk when streaming. (default: {64 KiB})
+        """
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.level = level
+        self.chunkSize = chunkSize
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        self.__size = None
+
+    @staticmethod
+    def key(reportKey, operation, attachment="", format=""):
+        return hashlib.sha256("\0".join(["%s" % p for p in (reportKey, operation, attachment or "", format or "")])
+                              .encode("utf-8")).hexdigest()
+
+    def path(self, reportKey, operation, attachment="", format=""):
+        digest = self.key(reportKey, operation, attachment, format)
+        return os.path.join(self.directory, digest[:2], digest[2:] + ".z")
+
+    def getStream(self, output, reportKey, operation, attachment="", format=""):
+        """
+        Decompress an entry into the file object output.
+
+        Returns:
+            int or None -- bytes written, or None on a miss.
+        """
+        path = self.path(reportKey, operation, attachment, format)
+        try:
+            f = open(path, "rb")
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+        written = 0
+        try:
+            with f:
+                decompressor = zlib.decompressobj()
+                for chunk in iter(lambda: f.read(self.chunkSize), b""):
+                    data = decompressor.decompress(chunk)
+                    output.write(data)
+                    written += len(data)
+                data = decompressor.flush()
+                output.write(data)
+                written += len(data)
+        except zlib.error as e:
+            log.warn("dropping corrupt cache entry '%s' because '%s'" % (path, e))
+            self.__discard(path)
+            raise Exception("Corrupt cache entry for '%s'." % reportKey)
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        log.debug("cache hit for '%s' '%s' '%s'" % (reportKey, operation, attachment))
+        return written
+
+    def get(self, reportKey, operation, attachment="", format=""):
+        """
+        Return the bytes stored for an entry, or None on a miss.
+        """
+        output = BytesIO()
+        try:
+            if self.getStream(output, reportKey, operation, attachment, format) is None:
+                return None
+        except Exception:
+            return None
+        return output.getvalue()
+
+    def putStream(self, source, reportKey, operation, attachment="", format=""):
+        """
+        Store everything read from the file object source as an entry.
+
+        Returns:
+            int -- compressed size on disk
+        """
+        path = self.path(reportKey, operation, attachment, format)
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        fd, tmpPath = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                compressor = zlib.compressobj(self.level)
+                for chunk in iter(lambda: source.read(self.chunkSize), b""):
+                    f.write(compressor.compress(chunk))
+                f.write(compressor.flush())
+            os.rename(tmpPath, path)
+        except Exception:
+            self.__discard(tmpPath)
+            raise
+        size = os.path.getsize(path)
+        if self.__size is not None:
+            self.__size += size
+        if self.__size is None or self.__size > self.maxBytes:
+            self.evict()
+        return size
+
+    def put(self, data, reportKey, operation, attachment="", format=""):
+        """
+        Store bytes as an entry.
+        """
+        return self.putStream(BytesIO(data), reportKey, operation, attachment, format)
+
+    @contextmanager
+    def __locked(self):
+        with open(os.path.join(self.directory, ".lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def __entries(self):
+        entries = []
+        for (folder, dirs, files) in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".z"):
+                    continue
+                path = os.path.join(folder, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def __discard(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in maxBytes.
+        Safe to run from several processes at once.
+        """
+        with self.__locked():
+            entries = self.__entries()
+            total = sum(e[1] for e in entries)
+            entries.sort()
+            removed = 0
+            for (mtime, size, path) in entries:
+                if total <= self.maxBytes:
+                    break
+                self.__discard(path)
+                total -= size
+                removed += 1
+            self.__size = total
+        if removed:
+            log.debug("evicted '%s' cache entries, '%s' bytes left" % (removed, total))
+        return removed
+
+    def size(self):
+        return sum(e[1] for e in self.__entries())
+
+    def clear(self):
+        with self.__locked():
+            for (mtime, size, path) in self.__entries():
+                self.__discard(path)
+            self.__size = 0
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from .__init__ import log, timeMilis
+from .executions import executionFinished, executionItems
+from .reportanalytics import extractRecords
+import sqlite3
+import threading
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS reports (reportKey TEXT PRIMARY KEY, executionId TEXT, startTime INTEGER,
+                                    status TEXT, indexedAt INTEGER);
+CREATE TABLE IF NOT EXISTS tests (id INTEGER PRIMARY KEY, reportKey TEXT, test TEXT, status TEXT, device TEXT,
+                                  model TEXT, os TEXT, duration REAL);
+CREATE TABLE IF NOT EXISTS steps (id INTEGER PRIMARY KEY, reportKey TEXT, test TEXT, step TEXT, status TEXT,
+                                  device TEXT, model TEXT, os TEXT, duration REAL, message TEXT);
+CREATE INDEX IF NOT EXISTS reports_start ON reports (startTime);
+CREATE INDEX IF NOT EXISTS tests_report ON tests (reportKey);
+CREATE INDEX IF NOT EXISTS steps_report ON steps (reportKey);
+CREATE INDEX IF NOT EXISTS steps_status ON steps (status, step);
+CREATE VIRTUAL TABLE IF NOT EXISTS steps_fts USING fts4 (content="steps", test, step, message);
+"""
+
+_STEP_COLUMNS = ("reportKey", "test", "step", "status", "device", "model", "os", "duration", "message")
+_TEST_COLUMNS = ("reportKey", "test", "status", "device", "model", "os", "duration")
+
+
+def _millis(value):
+    """Times may come back from the server as {"millis": ..., "formatted": ...} or as plain numbers."""
+    if isinstance(value, dict):
+        value = value.get("millis")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ReportIndex(object):
+    """
+    Local SQLite index of execution reports with full text search over their steps.
+
+    update() lists executions started since the high-water mark, downloads only the reports of finished
+    executions it has not indexed yet (parsed in a process pool through
+    Reporting.processReports) and moves a high-water mark forward, so later
+    updates skip everything older than the oldest execution still running.
+
+        index = ReportIndex("reports.db", reporting, executions)
+        index.update()
+        index.search('"element not found"', step="click", status="failed")
+    """
+
+    def __init__(self, path, reporting, executions=None, processes=None):
+        """
+        Arguments:
+            path {string} -- SQLite database file, created when missing.
+            reporting {Reporting} -- used to download reports.
+
+        Keyword Arguments:
+            executions {Executions} -- used by update() to find new reports. (default: {None})
+            processes {int} -- report parsing processes, see processReports. (default: {cpu count})
+        """
+        self.reporting = reporting
+        self.executions = executions
+        self.processes = processes
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.__lock = threading.Lock()
+        with self.__lock:
+            self.db.executescript(_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def highWater(self):
+        """
+        Start time (ms) before which every finished execution is indexed, or None.
+        """
+        with self.__lock:
+            row = self.db.execute("SELECT value FROM meta WHERE name = 'highWater'").fetchone()
+        return _millis(row[0]) if row else None
+
+    def indexed(self, reportKey):
+        with self.__lock:
+            return self.db.execute("SELECT 1 FROM reports WHERE reportKey = ?", (reportKey,)).fetchone() is not None
+
+    def add(self, reportKey, doc, executionId=None, startTime=None, status=None):
+        """
+        Index an already parsed report, or the result of extractRecords on it.
+
+        Returns:
+            bool -- False when the report was indexed before.
+        """
+        records = doc if isinstance(doc, dict) and "steps" in doc and "tests" in doc else extractRecords(doc, reportKey)
+        with self.__lock, self.db:
+            if self.db.execute("SELECT 1 FROM reports WHERE reportKey = ?", (reportKey,)).fetchone():
+                return False
+            self.db.execute("INSERT INTO reports VALUES (?, ?, ?, ?, ?)",
+                            (reportKey, executionId, startTime, status, timeMilis()))
+            self.db.executemany("INSERT INTO tests (%s) VALUES (%s)" % (", ".join(_TEST_COLUMNS), ", ".join("?" * len(_TEST_COLUMNS))),
+                                [tuple(reportKey if c == "reportKey" else t.get(c) for c in _TEST_COLUMNS)
+                                 for t in records["tests"]])
+            for step in records["steps"]:
+                cursor = self.db.execute("INSERT INTO steps (%s) VALUES (%s)" % (", ".join(_STEP_COLUMNS), ", ".join("?" * len(_STEP_COLUMNS))),
+                                         tuple(reportKey if c == "reportKey" else step.get(c) for c in _STEP_COLUMNS))
+                self.db.execute("INSERT INTO steps_fts (docid, test, step, message) VALUES (?, ?, ?, ?)",
+                                (cursor.lastrowid, step.get("test"), step.get("step"), step.get("message")))
+        return True
+
+    def update(self, reportKeys=None, maxWorkers=None, progress=None, **filters):
+        """
+        Index new reports.
+
+        Keyword Arguments:
+            reportKeys {list} -- index these reports instead of asking executions
+                                 for new ones. (default: {None})
+            maxWorkers {int} -- concurrent downloads, see processReports. (default: {None})
+            progress {callable} -- see processReports. (default: {None})
+            **filters -- passed to Executions.getExecutionsList. startTime is raised
+                         to the high-water mark.
+
+        Returns:
+            dict -- "indexed" count, "failed" reportKey -> error, and "highWater".
+        """
+        found = {}
+        newHighWater = None
+        if reportKeys is None:
+            if self.executions is None:
+                raise Exception("executions is required to find new reports.")
+            highWater = self.highWater()
+            if highWater is not None:
+                # Let the server skip what is already indexed; the check below stays
+                # for servers that ignore the filter.
+                filters["startTime"] = max(highWater, _millis(filters.get("startTime")) or 0)
+            running = []
+            for item in executionItems(self.executions.getExecutionsList(**filters)):
+                startTime = _millis(item.get("startTime"))
+                if highWater is not None and startTime is not None and startTime < highWater:
+                    continue
+                if not executionFinished(item):
+                    if startTime is not None:
+                        running.append(startTime)
+                    continue
+                if item.get("reportKey"):
+                    found[item["reportKey"]] = item
+                    newHighWater = max(newHighWater, startTime)
+            if running:
+                newHighWater = min(running)
+            reportKeys = list(found)
+        reportKeys = [k for k in reportKeys if not self.indexed(k)]
+        log.debug("indexing '%s' new reports" % len(reportKeys))
+        results = self.reporting.processReports(reportKeys, extractRecords, processes=self.processes,
+                                                maxWorkers=maxWorkers, progress=progress) if reportKeys else {}
+        indexed = 0
+        failed = {}
+        for (reportKey, outcome) in results.items():
+            if not outcome["success"]:
+                failed[reportKey] = outcome["error"]
+                continue
+            item = found.get(reportKey, {})
+            if self.add(reportKey, outcome["result"], item.get("executionId"), _millis(item.get("startTime")), item.get("status")):
+                indexed += 1
+        if failed and found:
+            # Retry failed reports next time: keep the mark at or before the oldest of them.
+            starts = [_millis(found[k].get("startTime")) for k in failed]
+            starts = [s for s in starts if s is not None]
+            if starts:
+                newHighWater = min([newHighWater] + starts) if newHighWater is not None else min(starts)
+        if newHighWater is not None and newHighWater > (self.highWater() or 0):
+            with self.__lock, self.db:
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES ('highWater', ?)", ("%s" % newHighWater,))
+        return {"indexed": indexed, "failed": failed, "highWater": self.highWater()}
+
+    def search(self, text=None, status=None, step=None, test=None, model=None, since=None, until=None, limit=100):
+        """
+        Find steps, newest reports first.
+
+        Keyword Arguments:
+            text {string} -- SQLite full text query over test name, step name and
+                             message, for example '"element not found"'. (default: {None})
+            status {string} -- step status, for example "failed". (default: {None})
+            step {string} -- exact step name. (default: {None})
+            test {string} -- exact test name. (default: {None})
+            model {string} -- exact device model. (default: {None})
+            since {long} -- only reports started at or after this time (ms). (default: {None})
+            until {long} -- only reports started before this time (ms). (default: {None})
+            limit {int} -- most rows returned. (default: {100})
+
+        Returns:
+            list -- dicts with reportKey, startTime and the step columns.
+        """
+        sql = ["SELECT s.*, r.startTime FROM steps s JOIN reports r ON r.reportKey = s.reportKey"]
+        where, args = [], []
+        if text:
+            sql.append("JOIN steps_fts f ON f.docid = s.id")
+            where.append("steps_fts MATCH ?")
+            args.append(text)
+        for (column, value) in (("s.status", status), ("s.step", step), ("s.test", test), ("s.model", model)):
+            if value is not None:
+                where.append("%s = ?" % column)
+                args.append(value)
+        if since is not None:
+            where.append("r.startTime >= ?")
+            args.append(since)
+        if until is not None:
+            where.append("r.startTime < ?")
+            args.append(until)
+        if where:
+            sql.append("WHERE " + " AND ".join(where))
+        sql.append("ORDER BY r.startTime DESC, s.id LIMIT ?")
+        args.append(limit)
+        with self.__lock:
+            rows = self.db.execute(" ".join(sql), args).fetchall()
+        return [dict(zip(row.keys(), row)) for row in rows]
+
+    def failures(self, text=None, **kwargs):
+        """
+        search() for failed steps.
+        """
+        return self.search(text, status="failed", **kwargs)
@@ -2,8 +2,184 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
-from .__init__ import APIBase, log
+from .__init__ import APIBase, APIError, log, properParams, runConcurrently
+from .xmltodict import parse
+from Queue import Queue, Full
+from collections import OrderedDict
 from urllib import urlencode
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+
+
+def attachmentItems(rslt):
+    """
+    Return the attachments in a getReportAttachmentList response as a list of
+    {"type": ..., "attachment": ...} dicts, whether the server answered in xml or json.
+    """
+    if not rslt:
+        return []
+    items = rslt
+    if isinstance(items, dict):
+        for name in ("attachments", "items", "attachment"):
+            if name in items:
+                items = items[name]
+                break
+        else:
+            items = []
+    if isinstance(items, dict):
+        items = items.get("attachment", [items])
+    if isinstance(items, dict):
+        items = [items]
+    found = []
+    for item in items or []:
+        if isinstance(item, basestring):
+            found.append({"type": None, "attachment": item})
+            continue
+        path = item.get("path") or item.get("attachment") or item.get("name") or item.get("#text")
+        found.append(dict(item, type=item.get("type") or item.get("@type"), attachment=path))
+    return [f for f in found if f["attachment"]]
+
+
+def iterXMLItems(xml_input, depth, names=None, queueSize=64, **kwargs):
+    """
+    Yield the elements at one depth of an xml document one at a time, as
+    (path, item) tuples, without building the whole document.
+
+    This is xmltodict.parse streaming mode (item_depth / item_callback) run on a
+    background thread that hands the items over through a bounded queue, so only
+    queueSize items and the element being parsed are held in memory.
+
+    Arguments:
+        xml_input {file or string} -- the document, for example an open response
+        depth {int} -- depth of the wanted elements; the root element is depth 1
+
+    Keyword Arguments:
+        names {list} -- only yield elements with these names (default: {all})
+        queueSize {int} -- parsed items buffered ahead of the consumer (default: {64})
+        **kwargs -- passed to xmltodict.parse, for example force_list
+
+    Returns:
+        generator -- (path, item); item is shaped like in xmltodict.parse output and
+                     path is the list of (name, attributes) from the root down to
+                     the element, so the enclosing elements' attributes are
+                     available with each item.
+    """
+    items = Queue(queueSize)
+    stopped = threading.Event()
+    done = object()
+
+    def put(entry):
+        while not stopped.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def callback(path, item):
+        (name, attrs) = path[-1]
+        if names and name not in names:
+            return True
+        if attrs:
+            # In streaming mode the item's own attributes are only in the path.
+            merged = OrderedDict(("@" + k, v) for (k, v) in attrs.items())
+            if isinstance(item, dict):
+                merged.update(item)
+            elif item is not None:
+                merged["#text"] = item
+            item = merged
+        return put((list(path), item))
+
+    def produce():
+        try:
+            parse(xml_input, item_depth=depth, item_callback=callback, **kwargs)
+            put(done)
+        except Exception as e:
+            if not stopped.is_set():
+                put(e)
+
+    producer = threading.Thread(target=produce, name="XMLItemParser")
+    producer.daemon = True
+    producer.start()
+    try:
+        while True:
+            entry = items.get()
+            if entry is done:
+                return
+            if isinstance(entry, Exception):
+                raise entry
+            yield entry
+    finally:
+        stopped.set()
+
+
+def parseReport(raw, **kwargs):
+    """
+    Parse a downloaded report body, json or xml, into a dict.
+    """
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return parse(raw, **kwargs)
+
+
+def summarizeReport(doc):
+    """
+    Compact summary of a parsed report for processReports: how many elements of
+    each name it has and how many of them have each status.
+
+    Returns:
+        dict -- {"elements": {name: count}, "statuses": {name: {status: count}}}
+    """
+    elements = {}
+    statuses = {}
+    todo = [(None, doc)]
+    while todo:
+        name, node = todo.pop()
+        if isinstance(node, list):
+            todo.extend((name, n) for n in node)
+            continue
+        if name is not None:
+            elements[name] = elements.get(name, 0) + 1
+        if not isinstance(node, dict):
+            continue
+        status = node.get("@status", node.get("status"))
+        if name is not None and isinstance(status, basestring):
+            counts = statuses.setdefault(name, {})
+            counts[status] = counts.get(status, 0) + 1
+        todo.extend((k, v) for (k, v) in node.items() if not k.startswith("@") and k != "#text")
+    return {"elements": elements, "statuses": statuses}
+
+
+def _processInWorker(raw, extractor, parseArgs):
+    return extractor(parseReport(raw, **parseArgs))
+
+
+class _HashingWriter(object):
+    """File wrapper that counts and hashes everything written through it."""
+
+    def __init__(self, f):
+        self.f = f
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.f.write(data)
+        self.update(data)
+
+    def update(self, data):
+        self.size += len(data)
+        self.sha256.update(data)
+
+    def updateFrom(self, f, chunkSize=64 * 1024):
+        for chunk in iter(lambda: f.read(chunkSize), b""):
+            self.update(chunk)
 
 
 class Reporting(APIBase):
@@ -20,6 +196,18 @@ class Reporting(APIBase):
                 baseURL {String}: the url to the web services. Public cloud has a different URL compared to a private cloud.
         """
         self.initClient(securityToken, baseURL)
+        self.cache = None
+
+    def __cachedGet(self, uriStr, reportKey, operation, attachment="", format=""):
+        """send_get through self.cache, when one is set."""
+        if self.cache is not None:
+            data = self.cache.get(reportKey, operation, attachment, format)
+            if data is not None:
+                return json.loads(data.decode("utf-8"))
+        rslt = self.client.send_get(uriStr)
+        if self.cache is not None and rslt:
+            self.cache.put(json.dumps(rslt).encode("utf-8"), reportKey, operation, attachment, format)
+        return rslt
 
     def getExecutionReport(self, reportKey, owner='', format="xml", responseFormat="json"):
         """
@@ -40,16 +228,111 @@ class Reporting(APIBase):
             params["owner"] = owner
         params["format"] = format
         params["responseFormat"] = responseFormat
-        uriStr += urlencode(params)
+        uriStr = properParams(uriStr, urlencode(params))
         log.debug("Params are '%s'" % uriStr)
         try:
-            rslt = self.client.send_get(uriStr)
+            rslt = self.__cachedGet(uriStr, reportKey, "download", format="%s/%s" % (format, responseFormat))
             log.debug("Parameters are '%s'" % rslt)
         except Exception as e:
             log.error("getExecutionReport API call failed because '%s'" % e.message)
             raise Exception("get execution report API call failed because '%s'" % e.message)
         return rslt
 
+    def iterExecutionReport(self, reportKey, depth=2, names=None, owner='', queueSize=64, **kwargs):
+        """
+        Stream an xml execution report and yield its elements at one depth one at a
+        time, instead of building the whole report like getExecutionReport does.
+        Memory stays about the same however large the report is.
+
+            for (path, command) in reporting.iterExecutionReport(reportKey, depth=4, names=["command"]):
+                test = path[1][1]    # attributes of the enclosing element
+                ...
+
+        Arguments:
+            reportKey {String}: The key to the report.
+
+        Keyword Arguments:
+            depth {int} -- depth of the wanted elements, root is 1 (default: {2})
+            names {list} -- only yield elements with these names (default: {all})
+            owner {String} -- Reports available to this user. (default: {''})
+            queueSize {int} -- see iterXMLItems (default: {64})
+            **kwargs -- passed to xmltodict.parse
+
+        Returns:
+            generator -- (path, item) tuples, see iterXMLItems
+        """
+        uriStr = self.__reportUri(reportKey, owner)
+        try:
+            response = self.client.send_get_stream(uriStr)
+        except Exception as e:
+            log.error("iterExecutionReport API call failed because '%s'" % e.message)
+            raise Exception("stream execution report API call failed because '%s'" % e.message)
+        try:
+            for entry in iterXMLItems(response, depth, names, queueSize, **kwargs):
+                yield entry
+        finally:
+            response.close()
+
+    def processReports(self, reportKeys, extractor=summarizeReport, owner='', format="xml", processes=None,
+                       maxWorkers=None, progress=None, **parseArgs):
+        """
+        Download many reports and parse them on all cores.
+
+        Reports are fetched on I/O threads and their raw bytes handed to a pool of
+        worker processes, which parse them and run extractor on the result. Only
+        what extractor returns comes back from the workers, so keep it small.
+        Each I/O thread waits for its report to be parsed before fetching the
+        next, which bounds the raw reports held in memory to maxWorkers.
+
+            results = reporting.processReports(reportKeys, summarizeReport, processes=8)
+
+        Arguments:
+            reportKeys {list} -- report identifiers
+
+        Keyword Arguments:
+            extractor {callable} -- extractor(doc) -> result, run in the workers. It
+                                    must be a module level function so it can be
+                                    pickled. (default: {summarizeReport})
+            owner {String} -- Reports available to this user. (default: {''})
+            format {String} -- The format of the report. (default: {"xml"})
+            processes {int} -- worker processes (default: {cpu count})
+            maxWorkers {int} -- concurrent downloads (default: {2 * processes})
+            progress {callable} -- called as progress(reportKey, outcome, done, total) (default: {None})
+            **parseArgs -- passed to xmltodict.parse in the workers, for example force_list
+
+        Returns:
+            OrderedDict -- reportKey -> {"success": True, "result": extractor result} or
+                           {"success": False, "error": message}
+        """
+        processes = processes or multiprocessing.cpu_count()
+        maxWorkers = maxWorkers or 2 * processes
+        pool = multiprocessing.Pool(processes)
+
+        def fetchAndParse(reportKey):
+            raw = self.client.send_get_raw(self.__reportUri(reportKey, owner, format))
+            return pool.apply_async(_processInWorker, (raw, extractor, parseArgs)).get()
+
+        try:
+            results = runConcurrently(fetchAndParse, [(k, (k,), {}) for k in reportKeys], maxWorkers, progress)
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        return results
+
+    def __reportUri(self, reportKey, owner, format="xml"):
+        if not reportKey:
+            raise Exception("reportKey is required and value is invalid.")
+        uriStr = "/reports/%s?operation=download" % reportKey
+        params = {"format": format}
+        if owner:
+            params["owner"] = owner
+        uriStr = properParams(uriStr, urlencode(params))
+        log.debug("Params are '%s'" % uriStr)
+        return uriStr
+
     def getReportAttachmentList(self, reportKey, type="", owner="", admin=False):
         """
             The <reportKey> is the report identifier returned by the Start New Script Execution, the Get Script Execution Status, or the Get Script Executions List operations.
@@ -89,7 +372,7 @@ class Reporting(APIBase):
             params["owner"] = owner
         if admin:
             params["admin"] = admin
-        uriStr += urlencode(params)
+        uriStr = properParams(uriStr, urlencode(params))
         log.debug("Params are '%s'" % uriStr)
         try:
             rslt = self.client.send_get(uriStr)
@@ -139,12 +422,250 @@ class Reporting(APIBase):
             params["owner"] = owner
         if admin:
             params["admin"] = admin
-        uriStr += urlencode(params)
-        log.degug("parameters are '%s'" % uriStr)
+        uriStr = properParams(uriStr, urlencode(params))
+        log.debug("parameters are '%s'" % uriStr)
         try:
-            rslt = self.client.send_get(uriStr)
+            rslt = self.__cachedGet(uriStr, reportKey, reportType, attachment)
             log.debug("Results are '%s'" % rslt)
         except Exception as e:
             log.error("getExecutionReportImage API call failed because '%s'" % e.message)
             raise Exception("download execution report API call failed because '%s'" % e.message)
         return rslt
+
+    def __attachmentUri(self, reportType, reportKey, attachment, owner, admin):
+        if not reportKey or not attachment or not reportType:
+            raise Exception("reportKey, attachment, and reportType are required parameters and their values are invalid.")
+        uriStr = "/reports/%s?operation=%s" % (reportKey, reportType)
+        params = {"attachment": attachment}
+        if owner:
+            params["owner"] = owner
+        if admin:
+            params["admin"] = admin
+        uriStr = properParams(uriStr, urlencode(params))
+        log.debug("parameters are '%s'" % uriStr)
+        return uriStr
+
+    def getAttachmentRange(self, reportType, reportKey, attachment, start=0, end=None, owner="", admin=False):
+        """
+        Download part of a report attachment, for example the last few MB of a video:
+
+            reporting.getAttachmentRange("video", reportKey, path, start=-5 * 1024 * 1024)
+
+        Arguments:
+            reportType {str} -- see getExecutionReportAttachment
+            reportKey {string} -- report identifier
+            attachment {string} -- attachment path as listed by getReportAttachmentList
+
+        Keyword Arguments:
+            start {int} -- First byte offset; negative counts from the end. (default: {0})
+            end {int} -- Last byte offset, inclusive. (default: {the end})
+            owner {str} -- see getExecutionReportAttachment (default: {""})
+            admin {bool} -- see getExecutionReportAttachment (default: {False})
+
+        Returns:
+            dict -- "body", "start", "end" and "total" (see APIClient.send_get_range)
+        """
+        uriStr = self.__attachmentUri(reportType, reportKey, attachment, owner, admin)
+        try:
+            return self.client.send_get_range(uriStr, start, end)
+        except Exception as e:
+            log.error("getAttachmentRange API call failed because '%s'" % e.message)
+            raise Exception("attachment range API call failed because '%s'" % e.message)
+
+    def downloadAttachment(self, reportType, reportKey, attachment, destPath, owner="", admin=False,
+                           resume=True, segments=1, minSegmentSize=4 * 1024 * 1024):
+        """
+        Stream one report attachment to a file.
+
+        The data goes to destPath + ".part" first and is renamed once complete, so an
+        interrupted download never looks finished. With resume, a .part file left by
+        an earlier attempt is continued from where it stopped with a Range request.
+        With self.cache set, attachments already in the cache are copied from it
+        instead of downloaded.
+
+        Arguments:
+            reportType {str} -- see getExecutionReportAttachment
+            reportKey {string} -- report identifier
+            attachment {string} -- attachment path as listed by getReportAttachmentList
+            destPath {string} -- file to write
+
+        Keyword Arguments:
+            owner {str} -- see getExecutionReportAttachment (default: {""})
+            admin {bool} -- see getExecutionReportAttachment (default: {False})
+            resume {bool} -- continue an existing .part file (default: {True})
+            segments {int} -- download a large attachment as this many byte ranges
+                              in parallel, when the server supports ranges (default: {1})
+            minSegmentSize {int} -- smallest range worth its own connection (default: {4 MiB})
+
+        Returns:
+            dict -- "file", "size" and "sha256" of the written file
+        """
+        uriStr = self.__attachmentUri(reportType, reportKey, attachment, owner, admin)
+        partPath = destPath + ".part"
+        try:
+            writer = self.__fromCache(partPath, reportKey, reportType, attachment)
+            if writer is None:
+                writer = self.__download(uriStr, partPath, resume, segments, minSegmentSize)
+                if self.cache is not None:
+                    with open(partPath, "rb") as f:
+                        self.cache.putStream(f, reportKey, reportType, attachment, "raw")
+            os.rename(partPath, destPath)
+        except Exception as e:
+            if os.path.exists(partPath) and not os.path.getsize(partPath):
+                os.remove(partPath)
+            log.error("downloadAttachment API call failed because '%s'" % e.message)
+            raise Exception("download attachment API call failed because '%s'" % e.message)
+        return {"file": destPath, "size": writer.size, "sha256": writer.sha256.hexdigest()}
+
+    def __fromCache(self, partPath, reportKey, reportType, attachment):
+        if self.cache is None or not os.path.exists(self.cache.path(reportKey, reportType, attachment, "raw")):
+            return None
+        with open(partPath, "wb") as f:
+            writer = _HashingWriter(f)
+            try:
+                if self.cache.getStream(writer, reportKey, reportType, attachment, "raw") is not None:
+                    return writer
+            except Exception:
+                pass
+            f.truncate(0)
+        return None
+
+    def __download(self, uriStr, partPath, resume, segments, minSegmentSize):
+        offset = os.path.getsize(partPath) if resume and os.path.exists(partPath) else 0
+        if offset:
+            writer = self.__resume(uriStr, partPath, offset)
+            if writer is not None:
+                return writer
+        elif segments > 1:
+            total, ranged = self.client.probe_range(uriStr)
+            segments = min(segments, (total or 0) // minSegmentSize)
+            if ranged and segments > 1:
+                return self.__downloadSegments(uriStr, partPath, total, segments)
+        with open(partPath, "wb") as f:
+            writer = _HashingWriter(f)
+            self.client.send_get_raw(uriStr, writer)
+        return writer
+
+    def __resume(self, uriStr, partPath, offset):
+        """Continue a .part file. Returns None when it has to start over."""
+        with open(partPath, "r+b") as f:
+            writer = _HashingWriter(f)
+            writer.updateFrom(f)
+            try:
+                info = self.client.send_get_range(uriStr, offset, output=writer)
+            except APIError as e:
+                # 416: nothing left after offset, so the part is complete if the sizes agree.
+                if "HTTP 416" not in e.message or self.client.probe_range(uriStr)[0] != offset:
+                    log.warn("cannot resume '%s' at '%s', starting over" % (partPath, offset))
+                    return None
+                return writer
+        log.debug("resumed '%s' at '%s', '%s' more bytes" % (partPath, offset, info["size"]))
+        return writer
+
+    def __downloadSegments(self, uriStr, partPath, total, segments):
+        size = -(-total // segments)
+        with open(partPath, "wb") as f:
+            f.truncate(total)
+
+        def fetch(start, end):
+            with open(partPath, "r+b") as f:
+                f.seek(start)
+                info = self.client.send_get_range(uriStr, start, end, f)
+            if info["size"] != end - start + 1:
+                raise Exception("range %s-%s returned %s bytes" % (start, end, info["size"]))
+
+        calls = [(start, (start, min(start + size, total) - 1), {}) for start in range(0, total, size)]
+        log.debug("downloading '%s' bytes as '%s' ranges" % (total, len(calls)))
+        results = runConcurrently(fetch, calls, len(calls))
+        failed = [o["error"] for o in results.values() if not o["success"]]
+        if failed:
+            # A part file with holes cannot be resumed.
+            os.remove(partPath)
+            raise Exception("'%s' of '%s' ranges failed: '%s'" % (len(failed), len(calls), failed[0]))
+        writer = _HashingWriter(None)
+        with open(partPath, "rb") as f:
+            writer.updateFrom(f)
+        return writer
+
+    def downloadAllAttachments(self, reportKey, destDir, types=None, owner="", admin=False, maxWorkers=4, retries=3, progress=None,
+                               segments=1):
+        """
+        Download every attachment of a report into destDir.
+
+        The attachment list is fetched once, then the attachments are streamed to disk
+        concurrently, each retried on failure from where it stopped. destDir/manifest.json records the type,
+        attachment path, file, size and sha256 of every attachment, or its error. Attachments
+        the list gives no type for cannot be downloaded and are recorded as failed.
+
+        Arguments:
+            reportKey {string} -- report identifier
+            destDir {string} -- directory to write to; attachments go in a folder per type
+
+        Keyword Arguments:
+            types {list} -- only these attachment types, ie. image, video, log (default: {all})
+            owner {str} -- see getReportAttachmentList (default: {""})
+            admin {bool} -- see getReportAttachmentList (default: {False})
+            maxWorkers {int} -- the most downloads in flight at the same time (default: {4})
+            retries {int} -- attempts per attachment (default: {3})
+            progress {callable} -- called as progress(file, outcome, done, total), file relative
+                                   to destDir (default: {None})
+            segments {int} -- parallel ranges per large attachment, see downloadAttachment (default: {1})
+
+        Returns:
+            dict -- the manifest
+        """
+        items = attachmentItems(self.getReportAttachmentList(reportKey, owner=owner, admin=admin))
+        if types:
+            items = [i for i in items if i["type"] in types]
+        calls = []
+        files = []
+        used = set()
+        for item in items:
+            if not item["type"]:
+                files.append(None)
+                continue
+            folder = os.path.join(destDir, item["type"])
+            name = re.sub(r"[^\w.\-]+", "_", os.path.basename(item["attachment"].rstrip("/"))) or "attachment"
+            path = os.path.join(folder, name)
+            n = 1
+            while path in used:
+                root, ext = os.path.splitext(name)
+                path = os.path.join(folder, "%s_%s%s" % (root, n, ext))
+                n += 1
+            used.add(path)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            files.append(os.path.relpath(path, destDir))
+            calls.append((files[-1], (item["type"], reportKey, item["attachment"], path, owner, admin, retries, segments), {}))
+        log.debug("downloading '%s' attachments of '%s'" % (len(calls), reportKey))
+        results = runConcurrently(self.__downloadWithRetry, calls, maxWorkers, progress)
+        manifest = {"reportKey": reportKey, "attachments": []}
+        for (item, name) in zip(items, files):
+            if name is None:
+                log.warn("skipping attachment '%s' of '%s' without a type" % (item["attachment"], reportKey))
+                manifest["attachments"].append({"type": None, "attachment": item["attachment"], "success": False,
+                                                "error": "attachment has no type"})
+                continue
+            outcome = results[name]
+            entry = {"type": item["type"], "attachment": item["attachment"], "success": outcome["success"]}
+            if outcome["success"]:
+                entry.update(outcome["result"])
+                entry["file"] = os.path.relpath(entry["file"], destDir)
+            else:
+                entry["error"] = outcome["error"]
+            manifest["attachments"].append(entry)
+        with open(os.path.join(destDir, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        return manifest
+
+    def __downloadWithRetry(self, reportType, reportKey, attachment, destPath, owner, admin, retries, segments):
+        delay = 1.0
+        for attempt in range(1, retries + 1):
+            try:
+                return self.downloadAttachment(reportType, reportKey, attachment, destPath, owner, admin, segments=segments)
+            except Exception as e:
+                log.warn("download of '%s' failed on attempt '%s' because '%s'" % (attachment, attempt, e.message))
+                if attempt == retries:
+                    raise
+                time.sleep(delay)
+                delay *= 2
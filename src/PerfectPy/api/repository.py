@@ -2,11 +2,225 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
-from .__init__ import APIBase, log, properParams
+from .__init__ import APIBase, log, properParams, runConcurrently
+from collections import OrderedDict, deque
+from io import BytesIO
+from Queue import Queue
 from urllib import urlencode
+from xml.sax.saxutils import XMLGenerator
+from xml.sax.xmlreader import AttributesImpl
+from .xmltodict import _emit
+import csv
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
 #URL: https://mycloud.perfectomobile.com/services/handsets
 #Request: operation=list&user=myUsername&password=myPassword&status=connected
 
+MANIFEST_NAME = ".perfecto-sync.json"
+
+
+def _rawItems(rslt):
+    """The entries of a repositoryList response, whether the server answered in xml or json."""
+    if not rslt:
+        return []
+    items = rslt
+    if isinstance(items, dict):
+        for name in ("items", "response", "item"):
+            if name in items:
+                items = items[name]
+                break
+        else:
+            items = []
+    while isinstance(items, dict) and ("items" in items or "item" in items):
+        items = items.get("items", items.get("item"))
+    if isinstance(items, (basestring, dict)):
+        items = [items]
+    return list(items or [])
+
+
+def repositoryItems(rslt):
+    """
+    Return the item keys in a repositoryList response as a list of strings,
+    whether the server answered in xml or json.
+    """
+    keys = []
+    for item in _rawItems(rslt):
+        if isinstance(item, dict):
+            item = item.get("key") or item.get("itemKey") or item.get("name") or item.get("#text")
+        if item:
+            keys.append(item)
+    return keys
+
+
+def _parentKey(itemKey):
+    """Repository key of the folder holding itemKey."""
+    head = itemKey.rstrip("/")
+    cut = max(head.rfind("/"), head.find(":"))
+    return head[:cut + 1]
+
+
+class TreeCache(object):
+    """
+    Folder listings kept for ttl seconds, used by Repository.walkRepository when
+    set as Repository.treeCache.
+
+    This is a plain TTL cache: it cannot tell which folders changed on the server,
+    so changes made by anyone else show up only once a listing expires. Uploads and
+    deletes through the same Repository drop the listings of the changed item's
+    folder and of every folder above it, since an upload may create folders.
+    """
+
+    def __init__(self, ttl=300, clock=time.time):
+        self.ttl = ttl
+        self.clock = clock
+        self.__folders = {}
+        self.__lock = threading.Lock()
+
+    def get(self, repository, folderKey):
+        with self.__lock:
+            entry = self.__folders.get((repository, folderKey))
+            if entry is None:
+                return None
+            if self.clock() - entry[0] > self.ttl:
+                del self.__folders[(repository, folderKey)]
+                return None
+            return entry[1]
+
+    def put(self, repository, folderKey, children):
+        with self.__lock:
+            self.__folders[(repository, folderKey)] = (self.clock(), children)
+
+    def invalidate(self, repository, itemKey=None):
+        """Drop the listings of every folder above itemKey, or every listing of the repository."""
+        with self.__lock:
+            if itemKey is None:
+                for key in [k for k in self.__folders if k[0] == repository]:
+                    del self.__folders[key]
+                return
+            self.__folders.pop((repository, ""), None)
+            folderKey = _parentKey(itemKey)
+            while True:
+                self.__folders.pop((repository, folderKey), None)
+                parentKey = _parentKey(folderKey)
+                if parentKey == folderKey:
+                    break
+                folderKey = parentKey
+
+
+def _cell(value):
+    return b"" if value is None else ("%s" % value).encode("utf-8")
+
+
+def csvChunks(rows, columns=None, chunkSize=64 * 1024):
+    """
+    Serialize rows to csv lazily, yielding blocks of about chunkSize bytes.
+
+    Arguments:
+        rows {iterable} -- dicts, or sequences in columns order
+
+    Keyword Arguments:
+        columns {list} -- column names; written as the header row. Taken from
+                          the first row when rows are dicts. (default: {None})
+        chunkSize {int} -- bytes per yielded block (default: {64 KiB})
+    """
+    buf = BytesIO()
+    writer = csv.writer(buf)
+    if columns is not None:
+        writer.writerow([_cell(c) for c in columns])
+    for row in rows:
+        if isinstance(row, dict):
+            if columns is None:
+                columns = list(row)
+                writer.writerow([_cell(c) for c in columns])
+            row = [row.get(c) for c in columns]
+        writer.writerow([_cell(v) for v in row])
+        if buf.tell() >= chunkSize:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+def xmlChunks(rows, columns=None, rootElement="dataTable", rowElement="row", chunkSize=64 * 1024):
+    """
+    Serialize rows to xml lazily, yielding blocks of about chunkSize bytes. Every
+    row is written with xmltodict's _emit, as unparse would, but the document is
+    never built as a whole.
+
+    Arguments:
+        rows {iterable} -- dicts as accepted by xmltodict.unparse, or sequences in columns order
+
+    Keyword Arguments:
+        columns {list} -- element names for sequence rows, or the element order for dict rows (default: {None})
+        rootElement {str} -- name of the document element (default: {"dataTable"})
+        rowElement {str} -- name of the element written per row (default: {"row"})
+        chunkSize {int} -- bytes per yielded block (default: {64 KiB})
+    """
+    buf = BytesIO()
+    handler = XMLGenerator(buf, "utf-8")
+    handler.startDocument()
+    handler.startElement(rootElement, AttributesImpl({}))
+    for row in rows:
+        if not isinstance(row, dict):
+            if columns is None:
+                raise Exception("columns is required for rows that are not dicts.")
+            row = OrderedDict(zip(columns, row))
+        elif columns is not None:
+            row = OrderedDict((c, row.get(c)) for c in columns)
+        _emit(rowElement, row, handler, full_document=False)
+        if buf.tell() >= chunkSize:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    handler.endElement(rootElement)
+    handler.endDocument()
+    yield buf.getvalue()
+
+
+def _scopeLabel(scope):
+    return ",".join("%s=%s" % (k, scope[k]) for k in sorted(scope))
+
+
+def _addStats(totals, result, prefix=""):
+    """Sum the numeric values of a cleanupRepository response into totals, by dotted path."""
+    if isinstance(result, dict):
+        for (key, value) in result.items():
+            _addStats(totals, value, prefix + key.lstrip("@") + ".")
+        return
+    if isinstance(result, bool):
+        return
+    if isinstance(result, basestring):
+        try:
+            result = int(result)
+        except ValueError:
+            try:
+                result = float(result)
+            except ValueError:
+                return
+    if isinstance(result, (int, long, float)):
+        name = prefix[:-1]
+        totals[name] = totals.get(name, 0) + result
+
+
+def _fileHash(path, chunkSize=64 * 1024):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunkSize), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _writeJSON(path, data):
+    """Write json next to path and rename it into place, so a crash never leaves half a file."""
+    fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.rename(tmpPath, path)
+
 
 class Repository(APIBase):
     """
@@ -24,6 +238,7 @@ class Repository(APIBase):
             baseURL {str} -- baseURL for the web services (default: {'https://mobilecloud.perfectomobile.com/services/'})
         """
         self.initClient(securityToken, baseURL)
+        self.treeCache = None
         return
 
     def uploadItem(self, repository, itemKey, data, admin=False, owner=None, group=None, overwrite=False, format=None, reponseFormat="json", **properties):
@@ -32,7 +247,7 @@ class Repository(APIBase):
         Arguments:
             repository {string} -- Name of the repo to upload to
             itemKey {string} -- item key for this uploaded item
-            data    {bytes}    The file to upload
+            data    {bytes}    The file to upload, as bytes or an open file which is streamed
             admin   boolean     false   true to allow users with administrative credentials
                                         to upload items to private repository of other automation users.
             owner   string      The user name of the user who owns the item. This parameter is used
@@ -55,10 +270,23 @@ class Repository(APIBase):
                                 possible values: xml, csv
             responseFormat  string  json    Format of response: json, xml
         """
+        uriStr = self.__uploadUri(repository, itemKey, admin, owner, group, overwrite, format, reponseFormat, properties)
+        rslt = None
+        try:
+            rslt = self.client.send_post(uriStr, data)
+            log.debug("results are '%s'" % rslt)
+            if self.treeCache is not None:
+                self.treeCache.invalidate(repository, itemKey)
+        except Exception as e:
+            log.error("uploadItem API call failed because '%s'" % e.message)
+            log.error(e)
+            raise Exception("upload item API call failed because '%s'" % e.message)
+        return rslt
+
+    def __uploadUri(self, repository, itemKey, admin, owner, group, overwrite, format, reponseFormat, properties):
         if not repository or not itemKey:
             raise Exception("repository key or itemKey are invalid values.")
         uriStr = u"repositories/%s/%s?operation=upload" % (repository, itemKey)
-        rslt = None
         params = {}
         if admin:
             params[u"admin"] = admin
@@ -72,16 +300,55 @@ class Repository(APIBase):
             params[u"format"] = format
         params[u"responseFormat"] = reponseFormat
         if properties:
-            params.update({(u"property.%s" % k, v) for (k, v) in properties})
+            params.update((u"property.%s" % k, v) for (k, v) in properties.items())
         uriStr = properParams(uriStr, urlencode(params))
         log.debug("params are '%s'" % uriStr)
+        return uriStr
+
+    def uploadDataTable(self, repository, itemKey, rows, columns=None, format="csv", admin=False, owner=None, group=None,
+                        overwrite=False, rootElement="dataTable", rowElement="row", chunkSize=64 * 1024, **properties):
+        """Upload a data table from an iterator of rows, serializing and sending it as it goes.
+
+        The rows are turned into csv (csvChunks) or xml (xmlChunks) lazily and
+        streamed into the request body with chunked transfer encoding, so a table
+        of millions of generated rows is never held in memory.
+
+            repo.uploadDataTable("datatables", "PRIVATE:users.csv",
+                                 ({"user": "u%d" % i, "pin": i} for i in range(10 ** 6)))
+
+        Arguments:
+            repository {string} -- Name of the repo to upload to, usually datatables
+            itemKey {string} -- item key for this uploaded item
+            rows {iterable} -- dicts, or sequences in columns order
+
+        Keyword Arguments:
+            columns {list} -- column names, see csvChunks and xmlChunks (default: {None})
+            format {str} -- csv or xml (default: {"csv"})
+            admin {bool} -- see uploadItem (default: {False})
+            owner {string} -- see uploadItem (default: {None})
+            group {string} -- see uploadItem (default: {None})
+            overwrite {bool} -- see uploadItem (default: {False})
+            rootElement {str} -- see xmlChunks (default: {"dataTable"})
+            rowElement {str} -- see xmlChunks (default: {"row"})
+            chunkSize {int} -- bytes serialized per chunk sent (default: {64 KiB})
+            **properties -- see uploadItem
+        """
+        if format == "csv":
+            chunks = csvChunks(rows, columns, chunkSize)
+        elif format == "xml":
+            chunks = xmlChunks(rows, columns, rootElement, rowElement, chunkSize)
+        else:
+            raise Exception("format must be csv or xml.")
+        uriStr = self.__uploadUri(repository, itemKey, admin, owner, group, overwrite, format, "json", properties)
+        rslt = None
         try:
-            rslt = self.client.send_post(uriStr, data)
+            rslt = self.client.send_post_chunks(uriStr, chunks)
             log.debug("results are '%s'" % rslt)
+            if self.treeCache is not None:
+                self.treeCache.invalidate(repository, itemKey)
         except Exception as e:
-            log.error("uploadItem API call failed because '%s'" % e.message)
-            log.error(e)
-            raise Exception("upload item API call failed because '%s'" % e.message)
+            log.error("uploadDataTable API call failed because '%s'" % e.message)
+            raise Exception("upload data table API call failed because '%s'" % e.message)
         return rslt
 
     def repositoryList(self, repository, itemKey, owner=None, group=None, responseFormat='json', admin=False):
@@ -191,6 +458,8 @@ class Repository(APIBase):
         try:
             rslt = self.client.send_get(uriStr)
             log.debug("results are '%s'" % rslt)
+            if self.treeCache is not None:
+                self.treeCache.invalidate(repository, itemKey)
         except Exception as e:
             log.error("deleteItem API call failed because '%s'" % e.message)
             raise Exception("delete item API call failed because '%s'" % e.message)
@@ -256,3 +525,281 @@ class Repository(APIBase):
             log.error("cleanupRepository API call failed because '%s'" % e.message)
             raise Exception("clean up repository API call failed because '%s'" % e.message)
         return rslt
+
+    def syncDirectory(self, localDir, repository, prefix, deleteOrphans=False, manifestPath=None, dryRun=False,
+                      admin=False, owner=None, group=None, maxWorkers=4, progress=None):
+        """Mirror a local directory into a repository folder, uploading only what changed.
+
+        The remote folder is walked once with walkRepository. A local manifest records the size,
+        modification time and sha256 of every file as last uploaded; files are only
+        hashed again when their size or modification time changed, and only new or
+        changed files, or files missing remotely, are uploaded. Uploads run
+        concurrently and stream from disk.
+
+            repo.syncDirectory("scripts", "media", "PRIVATE:release/")
+
+        Arguments:
+            localDir {string} -- the directory to mirror, including subdirectories
+            repository {string} -- the repository name, ie. media, datatables, scripts
+            prefix {string} -- repository key of the remote folder, ie. PRIVATE:release/
+
+        Keyword Arguments:
+            deleteOrphans {bool} -- delete remote items under prefix with no local file (default: {False})
+            manifestPath {string} -- where the manifest is kept (default: {localDir/.perfecto-sync.json})
+            dryRun {bool} -- only work out what would be uploaded and deleted (default: {False})
+            admin {bool} -- see uploadItem (default: {False})
+            owner {string} -- see uploadItem (default: {None})
+            group {string} -- see uploadItem (default: {None})
+            maxWorkers {int} -- the most uploads in flight at the same time (default: {4})
+            progress {callable} -- called as progress(itemKey, outcome, done, total) (default: {None})
+
+        Returns:
+            dict -- "uploaded" and "deleted" item keys, "unchanged" count and "failed" itemKey -> error
+        """
+        manifestPath = manifestPath or os.path.join(localDir, MANIFEST_NAME)
+        manifest = {}
+        if os.path.exists(manifestPath):
+            with open(manifestPath) as f:
+                manifest = json.load(f)
+        if prefix and not prefix.endswith(("/", ":")):
+            prefix += "/"
+        remote = set(self.walkRepository(repository, prefix, folders=False, owner=owner, group=group, admin=admin))
+        local = {}
+        for (folder, dirs, files) in os.walk(localDir):
+            for name in files:
+                path = os.path.join(folder, name)
+                if os.path.abspath(path) == os.path.abspath(manifestPath):
+                    continue
+                relPath = os.path.relpath(path, localDir).replace(os.sep, "/")
+                local[prefix + relPath] = (path, relPath)
+        changed = []
+        for (itemKey, (path, relPath)) in sorted(local.items()):
+            st = os.stat(path)
+            entry = manifest.get(relPath)
+            if entry and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime:
+                sha256 = entry["sha256"]
+            else:
+                sha256 = _fileHash(path)
+            if entry and entry["sha256"] == sha256 and itemKey in remote:
+                entry["mtime"] = st.st_mtime
+                continue
+            changed.append((itemKey, (itemKey, path, relPath, st.st_size, st.st_mtime, sha256), {}))
+        orphans = sorted(remote - set(local)) if deleteOrphans else []
+        summary = {"uploaded": [c[0] for c in changed], "deleted": orphans,
+                   "unchanged": len(local) - len(changed), "failed": {}}
+        log.debug("sync of '%s' to '%s': '%s' to upload, '%s' to delete, '%s' unchanged"
+                  % (localDir, prefix, len(changed), len(orphans), summary["unchanged"]))
+        if dryRun:
+            return summary
+
+        def upload(itemKey, path, relPath, size, mtime, sha256):
+            with open(path, "rb") as f:
+                rslt = self.uploadItem(repository, itemKey, f, admin=admin, owner=owner, group=group, overwrite=True)
+            manifest[relPath] = {"size": size, "mtime": mtime, "sha256": sha256}
+            return rslt
+
+        results = runConcurrently(upload, changed, maxWorkers, progress)
+        if orphans:
+            results.update(self.deleteItems(repository, orphans, owner, group, admin, maxWorkers, progress))
+        for (itemKey, outcome) in results.items():
+            if not outcome["success"]:
+                summary["failed"][itemKey] = outcome["error"]
+        summary["uploaded"] = [k for k in summary["uploaded"] if k not in summary["failed"]]
+        summary["deleted"] = [k for k in orphans if k not in summary["failed"]]
+        for relPath in list(manifest):
+            if prefix + relPath not in local:
+                del manifest[relPath]
+        _writeJSON(manifestPath, manifest)
+        return summary
+
+    def walkRepository(self, repository, rootKey, folders=True, maxWorkers=8, owner=None, group=None, admin=False):
+        """Enumerate a repository folder and everything below it.
+
+        Folders are listed concurrently, at most maxWorkers at a time, and items are
+        yielded as soon as their folder listing arrives, so the walk can be consumed
+        while it is still running. Keys ending in "/" are folders. With
+        self.treeCache set, folders listed within its ttl are not listed again; see
+        TreeCache for what that misses.
+
+            for itemKey in repo.walkRepository("media", "PUBLIC:videos/", folders=False):
+                ...
+
+        Arguments:
+            repository {string} -- the repository name, ie. media, datatables, scripts
+            rootKey {string} -- repository key of the folder to walk
+
+        Keyword Arguments:
+            folders {bool} -- yield folder keys too (default: {True})
+            maxWorkers {int} -- the most repositoryList calls in flight at the same time (default: {8})
+            owner {string} -- see repositoryList (default: {None})
+            group {string} -- see repositoryList (default: {None})
+            admin {bool} -- see repositoryList (default: {False})
+
+        Returns:
+            generator -- item keys
+
+        Raises:
+            Exception -- a folder could not be listed
+        """
+        if rootKey and not rootKey.endswith(("/", ":")):
+            rootKey += "/"
+        tasks = Queue()
+        results = Queue()
+
+        def worker():
+            while True:
+                folderKey = tasks.get()
+                if folderKey is None:
+                    return
+                try:
+                    rslt = self.repositoryList(repository, folderKey, owner=owner, group=group, admin=admin)
+                    results.put((folderKey, self.__children(folderKey, rslt), None))
+                except Exception as e:
+                    results.put((folderKey, None, e))
+
+        workers = []
+        pending = deque([rootKey])
+        seen = set([rootKey])
+        inFlight = 0
+        try:
+            while pending or inFlight:
+                listed = []
+                while pending and inFlight < maxWorkers:
+                    folderKey = pending.popleft()
+                    children = self.treeCache.get(repository, folderKey) if self.treeCache is not None else None
+                    if children is not None:
+                        listed.append((folderKey, children))
+                        continue
+                    if len(workers) < maxWorkers:
+                        t = threading.Thread(target=worker, name="RepositoryWalker-%s" % len(workers))
+                        t.daemon = True
+                        t.start()
+                        workers.append(t)
+                    tasks.put(folderKey)
+                    inFlight += 1
+                if not listed and inFlight:
+                    folderKey, children, error = results.get()
+                    inFlight -= 1
+                    if error is not None:
+                        raise Exception("listing '%s' failed because '%s'" % (folderKey, error.message))
+                    if self.treeCache is not None:
+                        self.treeCache.put(repository, folderKey, children)
+                    listed.append((folderKey, children))
+                for (folderKey, children) in listed:
+                    for child in children:
+                        if child in seen:
+                            continue
+                        seen.add(child)
+                        if child.endswith("/"):
+                            pending.append(child)
+                            if folders:
+                                yield child
+                        else:
+                            yield child
+        finally:
+            for t in workers:
+                tasks.put(None)
+            for t in workers:
+                t.join()
+
+    def __children(self, folderKey, rslt):
+        """Full keys of the entries in a repositoryList response of folderKey."""
+        children = []
+        for item in _rawItems(rslt):
+            isFolder = False
+            if isinstance(item, dict):
+                isFolder = ("%s" % item.get("isFolder", item.get("folder", ""))).lower() == "true" or \
+                    ("%s" % item.get("type", "")).lower() in ("folder", "directory")
+                item = item.get("key") or item.get("itemKey") or item.get("name") or item.get("#text")
+            if not item:
+                continue
+            if ":" not in item:
+                item = folderKey + item
+            if isFolder and not item.endswith("/"):
+                item += "/"
+            children.append(item)
+        return children
+
+    def deleteItems(self, repository, itemKeys, owner=None, group=None, admin=False, maxWorkers=8, progress=None):
+        """Delete many items at once instead of one at a time.
+
+        Arguments:
+            repository {string} -- The name of the repository
+            itemKeys {list} -- The keys of the items
+
+        Keyword Arguments:
+            owner {string} -- see deleteItem (default: {None})
+            group {string} -- see deleteItem (default: {None})
+            admin {bool} -- see deleteItem (default: {False})
+            maxWorkers {int} -- the most delete calls in flight at the same time (default: {8})
+            progress {callable} -- called as progress(itemKey, outcome, done, total) (default: {None})
+
+        Returns:
+            OrderedDict -- itemKey -> {"success": True, "result": response} or
+                           {"success": False, "error": message}. A failed delete does not stop the others.
+        """
+        calls = [(itemKey, (repository, itemKey, owner, group, "json", admin), {}) for itemKey in itemKeys]
+        log.debug("deleting '%s' items from '%s'" % (len(calls), repository))
+        return runConcurrently(self.deleteItem, calls, maxWorkers, progress)
+
+    def planCleanup(self, scopes, itemKey=None, daysToKeep=None, userStatus=None, admin=False, maxWorkers=8, progress=None):
+        """Dry run cleanupRepository for many owner and group scopes at once.
+
+        Arguments:
+            scopes {list} -- dicts with owner and/or group, and optionally itemKey,
+                             daysToKeep and userStatus overriding the defaults below.
+
+        Keyword Arguments:
+            itemKey {string} -- see cleanupRepository (default: {None})
+            daysToKeep {int} -- see cleanupRepository (default: {None})
+            userStatus {string} -- see cleanupRepository (default: {None})
+            admin {bool} -- see cleanupRepository (default: {False})
+            maxWorkers {int} -- the most dry runs in flight at the same time (default: {8})
+            progress {callable} -- called as progress(scope, outcome, done, total) (default: {None})
+
+        Returns:
+            dict -- "scopes": scope label -> {"scope", "success", "result" or "error"},
+                    "totals": the numeric statistics of all dry runs summed by name,
+                    "failed": labels of the scopes whose dry run failed. Pass it to runCleanup.
+        """
+        plan = {"scopes": OrderedDict(), "totals": {}, "failed": []}
+        calls = []
+        for given in scopes:
+            scope = dict({"itemKey": itemKey, "daysToKeep": daysToKeep, "userStatus": userStatus, "admin": admin}, **given)
+            if not scope.get("itemKey") or scope.get("daysToKeep") is None:
+                raise Exception("itemKey and daysToKeep are required for every cleanup scope.")
+            label = _scopeLabel(given)
+            if label in plan["scopes"]:
+                raise Exception("Cleanup scope '%s' is listed more than once." % label)
+            plan["scopes"][label] = {"scope": scope}
+            calls.append((label, (scope, True), {}))
+        for (label, outcome) in runConcurrently(self.__clean, calls, maxWorkers, progress).items():
+            plan["scopes"][label].update(outcome)
+            if outcome["success"]:
+                _addStats(plan["totals"], outcome["result"])
+            else:
+                plan["failed"].append(label)
+        log.debug("cleanup plan over '%s' scopes: '%s'" % (len(calls), plan["totals"]))
+        return plan
+
+    def runCleanup(self, plan, maxWorkers=8, progress=None):
+        """Carry out a plan from planCleanup, cleaning every scope whose dry run succeeded, concurrently.
+
+        Returns:
+            dict -- the plan, plus "results" (scope label -> result map entry), "totals"
+                    of what was actually cleaned as "cleaned" and "success".
+        """
+        calls = [(label, (entry["scope"], False), {}) for (label, entry) in plan["scopes"].items() if entry.get("success")]
+        log.debug("cleaning '%s' scopes" % len(calls))
+        plan["results"] = runConcurrently(self.__clean, calls, maxWorkers, progress)
+        plan["cleaned"] = {}
+        for outcome in plan["results"].values():
+            if outcome["success"]:
+                _addStats(plan["cleaned"], outcome["result"])
+        plan["success"] = all(o["success"] for o in plan["results"].values())
+        return plan
+
+    def __clean(self, scope, dryRun):
+        return self.cleanupRepository(scope["itemKey"], scope["daysToKeep"], owner=scope.get("owner"),
+                                      group=scope.get("group"), dryRun=dryRun, userStatus=scope.get("userStatus"),
+                                      admin=scope.get("admin", False))
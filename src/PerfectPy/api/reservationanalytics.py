@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Vectorized utilization analytics over reservationList data.
+
+    Requires numpy. Parquet export also requires pyarrow.
+"""
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from .__init__ import log
+from .columnar import encode, writeCSV, writeParquet
+from .reservationcalendar import reservationItems
+from collections import OrderedDict
+try:
+    import numpy as np
+except ImportError:  # pragma no cover
+    np = None
+
+HOUR = 60 * 60 * 1000
+DAY = 24 * HOUR
+
+
+class ReservationFrame(object):
+    """
+    Reservations held as columnar numpy arrays.
+
+    resource and reservedTo are dictionary encoded: resource[i] indexes
+    resources, reservedTo[i] indexes users. start and end are int64 ms.
+
+        frame = ReservationFrame.fromReservations(api.iterReservations(quarterStart, quarterEnd))
+        frame.deviceHours(by="model", models=dict((h["deviceId"], h["model"]) for h in handsets))
+        frame.hourOfDay()
+        frame.peakConcurrency()
+    """
+
+    def __init__(self, resource, resources, start, end, reservedTo, users, ids=None):
+        if np is None:
+            raise Exception("numpy is required for reservation analytics.")
+        self.resource = np.asarray(resource, dtype=np.int32)
+        self.resources = list(resources)
+        self.start = np.asarray(start, dtype=np.int64)
+        self.end = np.asarray(end, dtype=np.int64)
+        self.reservedTo = np.asarray(reservedTo, dtype=np.int32)
+        self.users = list(users)
+        self.ids = list(ids) if ids is not None else None
+
+    @classmethod
+    def fromReservations(cls, reservations):
+        """
+        Build a frame from a reservationList response or from an iterable of flat
+        reservation dicts (reservationItems, Reservations.iterReservations, ReservationStore.all).
+        """
+        if np is None:
+            raise Exception("numpy is required for reservation analytics.")
+        if isinstance(reservations, dict):
+            reservations = reservationItems(reservations)
+        ids, resources, users, starts, ends = [], [], [], [], []
+        for r in reservations:
+            if r.get("startTime") is None or r.get("endTime") is None:
+                continue
+            ids.append(r.get("id"))
+            resources.append(r.get("resourceId"))
+            users.append(r.get("reservedTo") or "")
+            starts.append(r["startTime"])
+            ends.append(r["endTime"])
+        resource, resourceNames = encode(resources)
+        reservedTo, userNames = encode(users)
+        log.debug("reservation frame holds '%s' reservations" % len(ids))
+        return cls(resource, resourceNames, starts, ends, reservedTo, userNames, ids)
+
+    def __len__(self):
+        return len(self.start)
+
+    def clip(self, startTime, endTime):
+        """
+        Return a new frame with every reservation cut to [startTime, endTime);
+        reservations entirely outside are dropped.
+        """
+        start = np.maximum(self.start, startTime)
+        end = np.minimum(self.end, endTime)
+        keep = end > start
+        ids = [i for (i, k) in zip(self.ids, keep) if k] if self.ids is not None else None
+        return ReservationFrame(self.resource[keep], self.resources, start[keep], end[keep],
+                                self.reservedTo[keep], self.users, ids)
+
+    def __groups(self, by, models=None):
+        """Return (codes, labels) for a group-by key."""
+        if by == "resource":
+            return self.resource, self.resources
+        if by == "reservedTo":
+            return self.reservedTo, self.users
+        if by == "model":
+            if models is None:
+                raise Exception("models (resourceId -> model) is required to group by model.")
+            modelCodes, modelNames = encode([models.get(r, "unknown") for r in self.resources])
+            return (modelCodes[self.resource] if len(self.resource) else self.resource), modelNames
+        raise Exception("Unknown group '%s'. Use resource, reservedTo or model." % by)
+
+    def deviceHours(self, by="resource", models=None):
+        """
+        Total reserved device-hours per group.
+
+        Keyword Arguments:
+            by {string} -- resource, reservedTo or model. (default: {"resource"})
+            models {dict} -- resourceId -> model name, required for by="model". (default: {None})
+
+        Returns:
+            dict -- group label -> device-hours
+        """
+        codes, labels = self.__groups(by, models)
+        hours = np.bincount(codes, weights=(self.end - self.start) / HOUR, minlength=len(labels))
+        return dict(zip(labels, hours.tolist()))
+
+    def hourOfDay(self, by=None, models=None, utcOffset=0):
+        """
+        Reserved device-hours falling in each hour of the day, splitting reservations
+        exactly across hour and day boundaries.
+
+        Keyword Arguments:
+            by {string} -- Optional group: resource, reservedTo or model. (default: {None})
+            models {dict} -- resourceId -> model name, for by="model". (default: {None})
+            utcOffset {long} -- Milliseconds added to every time to shift into local time. (default: {0})
+
+        Returns:
+            ndarray -- shape (24,), or (groups, 24) with the labels when by is given.
+        """
+        bins = np.arange(24, dtype=np.int64) * HOUR
+
+        def covered(t):
+            # Time spent in each hour-of-day bin between the epoch and t, shape (n, 24).
+            t = (t + utcOffset)[:, None]
+            return (t // DAY) * HOUR + np.clip(t % DAY - bins, 0, HOUR)
+
+        perReservation = (covered(self.end) - covered(self.start)) / HOUR
+        if by is None:
+            return perReservation.sum(axis=0)
+        codes, labels = self.__groups(by, models)
+        hist = np.zeros((len(labels), 24))
+        np.add.at(hist, codes, perReservation)
+        return hist, labels
+
+    def __steps(self, mask=None):
+        """Event times and the concurrency in effect from each of them."""
+        start = self.start if mask is None else self.start[mask]
+        end = self.end if mask is None else self.end[mask]
+        times = np.concatenate([start, end])
+        deltas = np.concatenate([np.ones(len(start), np.int64), -np.ones(len(end), np.int64)])
+        order = np.lexsort((deltas, times))
+        return times[order], np.cumsum(deltas[order])
+
+    def peakConcurrency(self, by=None, models=None):
+        """
+        Most reservations active at the same moment.
+
+        Returns:
+            tuple -- (peak, time) overall, or dict of label -> (peak, time) when by is given.
+        """
+        if by is None:
+            if not len(self):
+                return (0, None)
+            times, level = self.__steps()
+            i = int(np.argmax(level))
+            return (int(level[i]), int(times[i]))
+        codes, labels = self.__groups(by, models)
+        peaks = {}
+        for code in np.unique(codes):
+            times, level = self.__steps(codes == code)
+            i = int(np.argmax(level))
+            peaks[labels[code]] = (int(level[i]), int(times[i]))
+        return peaks
+
+    def utilization(self, startTime, endTime, bucket=HOUR, devices=None):
+        """
+        Reserved device time per time bucket.
+
+        Arguments:
+            startTime {long} -- Start of the first bucket in ms.
+            endTime {long} -- End of the range in ms.
+
+        Keyword Arguments:
+            bucket {long} -- Bucket length in ms. (default: {one hour})
+            devices {int} -- Fleet size. When given, the result is the fraction of the
+                             fleet reserved instead of device-hours. (default: {None})
+
+        Returns:
+            tuple -- (bucketStarts, values) arrays.
+        """
+        edges = np.arange(startTime, endTime + bucket, bucket, dtype=np.int64)
+        edges[-1] = min(edges[-1], endTime)
+        if not len(self):
+            return edges[:-1], np.zeros(len(edges) - 1)
+        times, level = self.__steps()
+        # Integral of the concurrency step function at every event time.
+        integral = np.concatenate([[0], np.cumsum(level[:-1] * np.diff(times))]).astype(np.float64)
+        atEdges = np.interp(edges.astype(np.float64), times.astype(np.float64), integral)
+        values = np.diff(atEdges) / HOUR
+        if devices:
+            values = values / (devices * np.diff(edges) / HOUR)
+        return edges[:-1], values
+
+    def idleGaps(self, minGap=0):
+        """
+        Gaps between consecutive reservations of the same device.
+
+        Keyword Arguments:
+            minGap {long} -- Only return gaps at least this long in ms. (default: {0})
+
+        Returns:
+            dict -- "resource" (labels), "gapStart", "gapEnd" and "gapHours" columns.
+        """
+        order = np.lexsort((self.start, self.resource))
+        resource = self.resource[order]
+        start = self.start[order]
+        end = self.end[order]
+        if not len(start):
+            return {"resource": [], "gapStart": start, "gapEnd": end, "gapHours": np.zeros(0)}
+        # Group-wise running max of the end time: offset each device so the max never crosses groups.
+        offset = resource.astype(np.int64) * (int(end.max()) + 1)
+        coveredUntil = np.maximum.accumulate(end + offset) - offset
+        sameDevice = resource[1:] == resource[:-1]
+        gapStart = coveredUntil[:-1]
+        gapEnd = start[1:]
+        gap = gapEnd - gapStart
+        keep = sameDevice & (gap > 0) & (gap >= minGap)
+        return {"resource": [self.resources[c] for c in resource[1:][keep]],
+                "gapStart": gapStart[keep], "gapEnd": gapEnd[keep],
+                "gapHours": (gapEnd[keep] - gapStart[keep]) / HOUR}
+
+    def columns(self):
+        """
+        Return the reservations as a dict of decoded columns, ready for writeCSV or writeParquet.
+        """
+        return OrderedDict([("id", self.ids if self.ids is not None else list(range(len(self)))),
+                            ("resourceId", [self.resources[c] for c in self.resource]),
+                            ("startTime", self.start), ("endTime", self.end),
+                            ("reservedTo", [self.users[c] for c in self.reservedTo])])
+
+    def toCSV(self, path, columns=None):
+        writeCSV(columns if columns is not None else self.columns(), path)
+
+    def toParquet(self, path, columns=None):
+        writeParquet(columns if columns is not None else self.columns(), path)
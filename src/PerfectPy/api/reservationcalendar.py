@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from .__init__ import log
+import threading
+
+
+def reservationItems(rslt):
+    """
+    Return the reservations in a reservationList response as a list of flat dicts
+    with "id", "resourceId", "startTime", "endTime" (ms), "reservedTo" and "description",
+    whether the server answered in xml or json.
+    """
+    if not rslt:
+        return []
+    items = rslt.get("reservations", []) if isinstance(rslt, dict) else rslt
+    if isinstance(items, dict):
+        items = items.get("reservation", [])
+    if isinstance(items, dict):
+        items = [items]
+    return [normalizeReservation(r) for r in items or []]
+
+
+def normalizeReservation(reservation):
+    """
+    Flatten one reservation as returned by the server.
+    Times may come as {"millis": ..., "formatted": ...} or as plain numbers.
+    """
+    def millis(value):
+        if isinstance(value, dict):
+            value = value.get("millis")
+        return int(value) if value not in (None, "") else None
+
+    resourceId = reservation.get("resourceId")
+    if resourceId is None and isinstance(reservation.get("resource"), dict):
+        resourceId = reservation["resource"].get("id")
+    return {
+        "id": "%s" % reservation.get("id"),
+        "resourceId": resourceId,
+        "startTime": millis(reservation.get("startTime")),
+        "endTime": millis(reservation.get("endTime")),
+        "reservedTo": reservation.get("reservedTo"),
+        "description": reservation.get("description"),
+    }
+
+
+class _Node(object):
+    __slots__ = ("start", "end", "key", "value", "maxEnd", "height", "left", "right")
+
+    def __init__(self, start, end, key, value):
+        self.start = start
+        self.end = end
+        self.key = key
+        self.value = value
+        self.maxEnd = end
+        self.height = 1
+        self.left = None
+        self.right = None
+
+
+def _height(node):
+    return node.height if node else 0
+
+
+def _update(node):
+    node.height = 1 + max(_height(node.left), _height(node.right))
+    node.maxEnd = max(node.end,
+                      node.left.maxEnd if node.left else node.end,
+                      node.right.maxEnd if node.right else node.end)
+
+
+def _rotateRight(node):
+    pivot = node.left
+    node.left = pivot.right
+    pivot.right = node
+    _update(node)
+    _update(pivot)
+    return pivot
+
+
+def _rotateLeft(node):
+    pivot = node.right
+    node.right = pivot.left
+    pivot.left = node
+    _update(node)
+    _update(pivot)
+    return pivot
+
+
+def _balance(node):
+    _update(node)
+    skew = _height(node.left) - _height(node.right)
+    if skew > 1:
+        if _height(node.left.left) < _height(node.left.right):
+            node.left = _rotateLeft(node.left)
+        return _rotateRight(node)
+    if skew < -1:
+        if _height(node.right.right) < _height(node.right.left):
+            node.right = _rotateRight(node.right)
+        return _rotateLeft(node)
+    return node
+
+
+class IntervalTree(object):
+    """
+    Balanced (AVL) interval tree of half-open [start, end) intervals.
+
+    Every node keeps the largest end time of its subtree, so insert, remove and
+    "is anything overlapping" run in O(log n) and listing overlaps in O(log n + k).
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def insert(self, start, end, key, value=None):
+        """
+        Add an interval. key must be unique within the tree.
+        """
+        def insert(node):
+            if node is None:
+                return _Node(start, end, key, value)
+            if (start, key) < (node.start, node.key):
+                node.left = insert(node.left)
+            else:
+                node.right = insert(node.right)
+            return _balance(node)
+
+        self.root = insert(self.root)
+        self.size += 1
+
+    def remove(self, start, key):
+        """
+        Remove the interval added with this start and key. Returns True if it was found.
+        """
+        found = [False]
+
+        def popMin(node):
+            if node.left is None:
+                return node.right, node
+            node.left, smallest = popMin(node.left)
+            return _balance(node), smallest
+
+        def remove(node):
+            if node is None:
+                return None
+            if (start, key) < (node.start, node.key):
+                node.left = remove(node.left)
+            elif (start, key) > (node.start, node.key):
+                node.right = remove(node.right)
+            else:
+                found[0] = True
+                if node.left is None:
+                    return node.right
+                if node.right is None:
+                    return node.left
+                node.right, successor = popMin(node.right)
+                successor.left = node.left
+                successor.right = node.right
+                node = successor
+            return _balance(node)
+
+        self.root = remove(self.root)
+        if found[0]:
+            self.size -= 1
+        return found[0]
+
+    def firstOverlap(self, start, end):
+        """
+        Return one node overlapping [start, end), or None, in O(log n).
+        """
+        node = self.root
+        while node is not None and not (node.start < end and start < node.end):
+            if node.left is not None and node.left.maxEnd > start:
+                node = node.left
+            else:
+                node = node.right
+        return node
+
+    def overlapping(self, start, end):
+        """
+        Return the nodes overlapping [start, end) ordered by start.
+        """
+        found = []
+        stack = [(self.root, False)]
+        while stack:
+            node, visited = stack.pop()
+            if node is None or node.maxEnd <= start:
+                continue
+            if visited:
+                if node.start < end and start < node.end:
+                    found.append(node)
+                continue
+            if node.start < end:
+                stack.append((node.right, False))
+            stack.append((node, True))
+            stack.append((node.left, False))
+        return found
+
+    def __iter__(self):
+        stack = []
+        node = self.root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node
+            node = node.right
+
+
+class ReservationCalendar(object):
+    """
+    Per-device index of reservations for overlap, conflict and free-slot queries.
+
+    Build it from reservationList output and keep it current through
+    Reservations.calendar, which also makes createReservation refuse requests
+    that would conflict with a known reservation.
+
+        calendar = ReservationCalendar.fromReservationList(api.reservationList(startTime=now, endTime=later))
+        slot = calendar.earliestFreeWindow(pixels, duration=2 * 3600 * 1000, after=now, count=5)
+
+    All times are milliseconds since the epoch and intervals are half-open [start, end).
+    """
+
+    def __init__(self, reservations=()):
+        self.__trees = {}
+        self.__byID = {}
+        self.__lock = threading.RLock()
+        for reservation in reservations:
+            self.add(reservation)
+
+    @classmethod
+    def fromReservationList(cls, rslt):
+        """
+        Build a calendar from a reservationList response.
+        """
+        return cls(reservationItems(rslt))
+
+    def __len__(self):
+        return len(self.__byID)
+
+    def resources(self):
+        with self.__lock:
+            return [r for (r, tree) in self.__trees.items() if len(tree)]
+
+    def get(self, reservationID):
+        with self.__lock:
+            reservation = self.__byID.get("%s" % reservationID)
+            return dict(reservation) if reservation else None
+
+    def add(self, reservation):
+        """
+        Add or replace a reservation. Accepts a server reservation or a flat dict
+        as returned by reservationItems.
+        """
+        reservation = normalizeReservation(reservation)
+        if reservation["startTime"] is None or reservation["endTime"] is None or reservation["resourceId"] is None:
+            log.warn("ignoring incomplete reservation '%s'" % reservation)
+            return
+        with self.__lock:
+            self.remove(reservation["id"])
+            reservation = dict(reservation)
+            self.__byID[reservation["id"]] = reservation
+            tree = self.__trees.setdefault(reservation["resourceId"], IntervalTree())
+            tree.insert(reservation["startTime"], reservation["endTime"], reservation["id"], reservation)
+
+    def remove(self, reservationID):
+        """
+        Remove a reservation. Returns the removed reservation or None.
+        """
+        with self.__lock:
+            reservation = self.__byID.pop("%s" % reservationID, None)
+            if reservation:
+                self.__trees[reservation["resourceId"]].remove(reservation["startTime"], reservation["id"])
+            return reservation
+
+    def update(self, reservationID, startTime=None, endTime=None, reservedTo=None, description=None):
+        """
+        Change a known reservation in place. Returns the updated reservation or None.
+        """
+        with self.__lock:
+            reservation = self.remove(reservationID)
+            if reservation is None:
+                return None
+            for (name, value) in (("startTime", startTime), ("endTime", endTime),
+                                  ("reservedTo", reservedTo), ("description", description)):
+                if value:
+                    reservation[name] = int(value) if name.endswith("Time") else value
+            self.add(reservation)
+            return dict(reservation)
+
+    def overlapping(self, resourceId, start, end):
+        """
+        Return the reservations of one device overlapping [start, end), ordered by start.
+        """
+        with self.__lock:
+            tree = self.__trees.get(resourceId)
+            return [dict(n.value) for n in tree.overlapping(start, end)] if tree else []
+
+    def between(self, start, end):
+        """
+        Return the reservations of every device overlapping [start, end).
+        """
+        with self.__lock:
+            return [dict(n.value) for tree in self.__trees.values() for n in tree.overlapping(start, end)]
+
+    def isFree(self, resourceId, start, end, ignore=()):
+        """
+        True if the device has no reservation overlapping [start, end).
+        Reservation IDs in ignore are not counted.
+        """
+        with self.__lock:
+            tree = self.__trees.get(resourceId)
+            if tree is None:
+                return True
+            if not ignore:
+                return tree.firstOverlap(start, end) is None
+            return all(n.key in ignore for n in tree.overlapping(start, end))
+
+    def conflicts(self, resourceIds, start, end, ignore=()):
+        """
+        Return resourceId -> overlapping reservations for each device that is not free
+        during [start, end). An empty dict means there is no conflict.
+        """
+        found = {}
+        with self.__lock:
+            for resourceId in resourceIds:
+                if not self.isFree(resourceId, start, end, ignore):
+                    found[resourceId] = [r for r in self.overlapping(resourceId, start, end) if r["id"] not in ignore]
+        return found
+
+    def busyUntil(self, resourceId, start, end):
+        """
+        Return the earliest time from which the device could hold a window as long as
+        [start, end), or start if it is free already.
+        """
+        overlaps = self.overlapping(resourceId, start, end)
+        return max(r["endTime"] for r in overlaps) if overlaps else start
+
+    def earliestFreeWindow(self, resourceIds, duration, after, before=None, count=None):
+        """
+        Find the earliest window of the given duration in which at least count of the
+        devices are free.
+
+        Arguments:
+            resourceIds {list} -- Candidate device IDs.
+            duration {long} -- Window length in milliseconds.
+            after {long} -- The window may not start earlier than this.
+
+        Keyword Arguments:
+            before {long} -- The window must end by this time. (default: {None})
+            count {int} -- Devices needed. (default: {all of resourceIds})
+
+        Returns:
+            tuple -- (start, end, freeResourceIds) or None if no window exists.
+        """
+        resourceIds = list(resourceIds)
+        count = len(resourceIds) if count is None else count
+        if count > len(resourceIds):
+            return None
+        start = after
+        with self.__lock:
+            while before is None or start + duration <= before:
+                end = start + duration
+                free = []
+                nextStart = None
+                for resourceId in resourceIds:
+                    until = self.busyUntil(resourceId, start, end)
+                    if until == start:
+                        free.append(resourceId)
+                    elif nextStart is None or until < nextStart:
+                        nextStart = until
+                if len(free) >= count:
+                    return (start, end, free[:count])
+                if nextStart is None:
+                    return None
+                start = nextStart
+        return None
@@ -2,8 +2,11 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
-from .__init__ import APIBase, log, properParams
+from .__init__ import APIBase, log, properParams, timeMilis, runConcurrently
+from .reservationcalendar import ReservationCalendar, reservationItems
 from urllib import urlencode
+from collections import deque
+import threading
 
 
 class Reservations(APIBase):
@@ -23,6 +26,18 @@ class Reservations(APIBase):
 
     def __init__(self, securityToken, baseURL='https://mobilecloud.perfectomobile.com/services/'):
         self.initClient(securityToken, baseURL)
+        self.calendar = None
+        self.renewals = None
+
+    def loadCalendar(self, resourceIds=None, startTime=None, endTime=None, reservedTo=None, admin=False):
+        """
+        Build a ReservationCalendar from reservationList and keep it as self.calendar.
+        While a calendar is set createReservation refuses requests that conflict with it,
+        and create, update and delete keep it current.
+        """
+        self.calendar = ReservationCalendar.fromReservationList(
+            self.reservationList(resourceIds, startTime, endTime, reservedTo, admin))
+        return self.calendar
 
     def reservationList(self, resourceIds=None, startTime=None, endTime=None, reservedTo=None, admin=False, responseFormat="json"):
         """
@@ -60,6 +75,61 @@ class Reservations(APIBase):
             raise Exception("reservation list API call failed because '%s'" % e.message)
         return rslt
 
+    def iterReservations(self, startTime, endTime, window=24 * 60 * 60 * 1000, resourceIds=None, reservedTo=None, admin=False, prefetch=4):
+        """
+        Yield the reservations between startTime and endTime one at a time.
+
+        The range is split into windows that are fetched with reservationList, up to
+        prefetch windows at the same time, and yielded in time order. A reservation that
+        spans a window boundary is only yielded once. Only the prefetched windows are
+        held in memory, however long the range is.
+
+        startTime, endTime  long    range in milliseconds from midnight January 1, 1970.
+        window      long    window length in milliseconds. (default: one day)
+        resourceIds, reservedTo, admin  see reservationList.
+        prefetch    int     the most windows fetched or waiting to be yielded at once.
+
+        Yields flat reservation dicts with id, resourceId, startTime, endTime, reservedTo and description.
+        """
+        if not startTime or not endTime or window <= 0:
+            raise Exception("startTime, endTime and a positive window are required.")
+        bounds = [(s, min(s + window, endTime)) for s in range(int(startTime), int(endTime), int(window))]
+        pending = deque()
+        seen = {}
+
+        def fetch(slot, windowStart, windowEnd):
+            try:
+                slot["result"] = self.reservationList(resourceIds, windowStart, windowEnd, reservedTo, admin)
+            except Exception as e:
+                slot["error"] = e
+            slot["done"].set()
+
+        def submit():
+            windowStart, windowEnd = bounds.pop(0)
+            slot = {"done": threading.Event(), "start": windowStart}
+            t = threading.Thread(target=fetch, args=(slot, windowStart, windowEnd), name="ReservationWindow")
+            t.daemon = True
+            t.start()
+            pending.append(slot)
+
+        while bounds or pending:
+            while bounds and len(pending) < max(1, prefetch):
+                submit()
+            slot = pending.popleft()
+            slot["done"].wait()
+            if "error" in slot:
+                raise slot["error"]
+            log.debug("reservation window starting '%s' fetched" % slot["start"])
+            for reservation in reservationItems(slot.pop("result")):
+                if reservation["id"] in seen:
+                    continue
+                seen[reservation["id"]] = reservation["endTime"]
+                yield reservation
+            nextStart = pending[0]["start"] if pending else (bounds[0][0] if bounds else None)
+            if nextStart is not None:
+                for reservationID in [i for (i, end) in seen.items() if end is not None and end <= nextStart]:
+                    del seen[reservationID]
+
     def reservationInfo(self, reservationID, admin=False, responseFormat="json"):
         """
         Get reservation info for a specific reservation
@@ -118,6 +188,12 @@ class Reservations(APIBase):
         """
         if not resourceIDs or not startTime or not endTime:
             raise Exception("Missing one or more required parameters.")
+        if self.calendar is not None:
+            start = timeMilis() if int(startTime) == -1 else int(startTime)
+            conflicts = self.calendar.conflicts(resourceIDs, start, int(endTime))
+            if conflicts:
+                raise Exception("createReservation conflicts with existing reservations '%s'" %
+                                ", ".join(r["id"] for rs in conflicts.values() for r in rs))
         rslt = None
         uriStr = "reservations?operation=create"
         params = {}
@@ -138,6 +214,61 @@ class Reservations(APIBase):
             log.error("createReservation API call failed because '%s'" % e.message)
             log.debug(e.args)
             raise Exception("create reservation API call failed because '%s'" % e.message)
+        if self.calendar is not None and rslt:
+            for (reservationID, resourceID) in zip(rslt.get("reservationIds", []), resourceIDs):
+                self.calendar.add({"id": reservationID, "resourceId": resourceID, "startTime": start,
+                                   "endTime": endTime, "reservedTo": reserveTo, "description": description})
+        return rslt
+
+    def createReservations(self, resourceGroups, startTime, endTime, reserveTo=None, description=None, responseFormat="json", admin=False, maxWorkers=8, progress=None):
+        """
+        Reserve a group of devices as one unit.
+
+        Each entry of resourceGroups is sent as its own createReservation call and the calls
+        run concurrently. If any call fails, the reservations that did succeed are deleted
+        again (also concurrently) so nothing is left dangling.
+
+        resourceGroups  List    device IDs, or lists of device IDs to reserve in one call each.
+        startTime, endTime, reserveTo, description, responseFormat, admin   see createReservation.
+        maxWorkers      int     the most calls in flight at the same time.
+        progress        callable    called as progress(group, outcome, done, total) per create call.
+
+        Response:
+            {
+                "success": True,
+                "reservationIds": ["87640", "87641"],
+                "results": {"deviceA": {"success": True, "result": {...}}, ...},
+                "rolledBack": {}
+            }
+            On failure "success" is False, "reservationIds" is empty, "errors" maps each failed
+            group to its error and "rolledBack" holds the per-reservation delete results.
+        """
+        groups = [[g] if isinstance(g, basestring) else list(g) for g in resourceGroups]
+        if not groups or not all(groups):
+            raise Exception("Missing one or more required parameters.")
+        if self.calendar is not None:
+            start = timeMilis() if int(startTime) == -1 else int(startTime)
+            conflicts = self.calendar.conflicts([r for g in groups for r in g], start, int(endTime))
+            if conflicts:
+                raise Exception("createReservations conflicts with existing reservations '%s'" %
+                                ", ".join(r["id"] for rs in conflicts.values() for r in rs))
+        calls = [(",".join("%s" % r for r in g), (g, startTime, endTime, reserveTo, description, responseFormat, admin), {})
+                 for g in groups]
+        results = runConcurrently(self.createReservation, calls, maxWorkers, progress)
+        reservationIDs = [i for outcome in results.values() if outcome["success"]
+                          for i in (outcome["result"] or {}).get("reservationIds", [])]
+        errors = dict((k, o["error"]) for (k, o) in results.items() if not o["success"])
+        rslt = {"success": not errors, "reservationIds": reservationIDs, "results": results, "rolledBack": {}}
+        if errors:
+            log.error("createReservations failed for '%s', rolling back '%s'" % (", ".join(errors), ", ".join(reservationIDs)))
+            rslt["errors"] = errors
+            rslt["reservationIds"] = []
+            rslt["rolledBack"] = runConcurrently(
+                self.deleteReservation,
+                [(i, (i, "remaining", responseFormat, admin), {}) for i in reservationIDs], maxWorkers)
+            for (i, outcome) in rslt["rolledBack"].items():
+                if not outcome["success"]:
+                    log.error("could not roll back reservation '%s' because '%s'" % (i, outcome["error"]))
         return rslt
 
     def deleteReservation(self, reservationID, scope="remaining", responseFormat="json", admin=False):
@@ -170,6 +301,10 @@ class Reservations(APIBase):
             log.error("deleteReservation API call failed because '%s'" % e.message)
             log.debug(e.args)
             raise Exception("delete reservation API call failed because '%s'" % e.message)
+        if self.calendar is not None:
+            self.calendar.remove(reservationID)
+        if self.renewals is not None:
+            self.renewals.cancel(reservationID)
         return rslt
 
     def updateReservation(self, reservationID, startTime=None, endTime=None, reserveTo=None, description=None, responseFormat="json", admin=False):
@@ -210,4 +345,6 @@ class Reservations(APIBase):
         except Exception as e:
             log.error("updateReservation API call failed because '%s'" % e.message)
             raise Exception("update reservation API call failed because '%s'." % e.message)
+        if self.calendar is not None:
+            self.calendar.update(reservationID, startTime, endTime, reserveTo, description)
         return rslt
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from .__init__ import log, timeMilis
+from .reservationcalendar import ReservationCalendar, reservationItems
+import itertools
+import threading
+
+
+class ReservationStore(object):
+    """
+    Local copy of the reservations, kept in sync in the background.
+
+    load() takes a full reservationList snapshot. After that a timer only re-reads a
+    sliding window around now, where reservations actually change. Reads are answered
+    from memory and never wait on a network call. createReservation, updateReservation
+    and deleteReservation made through the store are applied locally at once and rolled
+    back if the server refuses them.
+
+        store = ReservationStore(reservations, timeMilis(plusHours=-24), timeMilis(plusHours=24 * 30))
+        store.load()
+        store.start()
+        mine = [r for r in store.all() if r["reservedTo"] == "me"]
+    """
+
+    def __init__(self, reservations, startTime, endTime, resourceIds=None, reservedTo=None, admin=False,
+                 syncInterval=60, syncBefore=60 * 60 * 1000, syncAfter=4 * 60 * 60 * 1000):
+        """
+        Arguments:
+            reservations {Reservations} -- Reservations instance used for the API calls.
+            startTime {long} -- Start of the snapshot in ms since the epoch.
+            endTime {long} -- End of the snapshot in ms since the epoch.
+
+        Keyword Arguments:
+            resourceIds, reservedTo, admin -- reservationList filters for the snapshot and every sync.
+            syncInterval {number} -- Seconds between syncs. (default: {60})
+            syncBefore {long} -- Milliseconds before now re-read by each sync. (default: {one hour})
+            syncAfter {long} -- Milliseconds after now re-read by each sync. (default: {four hours})
+        """
+        self.reservations = reservations
+        self.startTime = startTime
+        self.endTime = endTime
+        self.resourceIds = resourceIds
+        self.reservedTo = reservedTo
+        self.admin = admin
+        self.syncInterval = syncInterval
+        self.syncBefore = syncBefore
+        self.syncAfter = syncAfter
+        self.calendar = ReservationCalendar()
+        self.lastSync = None
+        self.__inflight = set()
+        # reservationID -> syncs started when a local change to it finished. Syncs
+        # that started before then may have read the old state and must skip it.
+        self.__changed = {}
+        self.__syncs = 0
+        self.__placeholders = itertools.count()
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def load(self):
+        """
+        Replace the local copy with a full reservationList snapshot.
+        """
+        syncNumber = self.__startSync()
+        items = reservationItems(self.reservations.reservationList(
+            self.resourceIds, self.startTime, self.endTime, self.reservedTo, self.admin))
+        self.__apply(items, self.startTime, self.endTime, syncNumber)
+        log.debug("reservation store loaded '%s' reservations" % len(items))
+
+    def sync(self):
+        """
+        Re-read the window around now and apply the differences.
+        """
+        now = timeMilis()
+        start, end = now - self.syncBefore, now + self.syncAfter
+        syncNumber = self.__startSync()
+        items = reservationItems(self.reservations.reservationList(
+            self.resourceIds, start, end, self.reservedTo, self.admin))
+        self.__apply(items, start, end, syncNumber)
+
+    def __startSync(self):
+        with self.__lock:
+            self.__syncs += 1
+            return self.__syncs
+
+    def __finished(self, reservationIDs):
+        """Stop tracking local changes as in flight, but keep them from syncs already running."""
+        with self.__lock:
+            for reservationID in reservationIDs:
+                self.__inflight.discard(reservationID)
+                self.__changed[reservationID] = self.__syncs
+
+    def __apply(self, items, start, end, syncNumber):
+        fresh = dict((r["id"], r) for r in items)
+        with self.__lock:
+            busy = set(self.__inflight)
+            busy.update(k for (k, n) in self.__changed.items() if n >= syncNumber)
+        for stale in self.calendar.between(start, end):
+            if stale["id"] not in fresh and stale["id"] not in busy and not stale["id"].startswith("pending-"):
+                self.calendar.remove(stale["id"])
+        for (reservationID, reservation) in fresh.items():
+            if reservationID not in busy and self.calendar.get(reservationID) != reservation:
+                self.calendar.add(reservation)
+        with self.__lock:
+            for (reservationID, n) in list(self.__changed.items()):
+                if n < syncNumber:
+                    del self.__changed[reservationID]
+        self.lastSync = timeMilis()
+
+    def get(self, reservationID):
+        return self.calendar.get(reservationID)
+
+    def all(self):
+        """
+        Return every reservation in the store ordered by start time.
+        """
+        return sorted(self.calendar.between(-1, 2 ** 62), key=lambda r: (r["startTime"], r["id"]))
+
+    def forResource(self, resourceId, startTime=0, endTime=2 ** 62):
+        return self.calendar.overlapping(resourceId, startTime, endTime)
+
+    def between(self, startTime, endTime):
+        return self.calendar.between(startTime, endTime)
+
+    def createReservation(self, resourceIDs, startTime, endTime, reserveTo=None, description=None, responseFormat="json", admin=False):
+        """
+        Create a reservation, showing it in the store before the server answers.
+        See Reservations.createReservation.
+        """
+        start = timeMilis() if int(startTime) == -1 else int(startTime)
+        conflicts = self.calendar.conflicts(resourceIDs, start, int(endTime))
+        if conflicts:
+            raise Exception("createReservation conflicts with existing reservations '%s'" %
+                            ", ".join(r["id"] for rs in conflicts.values() for r in rs))
+        placeholders = []
+        for resourceID in resourceIDs:
+            placeholder = {"id": "pending-%s" % next(self.__placeholders), "resourceId": resourceID,
+                           "startTime": start, "endTime": endTime, "reservedTo": reserveTo, "description": description}
+            self.calendar.add(placeholder)
+            placeholders.append(placeholder)
+        try:
+            rslt = self.reservations.createReservation(resourceIDs, startTime, endTime, reserveTo, description, responseFormat, admin)
+        finally:
+            for placeholder in placeholders:
+                self.calendar.remove(placeholder["id"])
+        created = []
+        for (reservationID, placeholder) in zip((rslt or {}).get("reservationIds", []), placeholders):
+            placeholder["id"] = "%s" % reservationID
+            self.calendar.add(placeholder)
+            created.append(placeholder["id"])
+        self.__finished(created)
+        return rslt
+
+    def updateReservation(self, reservationID, startTime=None, endTime=None, reserveTo=None, description=None, responseFormat="json", admin=False):
+        """
+        Update a reservation locally at once and on the server. See Reservations.updateReservation.
+        """
+        reservationID = "%s" % reservationID
+        with self.__lock:
+            self.__inflight.add(reservationID)
+        previous = self.calendar.get(reservationID)
+        self.calendar.update(reservationID, startTime, endTime, reserveTo, description)
+        try:
+            return self.reservations.updateReservation(reservationID, startTime, endTime, reserveTo, description, responseFormat, admin)
+        except Exception:
+            if previous:
+                self.calendar.add(previous)
+            raise
+        finally:
+            self.__finished([reservationID])
+
+    def deleteReservation(self, reservationID, scope="remaining", responseFormat="json", admin=False):
+        """
+        Remove a reservation locally at once and on the server. See Reservations.deleteReservation.
+        """
+        reservationID = "%s" % reservationID
+        with self.__lock:
+            self.__inflight.add(reservationID)
+        previous = self.calendar.remove(reservationID)
+        try:
+            return self.reservations.deleteReservation(reservationID, scope, responseFormat, admin)
+        except Exception:
+            if previous:
+                self.calendar.add(previous)
+            raise
+        finally:
+            self.__finished([reservationID])
+
+    def start(self):
+        """
+        Call sync() every syncInterval seconds on a background thread.
+        """
+        if self.__thread is not None:
+            return
+        self.__stop.clear()
+
+        def loop():
+            while not self.__stop.wait(self.syncInterval):
+                try:
+                    self.sync()
+                except Exception as e:
+                    log.error("reservation store sync failed because '%s'" % e.message)
+
+        self.__thread = threading.Thread(target=loop, name="ReservationStore")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        if self.__thread is None:
+            return
+        self.__stop.set()
+        self.__thread.join()
+        self.__thread = None
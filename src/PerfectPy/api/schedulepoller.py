@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from .__init__ import log, timeMilis, runConcurrently
+from .cron import scheduleFireTimes
+import threading
+
+
+def _millis(value):
+    """Times may come back from the server as {"millis": ..., "formatted": ...} or as plain numbers."""
+    if isinstance(value, dict):
+        value = value.get("millis")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _state(rslt):
+    """The part of a getExecutionInfo response that says something about the schedule."""
+    if not isinstance(rslt, dict):
+        return rslt
+    return dict((k, v) for (k, v) in rslt.items() if k != "info")
+
+
+class SchedulePoller(object):
+    """
+    Watches many scheduled executions with getExecutionInfo and reports state changes.
+
+    Each schedule is polled on its own interval: rarely while its next fire time is
+    far away, often for a while after it fires, and not at all once it has ended.
+    All polls that are due together are sent as one concurrent round.
+
+        poller = SchedulePoller(scheduler)
+        poller.onChange(lambda key, old, new: notify(key, new))
+        poller.track("PRIVATE:nightly")
+        poller.start()
+    """
+
+    def __init__(self, scheduler, minInterval=15, maxInterval=15 * 60, activeFor=10 * 60,
+                 owner=None, admin=False, maxWorkers=8):
+        """
+        Arguments:
+            scheduler {Scheduler} -- Scheduler instance used for getExecutionInfo.
+
+        Keyword Arguments:
+            minInterval {number} -- Seconds between polls while a schedule is running. (default: {15})
+            maxInterval {number} -- Longest gap between polls of a live schedule. (default: {15 minutes})
+            activeFor {number} -- Seconds after a fire time during which polling stays fast. (default: {10 minutes})
+            owner {string} -- see getExecutionInfo. (default: {None})
+            admin {bool} -- see getExecutionInfo. (default: {False})
+            maxWorkers {int} -- The most getExecutionInfo calls in flight at the same time. (default: {8})
+        """
+        self.scheduler = scheduler
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.activeFor = activeFor
+        self.owner = owner
+        self.admin = admin
+        self.maxWorkers = maxWorkers
+        self.__tracked = {}
+        self.__callbacks = []
+        self.__lock = threading.Lock()
+        self.__wake = threading.Event()
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def onChange(self, callback):
+        """
+        Register callback(scheduleKey, oldState, newState), called whenever a poll returns a
+        state different from the previous one. oldState is None on the first poll.
+        """
+        self.__callbacks.append(callback)
+
+    def track(self, scheduleKey, recurrence=None, startTime=None, endTime=None, repeatCount=None):
+        """
+        Start watching a schedule. When recurrence is not given it is read from the
+        first poll's response.
+        """
+        with self.__lock:
+            self.__tracked[scheduleKey] = {"recurrence": recurrence, "startTime": _millis(startTime), "endTime": _millis(endTime),
+                                           "repeatCount": repeatCount, "state": None, "nextPoll": 0,
+                                           "lastFire": None}
+        self.__wake.set()
+
+    def untrack(self, scheduleKey):
+        with self.__lock:
+            return self.__tracked.pop(scheduleKey, None) is not None
+
+    def state(self, scheduleKey):
+        """
+        Return the last polled state of a schedule, without a network call.
+        """
+        with self.__lock:
+            entry = self.__tracked.get(scheduleKey)
+            return entry["state"] if entry else None
+
+    def __nextPoll(self, entry, now):
+        """Milliseconds epoch of the next useful poll of a schedule."""
+        if entry["lastFire"] is not None and now - entry["lastFire"] < self.activeFor * 1000:
+            return now + self.minInterval * 1000
+        if not entry["recurrence"]:
+            return now + self.maxInterval * 1000
+        try:
+            fires = scheduleFireTimes(entry["recurrence"], entry["startTime"], entry["endTime"],
+                                      None, now, count=1)
+        except Exception as e:
+            log.warn("cannot compute fire times for '%s' because '%s'" % (entry["recurrence"], e.message))
+            return now + self.maxInterval * 1000
+        if not fires:
+            return None
+        entry["nextFire"] = fires[0]
+        return min(fires[0] + self.minInterval * 1000, now + self.maxInterval * 1000)
+
+    def pollDue(self, now=None):
+        """
+        Poll every schedule whose next poll time has come, as one concurrent round.
+
+        Returns:
+            dict -- scheduleKey -> the result map entry of its getExecutionInfo call.
+        """
+        now = timeMilis() if now is None else now
+        with self.__lock:
+            due = [k for (k, e) in self.__tracked.items() if e["nextPoll"] is not None and e["nextPoll"] <= now]
+        if not due:
+            return {}
+        calls = [(k, (k, self.owner), {"admin": self.admin}) for k in due]
+        results = runConcurrently(self.scheduler.getExecutionInfo, calls, self.maxWorkers)
+        changes = []
+        with self.__lock:
+            for (key, outcome) in results.items():
+                entry = self.__tracked.get(key)
+                if entry is None:
+                    continue
+                if not outcome["success"]:
+                    entry["nextPoll"] = now + self.minInterval * 1000
+                    continue
+                new = _state(outcome["result"])
+                if isinstance(new, dict):
+                    for name in ("recurrence", "startTime", "endTime", "repeatCount"):
+                        if not entry[name] and new.get(name):
+                            entry[name] = _millis(new[name]) if name in ("startTime", "endTime") else new[name]
+                if entry.get("nextFire") is not None and entry["nextFire"] <= now:
+                    entry["lastFire"] = entry["nextFire"]
+                if new != entry["state"]:
+                    changes.append((key, entry["state"], new))
+                    entry["state"] = new
+                entry["nextPoll"] = self.__nextPoll(entry, now)
+        for (key, old, new) in changes:
+            for callback in self.__callbacks:
+                try:
+                    callback(key, old, new)
+                except Exception as e:
+                    log.error("schedule change callback failed because '%s'" % e.message)
+        return results
+
+    def nextWake(self):
+        """
+        Return the earliest next poll time (ms) of any tracked schedule, or None.
+        """
+        with self.__lock:
+            times = [e["nextPoll"] for e in self.__tracked.values() if e["nextPoll"] is not None]
+        return min(times) if times else None
+
+    def start(self):
+        """
+        Poll on a background thread, sleeping until the next schedule is due.
+        """
+        if self.__thread is not None:
+            return
+        self.__stop.clear()
+
+        def loop():
+            while not self.__stop.is_set():
+                try:
+                    self.pollDue()
+                except Exception as e:
+                    log.error("schedule poll round failed because '%s'" % e.message)
+                wake = self.nextWake()
+                wait = self.maxInterval if wake is None else max(0.0, (wake - timeMilis()) / 1000.0)
+                self.__wake.wait(min(wait, self.maxInterval))
+                self.__wake.clear()
+
+        self.__thread = threading.Thread(target=loop, name="SchedulePoller")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        if self.__thread is None:
+            return
+        self.__stop.set()
+        self.__wake.set()
+        self.__thread.join()
+        self.__thread = None
@@ -3,10 +3,57 @@
 
 from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
 
-from .__init__ import APIBase, log
+from .__init__ import APIBase, log, properParams, runConcurrently
+from .cron import compileCron
 from urllib import urlencode
 
 
+SCHEDULE_LIMIT = 20
+_compared = ("recurrence", "scriptKey", "startTime", "endTime", "repeatCount", "description", "status")
+
+
+def scheduleKey(key):
+    """
+    Return the scheduleKey with its visibility, PRIVATE when none is given.
+    """
+    return key if ":" in key else "PRIVATE:%s" % key
+
+
+def _comparable(field, value):
+    """Value of a schedule field as compared by planReconcile. Times may come back
+    from the server as {"millis": ..., "formatted": ...} or as plain numbers."""
+    if field in ("startTime", "endTime"):
+        if isinstance(value, dict):
+            value = value.get("millis")
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            pass
+    return "%s" % value
+
+
+def scheduleItems(rslt):
+    """
+    Return the scheduled executions in a getScheduledExcutions response as a list of
+    dicts, whether the server answered in xml or json.
+    """
+    if not rslt:
+        return []
+    items = rslt
+    if isinstance(items, dict):
+        for name in ("scheduledExecutions", "schedules", "items"):
+            if name in items:
+                items = items[name]
+                break
+        else:
+            items = []
+    if isinstance(items, dict):
+        items = items.get("schedule", items.get("scheduledExecution", []))
+    if isinstance(items, dict):
+        items = [items]
+    return list(items or [])
+
+
 class Scheduler(APIBase):
     """Scheduling operations
 
@@ -45,7 +92,8 @@ class Scheduler(APIBase):
                                     execution_name is supplied by the user.
                                     The scheduled execution can be updated by its owner and by automation
                                     administrators.
-            recurrence {string} -- Cron expression.
+            recurrence {string} -- Cron expression. It is checked locally with cron.compileCron
+                                   before anything is sent.
                                    The Cron expression maker can be used for creating Cron expressions.
                                    Cron expression limitations
                                    It is not possible for run a script every second.
@@ -85,6 +133,7 @@ class Scheduler(APIBase):
         """
         if not scheduleKey or not recurrence or not scriptKey:
             raise Exception("scheduleKey, recurrence, and scriptKey are required parameters and the values are wrong.")
+        compileCron(recurrence)
         uriStr = "/schedules?operation=create"
         params = {}
         rslt = None
@@ -98,6 +147,8 @@ class Scheduler(APIBase):
             params["endTime"] = endTime
         if repeatCount:
             params["repeatCount"] = repeatCount
+        if description:
+            params["description"] = description
         if admin:
             params["admin"] = admin
         params["responseFormat"] = responseFormat
@@ -108,7 +159,7 @@ class Scheduler(APIBase):
             params.update({("param.%s" % k, v) for (k, v) in parameters})
         if securedParams:
             params.update({("securedParam.%s" % k, v) for (k, v) in securedParams})
-        uriStr += urlencode(params)
+        uriStr = properParams(uriStr, urlencode(params))
         log.debug("parameters are '%s'" % uriStr)
         try:
             rslt = self.client.send_get(uriStr)
@@ -146,7 +197,7 @@ class Scheduler(APIBase):
         if admin:
             params["admin"] = admin
         params["responseFormat"] = responseFormat
-        uriStr += urlencode(params)
+        uriStr = properParams(uriStr, urlencode(params))
         log.debug("params are '%s'" % uriStr)
         try:
             rslt = self.client.send_get(uriStr)
@@ -187,7 +238,7 @@ class Scheduler(APIBase):
         params["responseFormat"] = responseFormat
         if admin:
             params["admin"] = admin
-        uriStr += urlencode(params)
+        uriStr = properParams(uriStr, urlencode(params))
         log.debug("params are '%s'" % uriStr)
         try:
             rslt = self.client.send_get(uriStr)
@@ -221,11 +272,11 @@ class Scheduler(APIBase):
         rslt = None
         params = {}
         if owner:
-            params["owner"]
+            params["owner"] = owner
         if admin:
             params["admin"] = admin
         params["responseFormat"] = responseFormat
-        uriStr += urlencode(params)
+        uriStr = properParams(uriStr, urlencode(params))
         log.debug("params are '%s'" % uriStr)
         try:
             rslt = self.client.send_get(uriStr)
@@ -284,6 +335,7 @@ class Scheduler(APIBase):
         if owner:
             params["owner"] = owner
         if recurrence:
+            compileCron(recurrence)
             params["recurrence"] = recurrence
         if startTime:
             params["startTime"] = startTime
@@ -298,7 +350,7 @@ class Scheduler(APIBase):
         if admin:
             params["admin"] = admin
         params["responseFormat"] = responseFormat
-        uriStr += urlencode(params)
+        uriStr = properParams(uriStr, urlencode(params))
         log.debug("parameters are '%s'" % uriStr)
         try:
             rslt = self.client.send_get(uriStr)
@@ -307,3 +359,136 @@ class Scheduler(APIBase):
             log.error("updateScheduledExecution API call failed because '%s'" % e.message)
             raise Exception("update scheduled execution API call failed because '%s'" % e.message)
         return rslt
+
+    def planReconcile(self, desiredSchedules, current=None, owner=None, admin=False, prune=True):
+        """Work out the changes that turn the current scheduled executions into desiredSchedules.
+
+        Arguments:
+            desiredSchedules {list} -- dicts with scheduleKey, recurrence and scriptKey and
+                                       optionally status, startTime, endTime, repeatCount,
+                                       description and parameters (dict, used on create).
+
+        Keyword Arguments:
+            current {list} -- the current schedules. Fetched with getScheduledExcutions when None. (default: {None})
+            owner {string} -- see getScheduledExcutions. (default: {None})
+            admin {bool} -- see getScheduledExcutions. (default: {False})
+            prune {bool} -- delete current schedules that are not desired. (default: {True})
+
+        Returns:
+            dict -- "delete": keys, "update": (key, changed fields) pairs, "create": schedules,
+                    "unchanged": keys. A schedule whose status changes is deleted and created
+                    again, because status cannot be updated.
+
+        Raises:
+            Exception -- a desired schedule is invalid, a name is used twice, or the result
+                         would exceed the limit of 20 scheduled executions.
+        """
+        if current is None:
+            current = scheduleItems(self.getScheduledExcutions(owner, admin=admin))
+        existing = dict((scheduleKey(s["scheduleKey"]), s) for s in current if s.get("scheduleKey"))
+        desired = {}
+        for schedule in desiredSchedules:
+            if not schedule.get("scheduleKey") or not schedule.get("recurrence") or not schedule.get("scriptKey"):
+                raise Exception("scheduleKey, recurrence, and scriptKey are required for every desired schedule.")
+            compileCron(schedule["recurrence"])
+            key = scheduleKey(schedule["scheduleKey"])
+            if key in desired:
+                raise Exception("Schedule '%s' is listed more than once." % key)
+            desired[key] = dict(schedule, scheduleKey=key)
+        names = {}
+        for key in desired:
+            name = key.split(":", 1)[1]
+            if name in names:
+                raise Exception("Scheduled execution names must be unique: '%s' and '%s'." % (names[name], key))
+            names[name] = key
+
+        plan = {"delete": [], "update": [], "create": [], "unchanged": []}
+        for (key, schedule) in existing.items():
+            if key not in desired and prune:
+                plan["delete"].append(key)
+        for (key, schedule) in desired.items():
+            if key not in existing:
+                plan["create"].append(schedule)
+                continue
+            changes = dict((f, schedule[f]) for f in _compared
+                           if schedule.get(f) is not None
+                           and _comparable(f, schedule[f]) != _comparable(f, existing[key].get(f)))
+            if "status" in changes:
+                plan["delete"].append(key)
+                plan["create"].append(schedule)
+            elif changes:
+                plan["update"].append((key, changes))
+            else:
+                plan["unchanged"].append(key)
+
+        remaining = set(existing) - set(plan["delete"])
+        for schedule in plan["create"]:
+            name = schedule["scheduleKey"].split(":", 1)[1]
+            clash = [k for k in remaining if k.split(":", 1)[1] == name]
+            if clash:
+                raise Exception("Cannot create '%s' while '%s' keeps the same name." % (schedule["scheduleKey"], clash[0]))
+        total = len(remaining) + len(plan["create"])
+        if total > SCHEDULE_LIMIT:
+            raise Exception("Reconciling would leave %s scheduled executions, the limit is %s." % (total, SCHEDULE_LIMIT))
+        log.debug("reconcile plan is '%s'" % plan)
+        return plan
+
+    def reconcile(self, desiredSchedules, owner=None, admin=False, prune=True, dryRun=False, maxWorkers=8, progress=None):
+        """Bring the scheduled executions in line with desiredSchedules.
+
+        The current state is fetched once and the minimal plan is computed with
+        planReconcile. Deletes and updates run concurrently first, so the 20 schedule
+        limit and the unique name rule hold at every step, then the creates run
+        concurrently. Creates are skipped if any delete failed.
+
+        Arguments:
+            desiredSchedules {list} -- see planReconcile
+
+        Keyword Arguments:
+            owner {string} -- owner of the schedules, used with admin. (default: {None})
+            admin {bool} -- act as admin. (default: {False})
+            prune {bool} -- delete current schedules that are not desired. (default: {True})
+            dryRun {bool} -- only return the plan. (default: {False})
+            maxWorkers {int} -- the most calls in flight at the same time. (default: {8})
+            progress {callable} -- called as progress(key, outcome, done, total) per call. (default: {None})
+
+        Returns:
+            dict -- the plan, plus "results" mapping "delete", "update" and "create" to their
+                    per-schedule result maps and "success" when not a dry run.
+        """
+        plan = self.planReconcile(desiredSchedules, owner=owner, admin=admin, prune=prune)
+        if dryRun:
+            return plan
+        first = [("delete:%s" % key, (self.deleteScheduledExecution, (key, owner), {"admin": admin}), {})
+                 for key in plan["delete"]]
+        first += [("update:%s" % key, (self.__update, (key, changes, owner, admin), {}), {})
+                  for (key, changes) in plan["update"]]
+        results = {"delete": {}, "update": {}, "create": {}}
+        for (key, outcome) in runConcurrently(self.__call, first, maxWorkers, progress).items():
+            (kind, name) = key.split(":", 1)
+            results[kind][name] = outcome
+        if any(not o["success"] for o in results["delete"].values()):
+            log.error("skipping creates because a delete failed")
+            for schedule in plan["create"]:
+                results["create"][schedule["scheduleKey"]] = {"success": False, "error": "skipped because a delete failed"}
+        else:
+            creates = [(s["scheduleKey"], (self.__create, (s, owner, admin), {}), {}) for s in plan["create"]]
+            results["create"] = runConcurrently(self.__call, creates, maxWorkers, progress)
+        plan["results"] = results
+        plan["success"] = all(o["success"] for r in results.values() for o in r.values())
+        return plan
+
+    @staticmethod
+    def __call(func, args, kwargs):
+        return func(*args, **kwargs)
+
+    def __update(self, key, changes, owner, admin):
+        return self.updateScheduledExecution(key, owner, changes.get("recurrence"), changes.get("startTime"),
+                                             changes.get("endTime"), changes.get("repeatCount"),
+                                             changes.get("scriptKey"), changes.get("description"), "json", admin)
+
+    def __create(self, schedule, owner, admin):
+        parameters = list((schedule.get("parameters") or {}).items())
+        return self.createSchedule(schedule["scheduleKey"], schedule["recurrence"], schedule["scriptKey"],
+                                   schedule.get("status"), owner, schedule.get("startTime"), schedule.get("endTime"),
+                                   schedule.get("repeatCount"), schedule.get("description"), "json", admin, *parameters)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from PerfectPy.api.broker import BrokerClient, DeviceBroker
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+
+class _Devices(object):
+
+    def listDevices(self, **filters):
+        return {"handsets": {"handset": [{"deviceId": "A", "os": "Android"}, {"deviceId": "B", "os": "iOS"}]}}
+
+    def releaseDevice(self, deviceID, admin=False):
+        pass
+
+
+class DeviceBrokerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "broker.sock")
+        self.broker = DeviceBroker(_Devices(), self.path, pollInterval=60, leaseSeconds=1, maxWait=2)
+        self.broker.start()
+        self.broker.refresh()
+        self.client = BrokerClient(self.path)
+
+    def tearDown(self):
+        self.client.close()
+        self.broker.stop()
+        shutil.rmtree(self.dir)
+
+    def wait(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.05)
+        return condition()
+
+    def test_lease_is_renewed_and_others_are_not_blocked(self):
+        got = []
+        with self.client.lease({"os": "android"}, renewInterval=0.2) as lease:
+            waiter = threading.Thread(target=lambda: got.append(self.client.acquire({"os": "android"}, timeout=10)))
+            waiter.start()
+            self.assertTrue(self.wait(lambda: self.broker.status()["waiting"]))
+            # Longer than leaseSeconds; the heartbeat keeps the device, on the same client.
+            time.sleep(1.6)
+            self.assertEqual(self.broker.status()["leased"], ["A"])
+            self.assertFalse(got)
+        waiter.join()
+        self.assertEqual(got[0]["deviceId"], "A")
+        self.assertNotEqual(got[0]["id"], lease["id"])
+
+    def test_expired_lease_does_not_hide_the_error(self):
+        def body():
+            with self.client.lease({"os": "ios"}, renewInterval=60):
+                self.assertTrue(self.wait(lambda: not self.broker.status()["leased"]))
+                raise KeyError("from the body")
+        self.assertRaises(KeyError, body)
+
+    def test_waiter_dropped_when_its_connection_closes(self):
+        self.client.acquire({"os": "android"}, leaseSeconds=60)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        sock.sendall(json.dumps({"op": "acquire", "attributes": {"os": "android"}}).encode("utf-8") + b"\n")
+        self.assertTrue(self.wait(lambda: self.broker.status()["waiting"]))
+        sock.close()
+        self.assertTrue(self.wait(lambda: not self.broker.status()["waiting"]))
+
+    def test_wait_is_bounded(self):
+        self.client.acquire({"os": "android"}, leaseSeconds=60)
+        started = time.time()
+        self.assertRaises(Exception, self.client.acquire, {"os": "android"})
+        self.assertLess(time.time() - started, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from PerfectPy.api import runConcurrently
+import threading
+import time
+import unittest
+
+
+class RunConcurrentlyTest(unittest.TestCase):
+
+    def test_results_keep_call_order(self):
+        # Later calls finish first, the result map still follows the given order.
+        calls = [(k, (k, 0.05 - k * 0.01), {}) for k in range(5)]
+
+        def slow(k, delay):
+            time.sleep(delay)
+            return k * 10
+
+        results = runConcurrently(slow, calls, maxWorkers=5)
+        self.assertEqual(list(results), [0, 1, 2, 3, 4])
+        self.assertEqual([r["result"] for r in results.values()], [0, 10, 20, 30, 40])
+
+    def test_errors_are_captured_per_call(self):
+        def maybe(k):
+            if k % 2:
+                raise Exception("odd %s" % k)
+            return k
+
+        results = runConcurrently(maybe, [(k, (k,), {}) for k in range(4)], maxWorkers=2)
+        self.assertEqual(results[0], {"success": True, "result": 0})
+        self.assertEqual(results[1], {"success": False, "error": "odd 1"})
+        self.assertFalse(results[3]["success"])
+        self.assertTrue(results[2]["success"])
+
+    def test_bounded_workers_and_progress(self):
+        lock = threading.Lock()
+        running = [0, 0]
+        seen = []
+
+        def work(k):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+
+        def progress(key, outcome, done, total):
+            seen.append((done, total))
+
+        runConcurrently(work, [(k, (k,), {}) for k in range(12)], maxWorkers=3, progress=progress)
+        self.assertLessEqual(running[1], 3)
+        self.assertEqual(sorted(seen), [(n, 12) for n in range(1, 13)])
+
+    def test_kwargs_and_empty_calls(self):
+        self.assertEqual(runConcurrently(lambda **kw: kw, []), {})
+        results = runConcurrently(lambda a, b=0: a + b, [("x", (1,), {"b": 2})])
+        self.assertEqual(results["x"]["result"], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
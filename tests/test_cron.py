@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from PerfectPy.api.cron import compileCron, findOverlaps, scheduleFireTimes
+from datetime import datetime
+import calendar
+import unittest
+
+
+def ms(*args):
+    return calendar.timegm(datetime(*args).timetuple()) * 1000
+
+
+class CronParsingTest(unittest.TestCase):
+
+    def test_fields_expand(self):
+        cron = compileCron("0 10/20 8-10 ? * MON-FRI")
+        self.assertEqual(cron.seconds, (0,))
+        self.assertEqual(cron.minutes, (10, 30, 50))
+        self.assertEqual(cron.hours, (8, 9, 10))
+        self.assertEqual(cron.months, tuple(range(1, 13)))
+        self.assertIsNone(cron.years)
+
+    def test_ranges_wrap_and_lists(self):
+        cron = compileCron("0 0 22-2 ? JAN,MAR FRI-MON")
+        self.assertEqual(cron.hours, (0, 1, 2, 22, 23))
+        self.assertEqual(cron.months, (1, 3))
+        # Quartz counts SUN as 1, so FRI-MON is FRI, SAT, SUN, MON.
+        self.assertTrue(cron.matchesDay(2021, 1, 1))    # Friday
+        self.assertTrue(cron.matchesDay(2021, 1, 4))    # Monday
+        self.assertFalse(cron.matchesDay(2021, 1, 5))   # Tuesday
+
+    def test_compile_is_cached_and_whitespace_insensitive(self):
+        self.assertIs(compileCron("0 0 12 * * ?"), compileCron(" 0  0 12 * *   ?"))
+
+    def test_invalid_expressions(self):
+        for expression in ("0 0 12 * *",                # too few fields
+                           "* 0 12 * * ?",              # * in seconds
+                           "0 * 12 * * ?",              # * in minutes
+                           "0/1 0 12 * * ?",            # every second
+                           "0 0 12 ? * ?",              # both days ?
+                           "0 0 12 1 * MON",            # neither day ?
+                           "0 0 24 * * ?",              # hour out of range
+                           "0 0 12 * FOO ?"):           # unknown month
+            self.assertRaises(Exception, compileCron, expression)
+
+
+class CronFireTimesTest(unittest.TestCase):
+
+    def test_increments_restart_every_hour(self):
+        cron = compileCron("0 10/20 * * * ?")
+        self.assertEqual(cron.nextFireTimes(4, after=ms(2021, 3, 1, 9, 55)),
+                         [ms(2021, 3, 1, 10, 10), ms(2021, 3, 1, 10, 30), ms(2021, 3, 1, 10, 50), ms(2021, 3, 1, 11, 10)])
+
+    def test_fire_times_are_strictly_after(self):
+        cron = compileCron("0 0 12 * * ?")
+        self.assertEqual(cron.nextFireTime(ms(2021, 3, 1, 12)), ms(2021, 3, 2, 12))
+
+    def test_weekdays_skip_weekend(self):
+        cron = compileCron("0 0 8 ? * MON-FRI")
+        # Friday 2021-03-05 after 8:00, next is Monday 2021-03-08.
+        self.assertEqual(cron.nextFireTime(ms(2021, 3, 5, 9)), ms(2021, 3, 8, 8))
+
+    def test_special_days(self):
+        self.assertEqual(compileCron("0 0 0 L * ?").nextFireTime(ms(2020, 2, 1)), ms(2020, 2, 29))
+        self.assertEqual(compileCron("0 0 0 L-2 * ?").nextFireTime(ms(2021, 4, 1)), ms(2021, 4, 28))
+        # 2021-05-15 is a Saturday, the nearest weekday is Friday the 14th.
+        self.assertEqual(compileCron("0 0 0 15W * ?").nextFireTime(ms(2021, 5, 1)), ms(2021, 5, 14))
+        # Second Tuesday of June 2021, and the last Friday.
+        self.assertEqual(compileCron("0 0 0 ? * 3#2").nextFireTime(ms(2021, 6, 1)), ms(2021, 6, 8))
+        self.assertEqual(compileCron("0 0 0 ? * 6L").nextFireTime(ms(2021, 6, 1)), ms(2021, 6, 25))
+
+    def test_year_field_and_until(self):
+        cron = compileCron("0 0 0 1 1 ? 2022")
+        self.assertEqual(cron.nextFireTimes(5, after=ms(2020, 6, 1)), [ms(2022, 1, 1)])
+        self.assertEqual(cron.nextFireTimes(5, after=ms(2023, 1, 1)), [])
+        self.assertEqual(compileCron("0 0 0 * * ?").nextFireTimes(10, ms(2021, 1, 1), ms(2021, 1, 3)),
+                         [ms(2021, 1, 2), ms(2021, 1, 3)])
+
+    def test_schedule_bounds(self):
+        times = scheduleFireTimes("0 0 * * * ?", startTime=ms(2021, 1, 1, 5), repeatCount=3, after=ms(2021, 1, 1))
+        self.assertEqual(times, [ms(2021, 1, 1, 5), ms(2021, 1, 1, 6), ms(2021, 1, 1, 7)])
+        times = scheduleFireTimes("0 0 * * * ?", endTime=ms(2021, 1, 1, 2), after=ms(2021, 1, 1))
+        self.assertEqual(times, [ms(2021, 1, 1, 1), ms(2021, 1, 1, 2)])
+        self.assertRaises(Exception, scheduleFireTimes, "0 0 * * * ?", after=ms(2021, 1, 1))
+
+    def test_find_overlaps(self):
+        schedules = [{"scheduleKey": "PRIVATE:a", "recurrence": "0 0 * * * ?", "duration": 30 * 60 * 1000},
+                     {"scheduleKey": "PRIVATE:b", "recurrence": "0 15 */2 * * ?"}]
+        overlaps = findOverlaps(schedules, after=ms(2021, 1, 1), until=ms(2021, 1, 1, 4, 59))
+        self.assertEqual(overlaps, [("PRIVATE:a", ms(2021, 1, 1, 2), "PRIVATE:b", ms(2021, 1, 1, 2, 15)),
+                                    ("PRIVATE:a", ms(2021, 1, 1, 4), "PRIVATE:b", ms(2021, 1, 1, 4, 15))])
+
+
+if __name__ == "__main__":
+    unittest.main()
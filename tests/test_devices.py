@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from PerfectPy.api.devices import DeviceUpdateQueue, Devices
+from urlparse import parse_qsl, urlsplit
+import threading
+import time
+import unittest
+
+
+class _Client(object):
+    """Answers the handset calls Devices makes, failing for the given devices."""
+
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def send_get(self, uri):
+        parts = urlsplit(uri)
+        deviceID = parts.path.split("/handsets/", 1)[1]
+        query = dict(parse_qsl(parts.query))
+        with self.lock:
+            self.calls.append((deviceID, query))
+        if deviceID in self.failing:
+            raise Exception("no such device")
+        return {"status": "success"}
+
+
+class BulkDevicesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.devices = Devices("token")
+        self.devices.client = _Client(failing=["bad"])
+
+    def test_release_devices(self):
+        results = self.devices.releaseDevices(["a", "bad", "b"], admin=True, maxWorkers=2)
+        self.assertEqual(list(results), ["a", "bad", "b"])
+        self.assertEqual([r["success"] for r in results.values()], [True, False, True])
+        self.assertIn("no such device", results["bad"]["error"])
+        self.assertEqual(sorted(d for (d, q) in self.devices.client.calls), ["a", "b", "bad"])
+        self.assertTrue(all(q == {"operation": "release", "admin": "True"} for (d, q) in self.devices.client.calls))
+
+    def test_update_devices(self):
+        results = self.devices.updateDevices({"a": ("lab 2", None), "b": (None, ["x", "y"]), "bad": ("z", None)})
+        self.assertEqual(dict((k, r["success"]) for (k, r) in results.items()), {"a": True, "b": True, "bad": False})
+        calls = dict(self.devices.client.calls)
+        self.assertEqual(calls["a"], {"operation": "update", "description": "lab 2"})
+        self.assertEqual(calls["b"], {"operation": "update", "roles": "x,y"})
+
+
+class _Devices(object):
+    """Records updateDevices batches, failing the listed devices."""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.batches = []
+        self.sent = threading.Event()
+
+    def updateDevices(self, updates, admin=False, maxWorkers=8, progress=None):
+        self.batches.append(dict((k, (d, list(r))) for (k, (d, r)) in updates.items()))
+        self.sent.set()
+        return dict((k, {"success": False, "error": "busy"} if k in self.failing else {"success": True, "result": {}})
+                    for k in updates)
+
+
+class DeviceUpdateQueueTest(unittest.TestCase):
+
+    def test_merges_updates_to_one_device(self):
+        devices = _Devices()
+        queue = DeviceUpdateQueue(devices, window=60)
+        queue.update("a", roles=["x"])
+        queue.update("a", description="first", roles=["y", "x"])
+        queue.update("a", description="second")
+        queue.update("b", roles=["z"])
+        self.assertEqual(queue.pending(), {"a": ("second", ["x", "y"]), "b": (None, ["z"])})
+        queue.flush()
+        self.assertEqual(devices.batches, [{"a": ("second", ["x", "y"]), "b": (None, ["z"])}])
+        self.assertEqual(queue.pending(), {})
+        queue.close()
+
+    def test_flushes_when_the_window_closes(self):
+        devices = _Devices()
+        queue = DeviceUpdateQueue(devices, window=0.05)
+        queue.update("a", roles=["x"])
+        self.assertTrue(devices.sent.wait(5))
+        self.assertEqual(devices.batches, [{"a": (None, ["x"])}])
+        self.assertEqual(queue.pending(), {})
+        queue.close()
+
+    def test_close_flushes_the_rest(self):
+        devices = _Devices()
+        with DeviceUpdateQueue(devices, window=60) as queue:
+            queue.update("a", description="lab")
+        self.assertEqual(devices.batches, [{"a": ("lab", [])}])
+        self.assertRaises(Exception, queue.update, "a", description="late")
+        self.assertEqual(queue.close(), {})
+
+    def test_failed_updates_are_queued_again(self):
+        devices = _Devices(failing=["a"])
+        queue = DeviceUpdateQueue(devices, window=60, retries=2)
+        queue.update("a", description="old", roles=["x"])
+        queue.update("b", roles=["y"])
+        queue.flush()
+        self.assertEqual(queue.pending(), {"a": ("old", ["x"])})
+        # A newer update is merged over the failed one instead of being replaced by it.
+        queue.update("a", description="new", roles=["z"])
+        queue.flush()
+        self.assertEqual(devices.batches[-1], {"a": ("new", ["x", "z"])})
+        # The second failure uses up the retries and the update is dropped.
+        self.assertEqual(queue.pending(), {})
+        queue.close()
+
+    def test_timer_flush_retries_failures(self):
+        devices = _Devices(failing=["a"])
+        queue = DeviceUpdateQueue(devices, window=0.05, retries=3)
+        queue.update("a", roles=["x"])
+        deadline = time.time() + 5
+        while len(devices.batches) < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        self.assertEqual(devices.batches, [{"a": (None, ["x"])}] * 3)
+        self.assertEqual(queue.pending(), {})
+        queue.close()
+
+    def test_close_does_not_queue_failures_again(self):
+        devices = _Devices(failing=["a"])
+        queue = DeviceUpdateQueue(devices, window=60)
+        queue.update("a", roles=["x"])
+        self.assertFalse(queue.close()["a"]["success"])
+        self.assertEqual(queue.pending(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
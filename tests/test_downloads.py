@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from PerfectPy.api import APIClient
+from PerfectPy.api.reporting import Reporting
+from urlparse import parse_qsl, urlsplit
+import BaseHTTPServer
+import SocketServer
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves report attachments with optional Range support."""
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, code, body, headers=()):
+        self.send_response(code)
+        for (name, value) in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        query = dict(parse_qsl(urlsplit(self.path).query))
+        if query.get("operation") == "attachments":
+            return self.reply(200, json.dumps({"attachments": server.listing}).encode("utf-8"))
+        data = server.files.get((query.get("operation"), query.get("attachment")))
+        if data is None:
+            return self.reply(404, b'{"error": "not found"}')
+        byteRange = self.headers.get("Range")
+        server.requests.append((query.get("attachment"), byteRange))
+        if not byteRange or not server.ranges:
+            return self.reply(200, data)
+        first, last = byteRange.split("=", 1)[1].split("-")
+        if not first:
+            start, end = max(0, len(data) - int(last)), len(data) - 1
+        else:
+            start, end = int(first), min(int(last), len(data) - 1) if last else len(data) - 1
+        if start >= len(data):
+            return self.reply(416, b"", [("Content-Range", "bytes */%d" % len(data))])
+        self.reply(206, data[start:end + 1], [("Content-Range", "bytes %d-%d/%d" % (start, end, len(data)))])
+
+
+class _DownloadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = _Server(("127.0.0.1", 0), _Handler)
+        self.server.files = {}
+        self.server.listing = []
+        self.server.requests = []
+        self.server.ranges = True
+        thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.01})
+        thread.daemon = True
+        thread.start()
+        self.baseURL = "http://127.0.0.1:%d/services/" % self.server.server_address[1]
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+    def add(self, reportType, attachment, data):
+        self.server.files[(reportType, attachment)] = data
+        self.server.listing.append({"type": reportType, "path": attachment})
+
+
+class RangeRequestTest(_DownloadTestCase):
+
+    def setUp(self):
+        _DownloadTestCase.setUp(self)
+        self.data = os.urandom(10000)
+        self.add("video", "v.mp4", self.data)
+        self.client = APIClient("token", self.baseURL)
+        self.uri = "/reports/R?operation=video&attachment=v.mp4"
+
+    def test_byte_range(self):
+        info = self.client.send_get_range(self.uri, 100, 199)
+        self.assertEqual(info["body"], self.data[100:200])
+        self.assertTrue(info["partial"])
+        self.assertEqual((info["start"], info["end"], info["total"]), (100, 199, 10000))
+        self.assertEqual(self.server.requests[-1][1], "bytes=100-199")
+
+    def test_suffix_range(self):
+        info = self.client.send_get_range(self.uri, -300)
+        self.assertEqual(info["body"], self.data[-300:])
+        self.assertEqual((info["start"], info["end"]), (9700, 9999))
+
+    def test_ignored_range_is_cut_locally(self):
+        self.server.ranges = False
+        info = self.client.send_get_range(self.uri, 100, 199)
+        self.assertFalse(info["partial"])
+        self.assertEqual(info["body"], self.data[100:200])
+        self.assertEqual((info["start"], info["end"]), (100, 199))
+        self.assertEqual(self.client.send_get_range(self.uri, -10)["body"], self.data[-10:])
+
+    def test_probe_and_stream_to_file(self):
+        self.assertEqual(self.client.probe_range(self.uri), (10000, True))
+        path = os.path.join(self.dir, "tail")
+        with open(path, "wb") as f:
+            info = self.client.send_get_range(self.uri, 9000, output=f)
+        self.assertEqual(info["size"], 1000)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), self.data[9000:])
+
+
+class DownloadAttachmentTest(_DownloadTestCase):
+
+    def setUp(self):
+        _DownloadTestCase.setUp(self)
+        self.data = os.urandom(50000)
+        self.add("video", "v.mp4", self.data)
+        self.reporting = Reporting("token", self.baseURL)
+        self.dest = os.path.join(self.dir, "v.mp4")
+
+    def check(self, result):
+        with open(self.dest, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(result["size"], len(self.data))
+        self.assertEqual(result["sha256"], hashlib.sha256(self.data).hexdigest())
+        self.assertFalse(os.path.exists(self.dest + ".part"))
+
+    def test_resume_from_part_file(self):
+        with open(self.dest + ".part", "wb") as f:
+            f.write(self.data[:12345])
+        self.check(self.reporting.downloadAttachment("video", "R", "v.mp4", self.dest))
+        self.assertEqual(self.server.requests, [("v.mp4", "bytes=12345-")])
+
+    def test_resume_of_complete_part_file(self):
+        with open(self.dest + ".part", "wb") as f:
+            f.write(self.data)
+        self.check(self.reporting.downloadAttachment("video", "R", "v.mp4", self.dest))
+
+    def test_resume_without_range_support(self):
+        self.server.ranges = False
+        with open(self.dest + ".part", "wb") as f:
+            f.write(self.data[:777])
+        self.check(self.reporting.downloadAttachment("video", "R", "v.mp4", self.dest))
+
+    def test_no_resume_starts_over(self):
+        with open(self.dest + ".part", "wb") as f:
+            f.write(b"garbage")
+        self.check(self.reporting.downloadAttachment("video", "R", "v.mp4", self.dest, resume=False))
+        self.assertEqual(self.server.requests, [("v.mp4", None)])
+
+    def test_segments(self):
+        self.check(self.reporting.downloadAttachment("video", "R", "v.mp4", self.dest, segments=4, minSegmentSize=1000))
+        ranges = sorted(r for (a, r) in self.server.requests if r != "bytes=0-0")
+        self.assertEqual(ranges, ["bytes=0-12499", "bytes=12500-24999", "bytes=25000-37499", "bytes=37500-49999"])
+
+    def test_missing_attachment_leaves_nothing(self):
+        self.assertRaises(Exception, self.reporting.downloadAttachment, "video", "R", "nope.mp4", self.dest)
+        self.assertEqual(os.listdir(self.dir), [])
+
+
+class DownloadAllAttachmentsTest(_DownloadTestCase):
+
+    def test_same_paths_and_untyped_items(self):
+        self.add("image", "shot.png", b"image one")
+        self.add("log", "shot.png", b"not an image")
+        self.server.listing.append({"type": "image", "path": "shot.png"})
+        self.server.listing.append({"path": "untyped.bin"})
+        self.add("log", "gone.txt", b"")
+        del self.server.files[("log", "gone.txt")]
+        manifest = Reporting("token", self.baseURL).downloadAllAttachments("R", self.dir, retries=1)
+        entries = manifest["attachments"]
+        self.assertEqual([(e["type"], e["attachment"], e["success"]) for e in entries],
+                         [("image", "shot.png", True), ("log", "shot.png", True), ("image", "shot.png", True),
+                          (None, "untyped.bin", False), ("log", "gone.txt", False)])
+        self.assertEqual([e.get("file") for e in entries if e["success"]],
+                         [os.path.join("image", "shot.png"), os.path.join("log", "shot.png"),
+                          os.path.join("image", "shot_1.png")])
+        self.assertEqual(entries[3]["error"], "attachment has no type")
+        with open(os.path.join(self.dir, "log", "shot.png"), "rb") as f:
+            self.assertEqual(f.read(), b"not an image")
+        with open(os.path.join(self.dir, "manifest.json")) as f:
+            self.assertEqual(json.load(f), manifest)
+        self.assertFalse(os.path.exists(os.path.join(self.dir, "other")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from PerfectPy.api.executions import Executions, executionFinished, executionItems
+from urlparse import parse_qsl, urlsplit
+import threading
+import time
+import unittest
+
+
+class _Client(object):
+    """Starts executions that finish after a number of status calls, or whose status always fails."""
+
+    def __init__(self, rounds=2, failingStart=(), failingStatus=()):
+        self.rounds = rounds
+        self.failingStart = failingStart
+        self.failingStatus = failingStatus
+        self.started = []
+        self.statusCalls = []
+        self.lock = threading.Lock()
+
+    def send_get(self, uri):
+        parts = urlsplit(uri)
+        query = dict(parse_qsl(parts.query))
+        with self.lock:
+            if query["operation"] == "execute":
+                if query["scriptKey"] in self.failingStart:
+                    raise Exception("script not found")
+                executionId = "e%d" % len(self.started)
+                self.started.append((executionId, query))
+                return {"executionId": executionId, "reportKey": "R-" + executionId}
+            executionId = parts.path.split("/executions/", 1)[1]
+            self.statusCalls.append(executionId)
+            if dict(self.started)[executionId]["scriptKey"] in self.failingStatus:
+                raise Exception("server error")
+            if self.statusCalls.count(executionId) < self.rounds:
+                return {"status": "RUNNING", "completed": "false"}
+            return {"status": "Completed", "completed": "true", "reportKey": "R-" + executionId}
+
+
+class ExecutionsTest(unittest.TestCase):
+
+    def tearDown(self):
+        # Let the poll thread notice nothing is left and exit before the interpreter does.
+        time.sleep(0.05)
+
+    def executions(self, client, **kwargs):
+        executions = Executions("token", pollInterval=0.01, **kwargs)
+        executions.client = client
+        return executions
+
+    def test_helpers(self):
+        self.assertTrue(executionFinished({"completed": True}))
+        self.assertTrue(executionFinished({"status": "ABORTED"}))
+        self.assertFalse(executionFinished({"status": "RUNNING"}))
+        self.assertFalse(executionFinished(None))
+        self.assertEqual(executionItems({"executions": {"execution": {"executionId": "1"}}}), [{"executionId": "1"}])
+        self.assertEqual(executionItems({"items": [{"a": 1}]}), [{"a": 1}])
+
+    def test_launch_and_shared_polling(self):
+        client = _Client(rounds=3, failingStart=["PRIVATE:missing.xml"])
+        executions = self.executions(client)
+        done = []
+        futures = executions.launch(["PRIVATE:a.xml", ("PRIVATE:b.xml", {"device": "X"}), "PRIVATE:missing.xml",
+                                     ("PRIVATE:c.xml", None, {"password": "p"})])
+        self.assertEqual(list(futures), [0, 1, 2, 3])
+        self.assertIn("script not found", "%s" % futures[2].exception(5))
+        futures[0].add_done_callback(done.append)
+        for i in (0, 1, 3):
+            self.assertEqual(futures[i].result(5)["completed"], "true")
+            self.assertEqual(futures[i].reportKey, "R-" + futures[i].executionId)
+        self.assertEqual(done, [futures[0]])
+        self.assertEqual(executions.pending(), 0)
+        self.assertEqual(sorted(client.statusCalls), ["e0"] * 3 + ["e1"] * 3 + ["e2"] * 3)
+        started = dict((q["scriptKey"], q) for (e, q) in client.started)
+        self.assertEqual(started["PRIVATE:b.xml"]["param.device"], "X")
+        self.assertEqual(started["PRIVATE:c.xml"]["securedParam.password"], "p")
+
+    def test_status_failures_resolve_the_future(self):
+        client = _Client(rounds=1, failingStatus=["PRIVATE:a.xml"])
+        executions = self.executions(client, maxStatusFailures=3)
+        futures = executions.launch(["PRIVATE:a.xml", "PRIVATE:b.xml"])
+        error = futures[0].exception(5)
+        self.assertIn("failed '3' times in a row", "%s" % error)
+        self.assertRaises(Exception, futures[0].result, 0)
+        self.assertEqual(futures[1].result(5)["status"], "Completed")
+        self.assertEqual(client.statusCalls.count(futures[0].executionId), 3)
+        self.assertEqual(executions.pending(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
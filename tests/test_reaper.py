@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from PerfectPy.api.reaper import AllocationReaper
+import unittest
+
+
+class _Clock(object):
+    now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class _Devices(object):
+    """Devices allocated per user, released in memory."""
+
+    def __init__(self, allocated, failing=()):
+        self.allocated = allocated
+        self.failing = failing
+        self.released = []
+
+    def listDevices(self, allocatedTo=None, admin=None):
+        return {"handsets": {"handset": [{"deviceId": d, "allocatedTo": u}
+                                         for (d, u) in sorted(self.allocated.items()) if u == allocatedTo]}}
+
+    def releaseDevices(self, deviceIDs, admin=False, maxWorkers=8, progress=None):
+        results = {}
+        for deviceID in deviceIDs:
+            if deviceID in self.failing:
+                results[deviceID] = {"success": False, "error": "busy"}
+            else:
+                self.released.append(deviceID)
+                del self.allocated[deviceID]
+                results[deviceID] = {"success": True, "result": {}}
+        return results
+
+
+class AllocationReaperTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = _Clock()
+        self.devices = _Devices({"a": "ci", "b": "ci", "c": "dev"})
+        self.metrics = []
+
+    def reaper(self, **kwargs):
+        return AllocationReaper(self.devices, ["ci", "dev"], clock=self.clock,
+                                metrics=lambda *args: self.metrics.append(args), **kwargs)
+
+    def test_idle_threshold(self):
+        reaper = self.reaper(idleMinutes={"ci": 10, "*": 60})
+        self.assertEqual(reaper.scan(), [])
+        self.clock.now = 5 * 60
+        reaper.touch("b")
+        self.clock.now = 10 * 60
+        self.assertEqual(reaper.scan(), [("a", "ci", 10.0)])
+        self.clock.now = 60 * 60
+        self.assertEqual([c[0] for c in reaper.scan()], ["a", "c", "b"])
+
+    def test_releases_idle_devices_and_reports_metrics(self):
+        self.devices.failing = ["b"]
+        reaper = self.reaper(idleMinutes=10)
+        reaper.scan()
+        self.clock.now = 15 * 60
+        rslt = reaper.reap()
+        self.assertEqual(sorted(self.devices.released), ["a", "c"])
+        self.assertEqual(rslt["recoveredDeviceMinutes"], 30.0)
+        self.assertEqual(reaper.stats, {"runs": 1, "released": 2, "failed": 1, "recoveredDeviceMinutes": 30.0})
+        tags = {"dryRun": False}
+        self.assertEqual(self.metrics, [("reaper.released", 2, tags), ("reaper.failed", 1, tags),
+                                        ("reaper.recoveredDeviceMinutes", 30.0, tags)])
+        self.assertEqual(list(reaper.allocations()), ["b"])
+
+    def test_max_release_per_run_takes_longest_idle(self):
+        reaper = self.reaper(idleMinutes=10, maxReleasePerRun=1)
+        reaper.scan()
+        self.clock.now = 5 * 60
+        reaper.touch("a")
+        reaper.touch("b")
+        self.clock.now = 20 * 60
+        reaper.reap()
+        self.assertEqual(self.devices.released, ["c"])
+
+    def test_dry_run_releases_nothing(self):
+        reaper = self.reaper(idleMinutes=10, dryRun=True)
+        reaper.scan()
+        self.clock.now = 10 * 60
+        rslt = reaper.reap()
+        self.assertEqual(self.devices.released, [])
+        self.assertEqual(len(rslt["candidates"]), 3)
+        self.assertEqual(rslt["results"], {})
+        self.assertEqual(rslt["recoveredDeviceMinutes"], 30.0)
+        self.assertEqual(reaper.stats, {"runs": 1, "released": 0, "failed": 0, "recoveredDeviceMinutes": 0.0})
+        self.assertEqual(self.metrics[0], ("reaper.released", 3, {"dryRun": True}))
+
+
+if __name__ == "__main__":
+    unittest.main()
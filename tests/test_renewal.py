@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from PerfectPy.api.renewal import RenewalScheduler, TimerWheel
+import random
+import unittest
+
+
+class TimerWheelTest(unittest.TestCase):
+
+    def test_fires_at_due_tick(self):
+        wheel = TimerWheel(resolution=1.0, slots=8, levels=2, now=0)
+        wheel.schedule("a", 3, "A")
+        wheel.schedule("b", 5)
+        self.assertEqual(len(wheel), 2)
+        self.assertEqual(wheel.advance(2), [])
+        self.assertEqual(wheel.advance(3), [("a", "A")])
+        self.assertNotIn("a", wheel)
+        self.assertEqual(wheel.advance(10), [("b", None)])
+        self.assertEqual(len(wheel), 0)
+
+    def test_past_due_fires_on_next_tick(self):
+        wheel = TimerWheel(slots=8, levels=2, now=100)
+        wheel.schedule("late", 50)
+        self.assertEqual(wheel.advance(101), [("late", None)])
+
+    def test_cancel_and_reschedule(self):
+        wheel = TimerWheel(slots=8, levels=2, now=0)
+        wheel.schedule("a", 4, 1)
+        self.assertEqual(wheel.cancel("a"), 1)
+        self.assertIsNone(wheel.cancel("a"))
+        wheel.schedule("b", 4, 1)
+        wheel.schedule("b", 40, 2)
+        self.assertEqual(wheel.advance(39), [])
+        self.assertEqual(wheel.advance(40), [("b", 2)])
+
+    def test_cascades_and_overflow(self):
+        # 8 slots x 2 levels cover 64 ticks; later timers wait in the overflow set.
+        wheel = TimerWheel(slots=8, levels=2, now=0)
+        due = {"near": 7, "level1": 20, "edge": 64, "overflow": 200, "far": 1000}
+        for (key, tick) in due.items():
+            wheel.schedule(key, tick)
+        fired = {}
+        for now in range(1, 1001):
+            for (key, value) in wheel.advance(now):
+                fired[key] = now
+        self.assertEqual(fired, due)
+
+    def test_matches_sorted_order(self):
+        rng = random.Random(7)
+        wheel = TimerWheel(resolution=0.5, slots=16, levels=3, now=0)
+        due = dict(("t%d" % i, rng.uniform(0, 3000)) for i in range(500))
+        for (key, at) in due.items():
+            wheel.schedule(key, at)
+        for key in list(due)[::5]:
+            wheel.cancel(key)
+            del due[key]
+        previous = now = 0.0
+        while len(wheel):
+            now += rng.uniform(0.1, 40)
+            for (key, value) in wheel.advance(now):
+                # Due after the previous advance and no later than this one.
+                self.assertLess(int(previous // 0.5), int(due[key] // 0.5))
+                self.assertLessEqual(int(due[key] // 0.5), int(now // 0.5))
+                del due[key]
+            previous = now
+        self.assertEqual(due, {})
+
+
+class _Reservations(object):
+    """updateReservation in memory, failing for the given reservations."""
+
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.updates = []
+
+    def updateReservation(self, reservationID, endTime=None, admin=False):
+        if reservationID in self.failing:
+            raise Exception("reservation is gone")
+        self.updates.append((reservationID, endTime))
+        return {}
+
+
+class RenewalSchedulerTest(unittest.TestCase):
+
+    def scheduler(self, reservations, **kwargs):
+        scheduler = RenewalScheduler(reservations, renewBefore=1000, extendBy=10000, batchWindow=1.0,
+                                     retries=1, **kwargs)
+        scheduler.wheel = TimerWheel(1.0, slots=8, levels=3, now=0)
+        return scheduler
+
+    def test_renews_and_reschedules(self):
+        reservations = _Reservations()
+        scheduler = self.scheduler(reservations)
+        scheduler.watch("r1", 5000, until=18000)
+        self.assertEqual(scheduler.renewDue(3), {})
+        self.assertTrue(scheduler.renewDue(4)["r1"]["success"])
+        self.assertEqual(reservations.updates, [("r1", 15000)])
+        scheduler.renewDue(14)
+        self.assertEqual(reservations.updates, [("r1", 15000), ("r1", 18000)])
+        # The final end time is reached, nothing is left to renew.
+        self.assertEqual(scheduler.watching(), 0)
+
+    def test_failing_callback_does_not_lose_the_batch(self):
+        failures = []
+
+        def onFailure(reservationID, error):
+            failures.append(reservationID)
+            raise Exception("callback broke")
+
+        reservations = _Reservations(failing=["a", "b"])
+        scheduler = self.scheduler(reservations, onFailure=onFailure)
+        for key in ("a", "b", "c", "d"):
+            scheduler.watch(key, 5000)
+        results = scheduler.renewDue(4)
+        self.assertEqual(sorted(k for (k, r) in results.items() if r["success"]), ["c", "d"])
+        self.assertEqual(sorted(failures), ["a", "b"])
+        # The successful renewals were scheduled again.
+        self.assertEqual(scheduler.watching(), 2)
+        scheduler.renewDue(14)
+        self.assertEqual(sorted(reservations.updates), [("c", 15000), ("c", 25000), ("d", 15000), ("d", 25000)])
+
+
+if __name__ == "__main__":
+    unittest.main()
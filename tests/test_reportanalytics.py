@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from PerfectPy.api.reportanalytics import ReportAnalytics, ReportFrame, extractRecords
+from PerfectPy.api.reporting import parseReport
+import math
+import shutil
+import tempfile
+import unittest
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+REPORT = b"""<report>
+  <deviceInfo deviceId="D1" model="Pixel" os="Android" osVersion="11"/>
+  <suite>
+    <test name="login" status="PASSED" duration="100">
+      <step name="open" status="passed" duration="40"/>
+      <step name="tap" status="FAILED" startTime="1000" endTime="1060"><message>not found</message></step>
+    </test>
+    <test name="skipped" status="SKIPPED"><device deviceId="D2" model="iPhone" os="iOS"/></test>
+    <test name="logout" status="FAILED">
+      <group><command name="click" status="failed" duration="5"/></group>
+    </test>
+  </suite>
+</report>"""
+
+
+class ExtractRecordsTest(unittest.TestCase):
+
+    def test_nested_report(self):
+        records = extractRecords(parseReport(REPORT), "R1")
+        tests = dict((t["test"], t) for t in records["tests"])
+        self.assertEqual(sorted(tests), ["login", "logout", "skipped"])
+        self.assertEqual(tests["login"], {"report": "R1", "test": "login", "step": "", "status": "passed",
+                                          "device": "D1", "model": "Pixel", "os": "Android 11", "duration": 100.0})
+        # A device inside the test wins over the report's.
+        self.assertEqual((tests["skipped"]["model"], tests["skipped"]["os"]), ("iPhone", "iOS"))
+        self.assertTrue(math.isnan(tests["logout"]["duration"]))
+        steps = dict((s["step"], s) for s in records["steps"])
+        self.assertEqual(sorted(steps), ["click", "open", "tap"])
+        self.assertEqual((steps["tap"]["test"], steps["tap"]["status"], steps["tap"]["duration"]), ("login", "failed", 60.0))
+        self.assertEqual(steps["tap"]["message"], "not found")
+        self.assertEqual((steps["click"]["test"], steps["click"]["model"]), ("logout", "Pixel"))
+
+    def test_empty_report(self):
+        self.assertEqual(extractRecords({}), {"tests": [], "steps": []})
+
+
+def _record(test, status, model, duration, step=""):
+    return {"report": "R", "test": test, "step": step, "status": status, "model": model, "duration": duration}
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class ReportFrameTest(unittest.TestCase):
+
+    def setUp(self):
+        self.frame = ReportFrame.fromRecords([
+            _record("a", "passed", "Pixel", 10), _record("b", "failed", "Pixel", 20),
+            _record("c", "skipped", "Pixel", 30), _record("d", "", "Pixel", float("nan")),
+            _record("a", "passed", "iPhone", 40), _record("b", "error", "iPhone", 50),
+            _record("c", "failed", "iPhone", 60), _record("e", "passed", "Galaxy", 70)])
+
+    def test_pass_rate_ignores_other_statuses(self):
+        self.assertEqual(self.frame.passRate("model"), {"Pixel": (0.5, 4), "iPhone": (1 / 3, 3), "Galaxy": (1.0, 1)})
+        self.assertEqual(self.frame.passRate(("model", "test"))[("Pixel", "c")], (0.0, 1))
+
+    def test_hotspots(self):
+        self.assertEqual(self.frame.hotspots("model"), [("iPhone", 2, 3, 2 / 3), ("Pixel", 1, 4, 0.5)])
+        self.assertEqual(self.frame.hotspots("test", top=1), [("b", 2, 2, 1.0)])
+
+    def test_percentiles(self):
+        self.assertEqual(self.frame.percentiles(q=(0, 50, 100)), [10.0, 40.0, 70.0])
+        byModel = self.frame.percentiles(by="model", q=(50,))
+        self.assertEqual(byModel, {"Pixel": [20.0], "iPhone": [50.0], "Galaxy": [70.0]})
+        self.assertIsNone(self.frame.filter(self.frame.where(test="d")).percentiles())
+
+    def test_where_and_count(self):
+        self.assertEqual(int(self.frame.where(model="Pixel", status="failed").sum()), 1)
+        self.assertFalse(self.frame.where(model="Nokia").any())
+        self.assertEqual(self.frame.count("status")["passed"], 3)
+
+    def test_save_and_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            analytics = ReportAnalytics.fromReports([("R1", parseReport(REPORT)), ("R2", parseReport(REPORT))])
+            analytics.save(directory)
+            for mmap in (True, False):
+                loaded = ReportAnalytics.load(directory, mmap=mmap)
+                self.assertEqual(len(loaded.tests), 6)
+                self.assertEqual(loaded.steps.labels("report"), analytics.steps.labels("report"))
+                self.assertEqual(loaded.tests.passRate("report"), {"R1": (0.5, 3), "R2": (0.5, 3)})
+                self.assertTrue(np.array_equal(loaded.steps.duration, analytics.steps.duration))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_from_results_skips_failures(self):
+        results = {"R1": {"success": True, "result": extractRecords(parseReport(REPORT))},
+                   "R2": {"success": False, "error": "not found"}}
+        analytics = ReportAnalytics.fromResults(results)
+        self.assertEqual(set(analytics.tests.labels("report")), set(["R1"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
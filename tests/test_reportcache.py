@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from PerfectPy.api.reportcache import ReportCache
+from PerfectPy.api.reporting import Reporting
+from io import BytesIO
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+
+def _files(directory, suffix):
+    return [name for (folder, dirs, files) in os.walk(directory) for name in files if name.endswith(suffix)]
+
+
+class ReportCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = ReportCache(os.path.join(self.dir, "cache"))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip_and_keys(self):
+        self.assertIsNone(self.cache.get("R", "download"))
+        self.cache.put(b"report" * 1000, "R", "download", format="xml/json")
+        self.assertEqual(self.cache.get("R", "download", format="xml/json"), b"report" * 1000)
+        self.assertIsNone(self.cache.get("R", "download", format="pdf/json"))
+        self.cache.put(b"a", "R", "video", "one.mp4")
+        self.assertIsNone(self.cache.get("R", "video", "two.mp4"))
+        output = BytesIO()
+        self.assertEqual(self.cache.getStream(output, "R", "video", "one.mp4"), 1)
+        self.assertEqual(output.getvalue(), b"a")
+        # Stored compressed.
+        self.assertLess(self.cache.size(), 1000)
+
+    def test_lru_eviction_by_size(self):
+        data = dict((name, os.urandom(1000)) for name in ("a", "b", "c"))
+        self.cache.maxBytes = 2500
+        self.cache.put(data["a"], "R", "image", "a")
+        self.cache.put(data["b"], "R", "image", "b")
+        os.utime(self.cache.path("R", "image", "a"), (100, 100))
+        os.utime(self.cache.path("R", "image", "b"), (200, 200))
+        # Reading a makes it the most recently used, so b goes first.
+        self.assertEqual(self.cache.get("R", "image", "a"), data["a"])
+        self.cache.put(data["c"], "R", "image", "c")
+        self.assertIsNone(self.cache.get("R", "image", "b"))
+        self.assertEqual(self.cache.get("R", "image", "a"), data["a"])
+        self.assertEqual(self.cache.get("R", "image", "c"), data["c"])
+        self.assertLessEqual(self.cache.size(), 2500)
+
+    def test_replacement_is_atomic(self):
+        class Broken(object):
+            def __init__(self):
+                self.reads = 0
+
+            def read(self, size):
+                self.reads += 1
+                if self.reads > 1:
+                    raise IOError("connection lost")
+                return b"partial"
+
+        self.cache.put(b"old", "R", "log", "l.txt")
+        self.assertRaises(IOError, self.cache.putStream, Broken(), "R", "log", "l.txt")
+        self.assertEqual(self.cache.get("R", "log", "l.txt"), b"old")
+        self.cache.put(b"new", "R", "log", "l.txt")
+        self.assertEqual(self.cache.get("R", "log", "l.txt"), b"new")
+        self.assertEqual(_files(self.cache.directory, ".tmp"), [])
+        self.assertEqual(len(_files(self.cache.directory, ".z")), 1)
+
+    def test_corrupt_entry_is_a_miss(self):
+        self.cache.put(b"data", "R", "log", "l.txt")
+        with open(self.cache.path("R", "log", "l.txt"), "wb") as f:
+            f.write(b"not zlib")
+        self.assertIsNone(self.cache.get("R", "log", "l.txt"))
+        self.assertFalse(os.path.exists(self.cache.path("R", "log", "l.txt")))
+
+    def test_clear(self):
+        self.cache.put(b"data", "R", "log", "l.txt")
+        self.cache.clear()
+        self.assertEqual(self.cache.size(), 0)
+
+
+class _Client(object):
+    """Counts the calls Reporting makes."""
+
+    def __init__(self):
+        self.calls = []
+
+    def send_get(self, uri):
+        self.calls.append(uri)
+        return {"report": "R"}
+
+    def send_get_raw(self, uri, output):
+        self.calls.append(uri)
+        output.write(b"video bytes")
+
+
+class ReportingCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.reporting = Reporting("token")
+        self.reporting.client = _Client()
+        self.reporting.cache = ReportCache(os.path.join(self.dir, "cache"))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_hit_avoids_the_network(self):
+        self.assertEqual(self.reporting.getExecutionReport("R"), {"report": "R"})
+        self.assertEqual(self.reporting.getExecutionReport("R"), {"report": "R"})
+        self.assertEqual(len(self.reporting.client.calls), 1)
+        self.reporting.getExecutionReport("R", format="pdf")
+        self.assertEqual(len(self.reporting.client.calls), 2)
+
+    def test_attachment_from_cache(self):
+        first = self.reporting.downloadAttachment("video", "R", "v.mp4", os.path.join(self.dir, "one.mp4"))
+        second = self.reporting.downloadAttachment("video", "R", "v.mp4", os.path.join(self.dir, "two.mp4"))
+        self.assertEqual(len(self.reporting.client.calls), 1)
+        self.assertEqual(second["sha256"], hashlib.sha256(b"video bytes").hexdigest())
+        self.assertEqual((first["size"], second["size"]), (11, 11))
+        with open(os.path.join(self.dir, "two.mp4"), "rb") as f:
+            self.assertEqual(f.read(), b"video bytes")
+
+
+if __name__ == "__main__":
+    unittest.main()
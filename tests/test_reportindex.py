@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from PerfectPy.api.reportanalytics import extractRecords
+from PerfectPy.api.reportindex import ReportIndex
+from PerfectPy.api.reporting import parseReport
+import unittest
+
+
+def _report(name, status, message=""):
+    return parseReport(('<report><deviceInfo deviceId="D" model="Pixel"/><test name="%s" status="%s">'
+                        '<step name="tap" status="%s"><message>%s</message></step>'
+                        '<step name="open" status="passed"/></test></report>' % (name, status, status, message))
+                       .encode("utf-8"))
+
+
+class _Executions(object):
+    """getExecutionsList over a list of executions, honouring the startTime filter."""
+
+    def __init__(self):
+        self.items = []
+        self.filters = []
+
+    def getExecutionsList(self, **filters):
+        self.filters.append(filters)
+        since = int(filters.get("startTime") or 0)
+        return {"executions": [i for i in self.items
+                               if int(i["startTime"]["millis"] if isinstance(i["startTime"], dict) else i["startTime"]) >= since]}
+
+
+class _Reporting(object):
+    """processReports run in process, failing the listed reports."""
+
+    def __init__(self, reports):
+        self.reports = reports
+        self.failing = set()
+        self.processed = []
+
+    def processReports(self, reportKeys, extractor, processes=None, maxWorkers=None, progress=None):
+        results = {}
+        for reportKey in reportKeys:
+            self.processed.append(reportKey)
+            if reportKey in self.failing:
+                results[reportKey] = {"success": False, "error": "download failed"}
+            else:
+                results[reportKey] = {"success": True, "result": extractor(self.reports[reportKey], reportKey)}
+        return results
+
+
+def _execution(executionId, startTime, status="Completed", reportKey=None):
+    return {"executionId": executionId, "startTime": startTime, "status": status, "reportKey": reportKey}
+
+
+class ReportIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.executions = _Executions()
+        self.reporting = _Reporting({"R1": _report("login", "passed"), "R2": _report("pay", "failed", "element not found"),
+                                     "R3": _report("logout", "failed", "timeout"), "R4": _report("search", "passed"),
+                                     "R5": _report("cart", "failed", "element not found on screen")})
+        self.index = ReportIndex(":memory:", self.reporting, self.executions)
+
+    def tearDown(self):
+        self.index.close()
+
+    def test_high_water_moves_forward_and_waits_for_running(self):
+        self.executions.items = [_execution("e1", 1000, reportKey="R1"),
+                                 _execution("e2", {"millis": 2000, "formatted": "x"}, status="Running"),
+                                 _execution("e3", {"millis": "3000"}, reportKey="R3")]
+        rslt = self.index.update()
+        self.assertEqual((rslt["indexed"], rslt["failed"]), (2, {}))
+        # e2 is still running, so the mark stays at its start.
+        self.assertEqual(rslt["highWater"], 2000)
+        self.assertNotIn("startTime", self.executions.filters[0])
+
+        self.executions.items[1] = _execution("e2", {"millis": 2000}, reportKey="R2")
+        rslt = self.index.update()
+        self.assertEqual(self.executions.filters[-1]["startTime"], 2000)
+        self.assertEqual((rslt["indexed"], rslt["highWater"]), (1, 3000))
+        self.assertEqual(sorted(self.reporting.processed), ["R1", "R2", "R3"])
+        self.assertTrue(self.index.indexed("R2"))
+
+        self.assertEqual(self.index.update(startTime=500)["indexed"], 0)
+        self.assertEqual(self.executions.filters[-1]["startTime"], 3000)
+
+    def test_failed_reports_hold_the_mark_back(self):
+        self.executions.items = [_execution("e3", 3000, reportKey="R3"), _execution("e4", 4000, reportKey="R4"),
+                                 _execution("e5", 5000, reportKey="R5")]
+        self.reporting.failing.add("R4")
+        rslt = self.index.update()
+        self.assertEqual((rslt["indexed"], rslt["failed"], rslt["highWater"]), (2, {"R4": "download failed"}, 4000))
+        self.reporting.failing.clear()
+        rslt = self.index.update()
+        self.assertEqual((rslt["indexed"], rslt["highWater"]), (1, 5000))
+
+    def test_add_is_idempotent(self):
+        self.assertTrue(self.index.add("R1", self.reporting.reports["R1"], startTime=10))
+        self.assertFalse(self.index.add("R1", self.reporting.reports["R1"], startTime=10))
+        self.assertTrue(self.index.add("R2", extractRecords(self.reporting.reports["R2"], "R2"), startTime=20))
+        self.assertEqual(len(self.index.search(step="open")), 2)
+
+    def test_search_and_full_text(self):
+        for (i, reportKey) in enumerate(["R1", "R2", "R3", "R5"]):
+            self.index.add(reportKey, self.reporting.reports[reportKey], "e%d" % i, 1000 * (i + 1), "Completed")
+        found = self.index.search('"element not found"')
+        self.assertEqual([(r["reportKey"], r["test"], r["startTime"]) for r in found], [("R5", "cart", 4000), ("R2", "pay", 2000)])
+        self.assertEqual(found[0]["model"], "Pixel")
+        self.assertEqual([r["reportKey"] for r in self.index.failures("timeout")], ["R3"])
+        self.assertEqual([r["reportKey"] for r in self.index.failures()], ["R5", "R3", "R2"])
+        self.assertEqual([r["reportKey"] for r in self.index.failures(since=2000, until=4000)], ["R3", "R2"])
+        self.assertEqual(len(self.index.search(step="open", limit=2)), 2)
+        self.assertEqual(self.index.search(test="login", step="tap")[0]["status"], "passed")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from PerfectPy.api.reporting import Reporting, iterXMLItems, summarizeReport
+from urlparse import urlsplit
+from io import BytesIO
+import threading
+import time
+import unittest
+
+REPORT = (b'<report id="R"><test name="login" status="passed"><step>open</step><step status="failed">tap</step></test>'
+          b'<test name="logout" status="failed"/><summary>2 tests</summary></report>')
+
+
+class _Endless(object):
+    """A document that never ends, read like a response."""
+
+    def __init__(self):
+        self.closed = False
+        self.started = False
+
+    def read(self, size=-1):
+        if not self.started:
+            self.started = True
+            return b"<report>"
+        return b"<test>x</test>" * 100
+
+    def close(self):
+        self.closed = True
+
+
+def _parsers():
+    return [t for t in threading.enumerate() if t.name == "XMLItemParser"]
+
+
+def _waitFor(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class IterXMLItemsTest(unittest.TestCase):
+
+    def test_items_in_document_order(self):
+        items = list(iterXMLItems(BytesIO(REPORT), 2))
+        self.assertEqual([path[-1][0] for (path, item) in items], ["test", "test", "summary"])
+        (path, login) = items[0]
+        self.assertEqual(path[0], ("report", {"id": "R"}))
+        self.assertEqual(login["@name"], "login")
+        self.assertEqual(login["step"][0], "open")
+        self.assertEqual(login["step"][1], {"@status": "failed", "#text": "tap"})
+        self.assertEqual(items[1][1], {"@name": "logout", "@status": "failed"})
+        self.assertEqual(items[2][1], "2 tests")
+
+    def test_names_and_depth(self):
+        steps = list(iterXMLItems(REPORT, 3, names=["step"], queueSize=1))
+        self.assertEqual([item for (path, item) in steps], ["open", {"@status": "failed", "#text": "tap"}])
+        self.assertEqual(steps[1][0][1][1]["name"], "login")
+
+    def test_closing_early_stops_the_parser(self):
+        # Parsers of finished documents exit on their own, shortly after the last item.
+        self.assertTrue(_waitFor(lambda: not _parsers()))
+        items = iterXMLItems(_Endless(), 2, queueSize=4)
+        self.assertEqual(next(items)[1], "x")
+        self.assertEqual(len(_parsers()), 1)
+        items.close()
+        self.assertTrue(_waitFor(lambda: not _parsers()))
+
+    def test_parse_error_reaches_the_consumer(self):
+        items = iterXMLItems(BytesIO(b"<report><test>a</test><test>b</oops></report>"), 2)
+        self.assertEqual(next(items)[1], "a")
+        self.assertRaises(Exception, list, items)
+
+
+class _Client(object):
+
+    def __init__(self, body):
+        self.body = body
+        self.responses = []
+
+    def send_get_stream(self, uri):
+        response = self.body() if callable(self.body) else BytesIO(self.body)
+        self.responses.append(response)
+        return response
+
+
+class IterExecutionReportTest(unittest.TestCase):
+
+    def test_yields_items_and_closes_the_response(self):
+        reporting = Reporting("token")
+        reporting.client = _Client(REPORT)
+        tests = list(reporting.iterExecutionReport("R", names=["test"]))
+        self.assertEqual([item["@name"] for (path, item) in tests], ["login", "logout"])
+        self.assertTrue(reporting.client.responses[0].closed)
+
+    def test_early_close_closes_the_response(self):
+        reporting = Reporting("token")
+        reporting.client = _Client(_Endless)
+        items = reporting.iterExecutionReport("R")
+        next(items)
+        items.close()
+        self.assertTrue(reporting.client.responses[0].closed)
+        self.assertTrue(_waitFor(lambda: not _parsers()))
+
+
+class _RawClient(object):
+    """send_get_raw answered from reportKey -> body."""
+
+    def __init__(self, bodies):
+        self.bodies = bodies
+
+    def send_get_raw(self, uri, output=None):
+        reportKey = urlsplit(uri).path.split("/reports/", 1)[1]
+        if reportKey not in self.bodies:
+            raise Exception("report '%s' not found" % reportKey)
+        return self.bodies[reportKey]
+
+
+class ProcessReportsTest(unittest.TestCase):
+
+    def test_results_keyed_by_report(self):
+        reporting = Reporting("token")
+        reporting.client = _RawClient({"R1": REPORT, "R2": b'{"test": [{"status": "passed"}]}',
+                                       "R3": b"<report><test></report>"})
+        seen = []
+        results = reporting.processReports(["R1", "R2", "R3", "R4"], summarizeReport, processes=2, maxWorkers=2,
+                                           progress=lambda key, outcome, done, total: seen.append(key))
+        self.assertEqual(list(results), ["R1", "R2", "R3", "R4"])
+        self.assertEqual(sorted(seen), ["R1", "R2", "R3", "R4"])
+        self.assertEqual(results["R1"], {"success": True, "result": {
+            "elements": {"report": 1, "test": 2, "step": 2, "summary": 1},
+            "statuses": {"test": {"passed": 1, "failed": 1}, "step": {"failed": 1}}}})
+        self.assertEqual(results["R2"]["result"]["statuses"], {"test": {"passed": 1}})
+        # A report that cannot be parsed or downloaded only fails its own entry.
+        self.assertFalse(results["R3"]["success"])
+        self.assertIn("mismatched tag", results["R3"]["error"])
+        self.assertIn("report 'R4' not found", results["R4"]["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
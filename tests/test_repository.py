@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from PerfectPy.api.repository import MANIFEST_NAME, Repository, TreeCache, csvChunks, xmlChunks
+from PerfectPy.api.xmltodict import parse
+from urlparse import parse_qsl, urlsplit
+import BaseHTTPServer
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+
+class _Client(object):
+    """In-memory repository server answering the calls Repository makes."""
+
+    def __init__(self, keys=()):
+        self.store = dict((k, b"") for k in keys)
+        self.calls = []
+        self.params = {}
+        self.lock = threading.Lock()
+
+    def __request(self, uri):
+        parts = urlsplit(uri)
+        (repository, key) = parts.path.split("repositories/", 1)[1].split("/", 1)
+        query = dict(parse_qsl(parts.query))
+        with self.lock:
+            self.calls.append((query["operation"], key))
+            self.params[key] = query
+        return key, query
+
+    def send_get(self, uri):
+        key, query = self.__request(uri)
+        with self.lock:
+            if query["operation"] == "list":
+                # One level at a time, with names relative to the listed folder.
+                names = set()
+                for k in self.store:
+                    if k.startswith(key):
+                        rest = k[len(key):]
+                        names.add(rest.split("/", 1)[0] + ("/" if "/" in rest else ""))
+                return {"items": sorted(names)}
+            if query["operation"] == "delete":
+                del self.store[key]
+                return {"status": "success"}
+        raise Exception("unexpected call '%s'" % uri)
+
+    def send_post(self, uri, data):
+        key, query = self.__request(uri)
+        with self.lock:
+            self.store[key] = data if isinstance(data, bytes) else data.read()
+        return {"status": "success"}
+
+    def lists(self):
+        return sorted(k for (op, k) in self.calls if op == "list")
+
+    def uploads(self):
+        return sorted(k for (op, k) in self.calls if op == "upload")
+
+
+class _Clock(object):
+    now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class WalkRepositoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.repo = Repository("token")
+        self.repo.client = _Client(["PUBLIC:v/a.mp4", "PUBLIC:v/d1/b.mp4", "PUBLIC:v/d1/e1/c.mp4",
+                                    "PUBLIC:v/d2/d.mp4", "PUBLIC:other/x.mp4"])
+
+    def test_walks_every_folder(self):
+        found = set(self.repo.walkRepository("media", "PUBLIC:v/", maxWorkers=3))
+        self.assertEqual(found, set(["PUBLIC:v/a.mp4", "PUBLIC:v/d1/", "PUBLIC:v/d1/b.mp4", "PUBLIC:v/d1/e1/",
+                                     "PUBLIC:v/d1/e1/c.mp4", "PUBLIC:v/d2/", "PUBLIC:v/d2/d.mp4"]))
+        self.assertEqual(self.repo.client.lists(), ["PUBLIC:v/", "PUBLIC:v/d1/", "PUBLIC:v/d1/e1/", "PUBLIC:v/d2/"])
+        files = set(self.repo.walkRepository("media", "PUBLIC:v", folders=False))
+        self.assertEqual(len(files), 4)
+
+    def test_listing_errors_are_raised(self):
+        self.repo.repositoryList = lambda *args, **kwargs: {}.pop("missing")
+        self.assertRaises(Exception, list, self.repo.walkRepository("media", "PUBLIC:v/"))
+
+    def test_tree_cache_ttl_and_invalidation(self):
+        clock = _Clock()
+        self.repo.treeCache = TreeCache(ttl=60, clock=clock)
+        first = set(self.repo.walkRepository("media", "PUBLIC:v/"))
+        self.repo.client.calls = []
+        self.assertEqual(set(self.repo.walkRepository("media", "PUBLIC:v/")), first)
+        self.assertEqual(self.repo.client.lists(), [])
+
+        # An upload into a folder that did not exist drops every listing above it.
+        self.repo.uploadItem("media", "PUBLIC:v/d1/new/f.mp4", b"x")
+        self.repo.client.calls = []
+        found = set(self.repo.walkRepository("media", "PUBLIC:v/"))
+        self.assertIn("PUBLIC:v/d1/new/f.mp4", found)
+        self.assertEqual(self.repo.client.lists(), ["PUBLIC:v/", "PUBLIC:v/d1/", "PUBLIC:v/d1/new/"])
+
+        self.repo.client.calls = []
+        clock.now += 61
+        list(self.repo.walkRepository("media", "PUBLIC:v/"))
+        self.assertEqual(len(self.repo.client.lists()), 5)
+
+    def test_tree_cache_invalidate(self):
+        cache = TreeCache()
+        for key in ("", "PRIVATE:", "PRIVATE:a/", "PRIVATE:a/b/", "PRIVATE:c/"):
+            cache.put("media", key, [])
+        cache.put("scripts", "PRIVATE:a/", [])
+        cache.invalidate("media", "PRIVATE:a/b/f.txt")
+        self.assertEqual([k for k in ("", "PRIVATE:", "PRIVATE:a/", "PRIVATE:a/b/", "PRIVATE:c/")
+                          if cache.get("media", k) is not None], ["PRIVATE:c/"])
+        self.assertEqual(cache.get("scripts", "PRIVATE:a/"), [])
+        cache.invalidate("media")
+        self.assertIsNone(cache.get("media", "PRIVATE:c/"))
+
+
+class SyncDirectoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.repo = Repository("token")
+        self.repo.client = _Client(["PRIVATE:rel/old.xml", "PRIVATE:keep.txt"])
+        self.write("a.xml", b"a")
+        self.write("sub/b.png", b"b")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, relPath, data):
+        path = os.path.join(self.dir, relPath)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def sync(self, **kwargs):
+        self.repo.client.calls = []
+        return self.repo.syncDirectory(self.dir, "media", "PRIVATE:rel", **kwargs)
+
+    def test_uploads_only_changes(self):
+        summary = self.sync(deleteOrphans=True)
+        self.assertEqual(sorted(summary["uploaded"]), ["PRIVATE:rel/a.xml", "PRIVATE:rel/sub/b.png"])
+        self.assertEqual(summary["deleted"], ["PRIVATE:rel/old.xml"])
+        self.assertEqual(summary["failed"], {})
+        self.assertEqual(self.repo.client.store["PRIVATE:rel/sub/b.png"], b"b")
+        self.assertIn("PRIVATE:keep.txt", self.repo.client.store)
+        self.assertTrue(os.path.exists(os.path.join(self.dir, MANIFEST_NAME)))
+
+        summary = self.sync(deleteOrphans=True)
+        self.assertEqual((summary["uploaded"], summary["deleted"], summary["unchanged"]), ([], [], 2))
+
+        self.write("a.xml", b"changed")
+        del self.repo.client.store["PRIVATE:rel/sub/b.png"]
+        summary = self.sync()
+        self.assertEqual(sorted(summary["uploaded"]), ["PRIVATE:rel/a.xml", "PRIVATE:rel/sub/b.png"])
+        self.assertEqual(self.repo.client.store["PRIVATE:rel/a.xml"], b"changed")
+
+    def test_dry_run_changes_nothing(self):
+        summary = self.sync(deleteOrphans=True, dryRun=True)
+        self.assertEqual(len(summary["uploaded"]), 2)
+        self.assertEqual(self.repo.client.uploads(), [])
+        self.assertIn("PRIVATE:rel/old.xml", self.repo.client.store)
+
+    def test_upload_item_properties(self):
+        self.repo.uploadItem("media", "PRIVATE:p.txt", b"x", overwrite=True, readonly="true", label="nightly")
+        params = self.repo.client.params["PRIVATE:p.txt"]
+        self.assertEqual((params["property.readonly"], params["property.label"]), ("true", "nightly"))
+        self.assertEqual(self.repo.client.store["PRIVATE:p.txt"], b"x")
+
+    def test_new_folder_with_tree_cache(self):
+        self.repo.treeCache = TreeCache(ttl=300)
+        self.sync()
+        self.write("new2/d.txt", b"d")
+        self.assertEqual(self.sync()["uploaded"], ["PRIVATE:rel/new2/d.txt"])
+        # Within the ttl the new folder is still seen, so nothing is uploaded again.
+        summary = self.sync()
+        self.assertEqual((summary["uploaded"], summary["unchanged"]), ([], 3))
+        self.assertEqual(self.repo.client.uploads(), [])
+
+
+class _CleanClient(object):
+    """Answers clean calls over (itemKey, owner, group, ageDays) items like the server does."""
+
+    def __init__(self, items):
+        self.items = list(items)
+        self.calls = []
+
+    def send_get(self, uri):
+        query = dict(parse_qsl(urlsplit(uri).query))
+        self.calls.append(query)
+        if query.get("owner") == "nobody":
+            raise Exception("no such user")
+        daysToKeep = int(query["lastModified.daysToKeep"])
+        matched = [i for i in self.items
+                   if i[3] > daysToKeep and query.get("owner") in (None, "*", i[1]) and query.get("group") in (None, "*", i[2])]
+        if query.get("dryRun") != "True":
+            self.items = [i for i in self.items if i not in matched]
+        return {"dryRun": query.get("dryRun") == "True",
+                "statistics": {"deletedItems": "%s" % len(matched), "deletedSize": 10 * len(matched)}}
+
+
+class CleanupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.repo = Repository("token")
+        self.repo.client = _CleanClient([("r1", "ann", "qa", 40), ("r2", "ann", "qa", 5), ("r3", "bob", "qa", 100),
+                                         ("r4", "bob", "dev", 20), ("r5", "cat", "dev", 8)])
+
+    def test_plan_selects_by_age_and_scope(self):
+        plan = self.repo.planCleanup([{"owner": "ann"}, {"owner": "bob", "daysToKeep": 50}, {"group": "dev"}],
+                                     itemKey="PRIVATE:", daysToKeep=10)
+        self.assertEqual(list(plan["scopes"]), ["owner=ann", "daysToKeep=50,owner=bob", "group=dev"])
+        self.assertEqual(plan["scopes"]["owner=ann"]["result"]["statistics"]["deletedItems"], "1")
+        self.assertEqual(plan["scopes"]["daysToKeep=50,owner=bob"]["result"]["statistics"]["deletedItems"], "1")
+        self.assertEqual(plan["scopes"]["group=dev"]["result"]["statistics"]["deletedItems"], "1")
+        self.assertEqual(plan["totals"], {"statistics.deletedItems": 3, "statistics.deletedSize": 30})
+        self.assertEqual(plan["failed"], [])
+        self.assertTrue(all(q["dryRun"] == "True" for q in self.repo.client.calls))
+
+    def test_dry_run_deletes_nothing(self):
+        before = list(self.repo.client.items)
+        plan = self.repo.planCleanup([{"owner": "*"}, {"owner": "nobody"}], itemKey="PRIVATE:", daysToKeep=10)
+        self.assertEqual(self.repo.client.items, before)
+        self.assertEqual(plan["failed"], ["owner=nobody"])
+        self.assertEqual(plan["totals"]["statistics.deletedItems"], 3)
+
+        self.repo.client.calls = []
+        plan = self.repo.runCleanup(plan)
+        # Only the scope whose dry run worked is cleaned.
+        self.assertEqual([q.get("owner") for q in self.repo.client.calls], ["*"])
+        self.assertNotIn("dryRun", self.repo.client.calls[0])
+        self.assertEqual(plan["cleaned"], {"statistics.deletedItems": 3, "statistics.deletedSize": 30})
+        self.assertTrue(plan["success"])
+        self.assertEqual([i[0] for i in self.repo.client.items], ["r2", "r5"])
+
+    def test_invalid_scopes(self):
+        self.assertRaises(Exception, self.repo.planCleanup, [{"owner": "ann"}], daysToKeep=10)
+        self.assertRaises(Exception, self.repo.planCleanup, [{"owner": "ann"}], itemKey="PRIVATE:")
+        self.assertRaises(Exception, self.repo.planCleanup, [{"owner": "ann"}, {"owner": "ann"}],
+                          itemKey="PRIVATE:", daysToKeep=1)
+        self.assertEqual(self.repo.client.calls, [])
+
+
+class DeleteItemsTest(unittest.TestCase):
+
+    def test_failures_stay_per_item(self):
+        repo = Repository("token")
+        repo.client = _Client(["PRIVATE:a", "PRIVATE:b"])
+        results = repo.deleteItems("media", ["PRIVATE:a", "PRIVATE:missing", "PRIVATE:b"], maxWorkers=2)
+        self.assertEqual([r["success"] for r in results.values()], [True, False, True])
+        self.assertEqual(repo.client.store, {})
+
+
+class DataTableChunksTest(unittest.TestCase):
+
+    def test_csv_header_and_rows(self):
+        rows = [{"user": "ann", "pin": 1}, {"user": "b\u00e9a, jr", "pin": None}]
+        data = b"".join(csvChunks(rows, columns=["user", "pin"]))
+        self.assertEqual(data, b'user,pin\r\nann,1\r\n"b\xc3\xa9a, jr",\r\n')
+
+    def test_csv_header_from_first_dict(self):
+        data = b"".join(csvChunks([{"a": 1}, {"a": 2, "b": 3}]))
+        self.assertEqual(data, b"a\r\n1\r\n2\r\n")
+
+    def test_csv_sequence_rows_without_header(self):
+        self.assertEqual(b"".join(csvChunks([(1, 2), (3, 4)])), b"1,2\r\n3,4\r\n")
+
+    def test_chunk_size(self):
+        rows = [("row%04d" % i, i) for i in range(1000)]
+        chunks = list(csvChunks(rows, ["name", "value"], chunkSize=1024))
+        self.assertGreater(len(chunks), 5)
+        self.assertTrue(all(len(c) < 1024 + 64 for c in chunks))
+        self.assertEqual(b"".join(chunks), b"".join(csvChunks(rows, ["name", "value"])))
+
+    def test_xml_document(self):
+        rows = [{"user": "ann", "pin": "1"}, ("b\u00e9a", "2")]
+        self.assertRaises(Exception, list, xmlChunks(rows))
+        data = b"".join(xmlChunks(rows, columns=["user", "pin"], rootElement="users", rowElement="u", chunkSize=16))
+        self.assertTrue(data.startswith(b'<?xml version="1.0" encoding="utf-8"?>\n<users>'))
+        doc = parse(data)
+        self.assertEqual([dict(u) for u in doc["users"]["u"]], [{"user": "ann", "pin": "1"}, {"user": "b\u00e9a", "pin": "2"}])
+
+    def test_xml_empty_table(self):
+        self.assertEqual(parse(b"".join(xmlChunks([]))), {"dataTable": None})
+
+
+class _Server(BaseHTTPServer.HTTPServer):
+    pass
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Records one chunked upload as it arrived on the wire."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        framing = []
+        while True:
+            size = int(self.rfile.readline().strip(), 16)
+            framing.append(size)
+            data = self.rfile.read(size + 2)
+            if not size:
+                break
+            self.server.body += data[:-2]
+        self.server.request = (self.path, dict(self.headers), framing)
+        body = json.dumps({"status": "Success"}).encode("utf-8")
+        self.send_response(self.server.status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class UploadDataTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = _Server(("127.0.0.1", 0), _Handler)
+        self.server.body = b""
+        self.server.status = 200
+        thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.01})
+        thread.daemon = True
+        thread.start()
+        self.repo = Repository("token", "http://127.0.0.1:%d/services/" % self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_csv_upload_is_chunked(self):
+        rows = ({"user": "u%d" % i, "pin": i} for i in range(2000))
+        rslt = self.repo.uploadDataTable("datatables", "PRIVATE:users.csv", rows, columns=["user", "pin"],
+                                         overwrite=True, chunkSize=4096, team="qa")
+        self.assertEqual(rslt, {"status": "Success"})
+        path, headers, framing = self.server.request
+        query = dict(parse_qsl(urlsplit(path).query))
+        self.assertTrue(urlsplit(path).path.endswith("/repositories/datatables/PRIVATE:users.csv"))
+        self.assertEqual((query["operation"], query["format"], query["overwrite"]), ("upload", "csv", "true"))
+        self.assertEqual(query["property.team"], "qa")
+        self.assertEqual(headers["transfer-encoding"], "chunked")
+        self.assertNotIn("content-length", headers)
+        self.assertGreater(len(framing), 3)
+        self.assertEqual(framing[-1], 0)
+        self.assertEqual(sum(framing), len(self.server.body))
+        lines = self.server.body.split(b"\r\n")
+        self.assertEqual((lines[0], lines[1], lines[2000]), (b"user,pin", b"u0,0", b"u1999,1999"))
+
+    def test_xml_upload(self):
+        self.repo.uploadDataTable("datatables", "PRIVATE:users.xml", [{"user": "ann"}], format="xml")
+        query = dict(parse_qsl(urlsplit(self.server.request[0]).query))
+        self.assertEqual(query["format"], "xml")
+        self.assertEqual(parse(self.server.body), {"dataTable": {"row": {"user": "ann"}}})
+
+    def test_errors(self):
+        self.assertRaises(Exception, self.repo.uploadDataTable, "datatables", "PRIVATE:t.json", [], format="json")
+        self.server.status = 500
+        self.assertRaises(Exception, self.repo.uploadDataTable, "datatables", "PRIVATE:t.csv", [(1,)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from PerfectPy.api.reservationanalytics import DAY, HOUR, ReservationFrame
+import unittest
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+D = 10 * DAY
+
+
+def reservation(reservationID, resourceId, start, end, reservedTo):
+    return {"id": reservationID, "resourceId": resourceId, "startTime": start, "endTime": end, "reservedTo": reservedTo}
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class ReservationFrameTest(unittest.TestCase):
+
+    def setUp(self):
+        # 1 crosses midnight and is followed right away by 2 on the same device.
+        self.frame = ReservationFrame.fromReservations([
+            reservation("1", "A", D - 2 * HOUR, D + 2 * HOUR, "u1"),
+            reservation("2", "A", D + 2 * HOUR, D + 3 * HOUR, "u2"),
+            reservation("3", "B", D + HOUR, D + HOUR + HOUR // 2, "u1"),
+            reservation("4", "A", D + 5 * HOUR, D + 6 * HOUR, "u1"),
+            {"id": "5", "resourceId": "C", "startTime": None, "endTime": None}])
+
+    def test_from_reservations(self):
+        self.assertEqual(len(self.frame), 4)
+        self.assertEqual(self.frame.ids, ["1", "2", "3", "4"])
+        self.assertEqual(self.frame.resources, ["A", "B"])
+        self.assertEqual(self.frame.columns()["reservedTo"], ["u1", "u2", "u1", "u1"])
+
+    def test_device_hours(self):
+        self.assertEqual(self.frame.deviceHours(), {"A": 6.0, "B": 0.5})
+        self.assertEqual(self.frame.deviceHours(by="reservedTo"), {"u1": 5.5, "u2": 1.0})
+        self.assertEqual(self.frame.deviceHours(by="model", models={"A": "Pixel", "B": "Pixel"}), {"Pixel": 6.5})
+        self.assertRaises(Exception, self.frame.deviceHours, by="model")
+
+    def test_hour_of_day_across_midnight(self):
+        expected = np.zeros(24)
+        expected[[22, 23, 0, 2, 5]] = 1.0
+        expected[1] = 1.5
+        self.assertTrue(np.allclose(self.frame.hourOfDay(), expected))
+        self.assertTrue(np.allclose(self.frame.hourOfDay(utcOffset=HOUR), np.roll(expected, 1)))
+        hist, labels = self.frame.hourOfDay(by="resource")
+        self.assertEqual(labels, ["A", "B"])
+        self.assertEqual(hist[1][1], 0.5)
+        self.assertEqual(hist[0].sum(), 6.0)
+
+    def test_peak_concurrency(self):
+        self.assertEqual(self.frame.peakConcurrency(), (2, D + HOUR))
+        # Back-to-back reservations on one device never overlap.
+        self.assertEqual(self.frame.peakConcurrency(by="resource"), {"A": (1, D - 2 * HOUR), "B": (1, D + HOUR)})
+        self.assertEqual(ReservationFrame.fromReservations([]).peakConcurrency(), (0, None))
+
+    def test_utilization(self):
+        starts, hours = self.frame.utilization(D, D + 4 * HOUR)
+        self.assertEqual(starts.tolist(), [D, D + HOUR, D + 2 * HOUR, D + 3 * HOUR])
+        self.assertTrue(np.allclose(hours, [1.0, 1.5, 1.0, 0.0]))
+        starts, fraction = self.frame.utilization(D, D + 4 * HOUR, bucket=2 * HOUR, devices=2)
+        self.assertTrue(np.allclose(fraction, [0.625, 0.25]))
+
+    def test_idle_gaps(self):
+        gaps = self.frame.idleGaps()
+        self.assertEqual(gaps["resource"], ["A"])
+        self.assertEqual((gaps["gapStart"].tolist(), gaps["gapEnd"].tolist()), ([D + 3 * HOUR], [D + 5 * HOUR]))
+        self.assertEqual(gaps["gapHours"].tolist(), [2.0])
+        self.assertEqual(self.frame.idleGaps(minGap=3 * HOUR)["resource"], [])
+
+    def test_clip(self):
+        clipped = self.frame.clip(D, D + 3 * HOUR)
+        self.assertEqual(clipped.ids, ["1", "2", "3"])
+        self.assertEqual(clipped.deviceHours(), {"A": 3.0, "B": 0.5})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from PerfectPy.api.reservationcalendar import IntervalTree, ReservationCalendar, reservationItems
+from PerfectPy.api.reservations import Reservations
+from PerfectPy.api.reservationstore import ReservationStore
+import random
+import threading
+import unittest
+
+
+def reservation(reservationID, resourceId, start, end):
+    return {"id": reservationID, "resourceId": resourceId, "startTime": start, "endTime": end}
+
+
+class IntervalTreeTest(unittest.TestCase):
+
+    def test_half_open_overlap(self):
+        tree = IntervalTree()
+        tree.insert(10, 20, "a")
+        self.assertIsNone(tree.firstOverlap(20, 30))
+        self.assertIsNone(tree.firstOverlap(0, 10))
+        self.assertEqual(tree.firstOverlap(19, 21).key, "a")
+        self.assertEqual([n.key for n in tree.overlapping(0, 100)], ["a"])
+
+    def test_matches_brute_force(self):
+        rng = random.Random(3)
+        tree = IntervalTree()
+        intervals = {}
+        for i in range(400):
+            start = rng.randint(0, 10000)
+            intervals[i] = (start, start + rng.randint(1, 500))
+            tree.insert(intervals[i][0], intervals[i][1], i)
+        for i in rng.sample(sorted(intervals), 150):
+            self.assertTrue(tree.remove(intervals[i][0], i))
+            del intervals[i]
+        self.assertFalse(tree.remove(-1, "missing"))
+        self.assertEqual(len(tree), len(intervals))
+        self.assertEqual([n.key for n in tree], sorted(intervals, key=lambda k: (intervals[k][0], k)))
+        for _ in range(300):
+            start = rng.randint(-100, 10500)
+            end = start + rng.randint(1, 800)
+            expected = sorted((s, k) for (k, (s, e)) in intervals.items() if s < end and start < e)
+            found = tree.overlapping(start, end)
+            self.assertEqual([(n.start, n.key) for n in found], expected)
+            self.assertEqual(tree.firstOverlap(start, end) is None, not expected)
+
+
+class ReservationCalendarTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calendar = ReservationCalendar([reservation("1", "A", 100, 200), reservation("2", "A", 300, 400),
+                                             reservation("3", "B", 150, 250)])
+
+    def test_normalizes_server_reservations(self):
+        items = reservationItems({"reservations": {"reservation": {
+            "id": 7, "resource": {"id": "C"}, "startTime": {"millis": "5", "formatted": "x"}, "endTime": 9}}})
+        self.assertEqual(items, [{"id": "7", "resourceId": "C", "startTime": 5, "endTime": 9,
+                                  "reservedTo": None, "description": None}])
+
+    def test_is_free_and_conflicts(self):
+        self.assertTrue(self.calendar.isFree("A", 200, 300))
+        self.assertFalse(self.calendar.isFree("A", 199, 300))
+        self.assertTrue(self.calendar.isFree("A", 199, 300, ignore=("1",)))
+        self.assertTrue(self.calendar.isFree("C", 0, 1000))
+        conflicts = self.calendar.conflicts(["A", "B", "C"], 180, 320)
+        self.assertEqual(sorted(conflicts), ["A", "B"])
+        self.assertEqual([r["id"] for r in conflicts["A"]], ["1", "2"])
+
+    def test_update_and_remove_move_the_interval(self):
+        self.calendar.update("1", startTime=500, endTime=600)
+        self.assertTrue(self.calendar.isFree("A", 100, 200))
+        self.assertFalse(self.calendar.isFree("A", 550, 560))
+        self.assertEqual(self.calendar.remove("2")["id"], "2")
+        self.assertIsNone(self.calendar.get("2"))
+        self.assertEqual(len(self.calendar), 2)
+
+    def test_earliest_free_window(self):
+        self.assertEqual(self.calendar.earliestFreeWindow(["A", "B"], 50, 100), (250, 300, ["A", "B"]))
+        self.assertEqual(self.calendar.earliestFreeWindow(["A", "B"], 100, 100), (400, 500, ["A", "B"]))
+        self.assertEqual(self.calendar.earliestFreeWindow(["A", "B"], 100, 100, count=1), (200, 300, ["A"]))
+        self.assertIsNone(self.calendar.earliestFreeWindow(["A", "B"], 100, 100, before=450))
+
+
+class _Reservations(Reservations):
+    """Reservations with the API calls answered locally."""
+
+    def __init__(self, failing=()):
+        Reservations.__init__(self, "token")
+        self.failing = failing
+        self.deleted = []
+        self.ids = iter(range(100, 200))
+        self.lock = threading.Lock()
+
+    def createReservation(self, resourceIDs, *args):
+        if set(resourceIDs) & set(self.failing):
+            raise Exception("device busy")
+        with self.lock:
+            return {"reservationIds": ["%s" % next(self.ids) for _ in resourceIDs]}
+
+    def deleteReservation(self, reservationID, *args):
+        with self.lock:
+            self.deleted.append(reservationID)
+        return {}
+
+
+class CreateReservationsTest(unittest.TestCase):
+
+    def test_all_or_nothing(self):
+        api = _Reservations()
+        rslt = api.createReservations(["A", ["B", "C"]], 1000, 2000)
+        self.assertTrue(rslt["success"])
+        self.assertEqual(len(rslt["reservationIds"]), 3)
+
+        api = _Reservations(failing=["C"])
+        rslt = api.createReservations(["A", "B", "C"], 1000, 2000)
+        self.assertFalse(rslt["success"])
+        self.assertEqual(rslt["reservationIds"], [])
+        self.assertEqual(list(rslt["errors"]), ["C"])
+        self.assertEqual(sorted(api.deleted), sorted(rslt["rolledBack"]))
+        self.assertEqual(len(api.deleted), 2)
+
+    def test_calendar_conflict_is_checked_first(self):
+        api = _Reservations()
+        api.calendar = ReservationCalendar([reservation("9", "B", 1500, 2500)])
+        self.assertRaises(Exception, api.createReservations, ["A", "B"], 1000, 2000)
+
+
+class _Windows(Reservations):
+    """Reservations whose reservationList answers from a fixed list, like the server does."""
+
+    def __init__(self, reservations, failAt=None):
+        Reservations.__init__(self, "token")
+        self.reservations = reservations
+        self.failAt = failAt
+        self.windows = []
+        self.lock = threading.Lock()
+
+    def reservationList(self, resourceIds=None, startTime=None, endTime=None, reservedTo=None, admin=False, responseFormat="json"):
+        with self.lock:
+            self.windows.append((startTime, endTime))
+        if startTime == self.failAt:
+            raise Exception("window failed")
+        return {"reservations": [r for r in self.reservations if r["startTime"] < endTime and startTime < r["endTime"]]}
+
+
+class IterReservationsTest(unittest.TestCase):
+
+    def test_window_stepping(self):
+        api = _Windows([])
+        self.assertEqual(list(api.iterReservations(1000, 1250, window=100, prefetch=2)), [])
+        self.assertEqual(sorted(api.windows), [(1000, 1100), (1100, 1200), (1200, 1250)])
+        self.assertRaises(Exception, list, api.iterReservations(1000, 2000, window=0))
+
+    def test_spanning_reservations_are_yielded_once(self):
+        api = _Windows([reservation("1", "A", 1010, 1020), reservation("2", "A", 1050, 1150),
+                        reservation("3", "B", 1090, 1390), reservation("4", "B", 1210, 1220)])
+        found = [r["id"] for r in api.iterReservations(1000, 1400, window=100)]
+        self.assertEqual(found, ["1", "2", "3", "4"])
+        self.assertEqual(len(api.windows), 4)
+
+    def test_window_error_reaches_the_caller(self):
+        api = _Windows([reservation("1", "A", 1010, 1020)], failAt=1100)
+        items = api.iterReservations(1000, 1300, window=100, prefetch=1)
+        self.assertEqual(next(items)["id"], "1")
+        self.assertRaises(Exception, next, items)
+
+
+class ReservationStoreTest(unittest.TestCase):
+
+    def test_sync_started_before_a_create_keeps_it(self):
+        listed = threading.Event()
+        release = threading.Event()
+
+        class Server(object):
+            items = []
+            gate = False
+
+            def reservationList(self, *args):
+                snapshot = {"reservations": list(self.items)}
+                if self.gate:
+                    listed.set()
+                    release.wait(5)
+                return snapshot
+
+            def createReservation(self, resourceIDs, startTime, endTime, *args):
+                self.items.append({"id": 7, "resourceId": resourceIDs[0], "startTime": startTime, "endTime": endTime})
+                return {"reservationIds": [7]}
+
+        server = Server()
+        store = ReservationStore(server, 0, 10 ** 13, syncBefore=10 ** 13, syncAfter=10 ** 13)
+        store.load()
+        server.gate = True
+        sync = threading.Thread(target=store.sync)
+        sync.start()
+        listed.wait(5)
+        store.createReservation(["A"], 10 ** 12, 10 ** 12 + 1000)
+        release.set()
+        sync.join()
+        self.assertEqual([r["id"] for r in store.all()], ["7"])
+        server.gate = False
+        store.sync()
+        self.assertEqual([r["id"] for r in store.all()], ["7"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from PerfectPy.api.schedulepoller import SchedulePoller
+from datetime import datetime
+import calendar
+import unittest
+
+HOURLY = "0 0 * * * ?"
+
+
+def ms(*args):
+    return calendar.timegm(datetime(*args).timetuple()) * 1000
+
+
+class _Scheduler(object):
+    """getExecutionInfo answered from a dict of scheduleKey -> response."""
+
+    def __init__(self, schedules):
+        self.schedules = schedules
+        self.polled = []
+
+    def getExecutionInfo(self, scheduleKey, owner=None, admin=False):
+        self.polled.append(scheduleKey)
+        if scheduleKey not in self.schedules:
+            raise Exception("no such schedule")
+        return dict(self.schedules[scheduleKey])
+
+
+class SchedulePollerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = _Scheduler({})
+        self.poller = SchedulePoller(self.scheduler, minInterval=15, maxInterval=2 * 60 * 60, activeFor=10 * 60)
+
+    def test_millis_times_from_the_server(self):
+        self.scheduler.schedules["PRIVATE:a"] = {
+            "recurrence": HOURLY, "status": "ACTIVE",
+            "startTime": {"millis": ms(2021, 1, 1), "formatted": "2021-01-01"},
+            "endTime": {"millis": "%s" % ms(2021, 2, 1), "formatted": "2021-02-01"}}
+        self.poller.track("PRIVATE:a")
+        now = ms(2021, 1, 5, 10, 0, 30)
+        self.poller.pollDue(now)
+        # Next poll just after the 11:00 fire, not the maxInterval fallback.
+        self.assertEqual(self.poller.nextWake(), ms(2021, 1, 5, 11, 0, 15))
+
+    def test_ended_schedule_is_not_polled_again(self):
+        self.scheduler.schedules["PRIVATE:a"] = {"recurrence": HOURLY, "endTime": {"millis": ms(2021, 1, 1)}}
+        self.poller.track("PRIVATE:a")
+        self.poller.pollDue(ms(2021, 1, 5))
+        self.assertIsNone(self.poller.nextWake())
+        self.assertEqual(self.poller.pollDue(ms(2022, 1, 1)), {})
+
+    def test_polls_fast_after_a_fire_and_reports_changes(self):
+        changes = []
+        self.poller.onChange(lambda key, old, new: changes.append((key, old, new)))
+        self.scheduler.schedules["PRIVATE:a"] = {"status": "ACTIVE", "info": "ignored"}
+        self.poller.track("PRIVATE:a", recurrence=HOURLY, endTime=ms(2022, 1, 1))
+        self.poller.pollDue(ms(2021, 1, 5, 10, 59))
+        self.assertEqual(self.poller.nextWake(), ms(2021, 1, 5, 11, 0, 15))
+        self.scheduler.schedules["PRIVATE:a"] = {"status": "RUNNING"}
+        self.poller.pollDue(ms(2021, 1, 5, 11, 0, 15))
+        self.assertEqual(self.poller.nextWake(), ms(2021, 1, 5, 11, 0, 30))
+        self.assertEqual(changes, [("PRIVATE:a", None, {"status": "ACTIVE"}),
+                                   ("PRIVATE:a", {"status": "ACTIVE"}, {"status": "RUNNING"})])
+        self.assertEqual(self.poller.state("PRIVATE:a"), {"status": "RUNNING"})
+        # Once activeFor has passed, polling slows down to the next fire again.
+        self.poller.pollDue(ms(2021, 1, 5, 11, 20))
+        self.assertEqual(self.poller.nextWake(), ms(2021, 1, 5, 12, 0, 15))
+
+    def test_failed_poll_is_retried_soon(self):
+        self.poller.track("PRIVATE:missing")
+        results = self.poller.pollDue(ms(2021, 1, 1))
+        self.assertFalse(results["PRIVATE:missing"]["success"])
+        self.assertEqual(self.poller.nextWake(), ms(2021, 1, 1) + 15 * 1000)
+        self.assertTrue(self.poller.untrack("PRIVATE:missing"))
+        self.assertIsNone(self.poller.nextWake())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, generators, division, absolute_import, with_statement, print_function
+from PerfectPy.api.scheduler import Scheduler, scheduleItems
+from urlparse import parse_qsl, urlsplit
+import unittest
+
+DAILY = "0 0 12 * * ?"
+HOURLY = "0 0 * * * ?"
+
+
+def schedule(name, recurrence=DAILY, script="PRIVATE:s.xml", **fields):
+    return dict(fields, scheduleKey=name, recurrence=recurrence, scriptKey=script)
+
+
+class PlanReconcileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = Scheduler("token")
+
+    def plan(self, desired, current, **kwargs):
+        return self.scheduler.planReconcile(desired, current=current, **kwargs)
+
+    def test_minimal_plan(self):
+        current = [schedule("PRIVATE:keep"), schedule("PRIVATE:change"), schedule("PRIVATE:gone")]
+        desired = [schedule("keep"), schedule("PRIVATE:change", HOURLY), schedule("PRIVATE:new")]
+        plan = self.plan(desired, current)
+        self.assertEqual(plan["unchanged"], ["PRIVATE:keep"])
+        self.assertEqual(plan["update"], [("PRIVATE:change", {"recurrence": HOURLY})])
+        self.assertEqual([s["scheduleKey"] for s in plan["create"]], ["PRIVATE:new"])
+        self.assertEqual(plan["delete"], ["PRIVATE:gone"])
+        self.assertEqual(self.plan(desired, current, prune=False)["delete"], [])
+
+    def test_status_change_recreates(self):
+        plan = self.plan([schedule("PRIVATE:a", status="INACTIVE")], [schedule("PRIVATE:a", status="ACTIVE")])
+        self.assertEqual(plan["delete"], ["PRIVATE:a"])
+        self.assertEqual([s["scheduleKey"] for s in plan["create"]], ["PRIVATE:a"])
+
+    def test_idempotent_against_server_shapes(self):
+        # Times come back as {"millis": ...} and numbers as strings.
+        current = [schedule("PRIVATE:a", startTime={"millis": 1000, "formatted": "x"}, endTime="2000",
+                            repeatCount="3", description="nightly")]
+        desired = [schedule("PRIVATE:a", startTime=1000, endTime=2000, repeatCount=3, description="nightly")]
+        plan = self.plan(desired, current)
+        self.assertEqual(plan["unchanged"], ["PRIVATE:a"])
+        plan = self.plan([dict(desired[0], startTime=1500)], current)
+        self.assertEqual(plan["update"], [("PRIVATE:a", {"startTime": 1500})])
+
+    def test_invalid_plans(self):
+        self.assertRaises(Exception, self.plan, [schedule("a", "* 0 12 * * ?")], [])
+        self.assertRaises(Exception, self.plan, [schedule("a"), schedule("PRIVATE:a")], [])
+        self.assertRaises(Exception, self.plan, [schedule("PRIVATE:a"), schedule("GROUP:a")], [])
+        self.assertRaises(Exception, self.plan, [schedule("GROUP:a")], [schedule("PRIVATE:a")], prune=False)
+        self.assertRaises(Exception, self.plan, [schedule("s%d" % i) for i in range(21)], [])
+        self.plan([schedule("GROUP:a")], [schedule("PRIVATE:a")])
+
+    def test_schedule_items_shapes(self):
+        one = schedule("PRIVATE:a")
+        self.assertEqual(scheduleItems({"scheduledExecutions": {"schedule": one}}), [one])
+        self.assertEqual(scheduleItems({"items": [one, one]}), [one, one])
+        self.assertEqual(scheduleItems(None), [])
+
+
+class ReconcileTest(unittest.TestCase):
+
+    def test_created_schedule_is_unchanged_next_time(self):
+        server = {}
+
+        class Client(object):
+            def send_get(self, uri):
+                query = dict(parse_qsl(urlsplit(uri).query))
+                if query["operation"] == "create":
+                    server[query["scheduleKey"]] = query
+                elif query["operation"] == "list":
+                    return {"scheduledExecutions": list(server.values())}
+                return {"status": "success"}
+
+        scheduler = Scheduler("token")
+        scheduler.client = Client()
+        desired = [schedule("PRIVATE:a", description="nightly run", repeatCount=5)]
+        first = scheduler.reconcile(desired)
+        self.assertTrue(first["success"])
+        self.assertEqual(server["PRIVATE:a"]["description"], "nightly run")
+        second = scheduler.reconcile(desired)
+        self.assertEqual(second["unchanged"], ["PRIVATE:a"])
+        self.assertEqual(second["update"] + second["create"] + second["delete"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()